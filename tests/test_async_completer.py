@@ -0,0 +1,112 @@
+import asyncio
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from prompt_toolkit.document import Document
+from xonsh.aliases import Aliases
+from xonsh.completers.tools import RichCompletion
+
+from xontrib_ptk_shell.async_completer import AsyncCompleter
+from xontrib_ptk_shell.completer import PromptToolkitCompleter
+
+
+class StreamingCompleter:
+    """Generates the completions of each completer, waiting for ``release``
+    before the slow one."""
+
+    def __init__(self, fast, slow):
+        self.fast = fast
+        self.slow = slow
+        self.release = threading.Event()
+        self.calls = 0
+        self.finished = False
+        self.closed = threading.Event()
+
+    def parse(self, text, cursor_index, ctx):
+        return text[:cursor_index]
+
+    def generate_completions(self, context, old_completer_args, trace):
+        self.calls += 1
+        try:
+            for name in self.fast:
+                yield RichCompletion(name, prefix_len=1), 1
+            self.release.wait(2)
+            for name in self.slow:
+                yield RichCompletion(name, prefix_len=1), 1
+            self.finished = True
+        finally:
+            self.closed.set()
+
+
+@pytest.fixture
+def completer(monkeypatch, xession):
+    monkeypatch.setattr(xession, "aliases", Aliases())
+    xession.env["COMPLETION_IN_THREAD_DEBOUNCE"] = 0.01
+    xonsh_completer = StreamingCompleter(["foo", "fob"], ["foobar"])
+    ptk_completer = PromptToolkitCompleter(xonsh_completer, None, None)
+    ptk_completer.suggestion_completion = lambda _, __: None
+    yield ptk_completer
+    xonsh_completer.release.set()
+
+
+def run(async_completer, text, requested=True, on_completion=None):
+    async def collect():
+        event = MagicMock(completion_requested=requested)
+        texts = []
+        async for comp in async_completer.get_completions_async(Document(text), event):
+            texts.append(comp.text)
+            if on_completion:
+                on_completion(texts)
+        return texts
+
+    return asyncio.run(collect())
+
+
+def test_streams_completions_while_generated(completer):
+    xonsh_completer = completer.completer
+    async_completer = AsyncCompleter(completer, lambda: Document("ls f"))
+    streamed = []
+
+    def on_completion(texts):
+        if len(texts) == 2:
+            # the slow completer did not run yet
+            streamed.extend(texts)
+            xonsh_completer.release.set()
+
+    assert run(async_completer, "ls f", on_completion=on_completion) == [
+        "fob",
+        "foo",
+        "foobar",
+    ]
+    # sorted like the cached result
+    assert streamed == ["fob", "foo"]
+    # the whole result is cached
+    assert run(async_completer, "ls f") == ["fob", "foo", "foobar"]
+    assert xonsh_completer.calls == 1
+
+
+def test_drops_completions_of_changed_text(completer):
+    xonsh_completer = completer.completer
+    document = Document("ls f")
+    async_completer = AsyncCompleter(completer, lambda: document)
+
+    def on_completion(texts):
+        nonlocal document
+        document = Document("ls fo")
+
+    texts = run(async_completer, "ls f", on_completion=on_completion)
+    assert texts == ["fob", "foo"]
+    xonsh_completer.release.set()
+    assert xonsh_completer.closed.wait(2)
+    # the completers are stopped without caching their completions
+    assert completer.cache.get("ls f", "") is None
+    assert not xonsh_completer.finished
+
+
+def test_debounces_keystrokes(completer):
+    xonsh_completer = completer.completer
+    async_completer = AsyncCompleter(completer, lambda: Document("ls fo"))
+
+    assert run(async_completer, "ls f", requested=False) == []
+    assert xonsh_completer.calls == 0
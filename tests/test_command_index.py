@@ -0,0 +1,94 @@
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from prompt_toolkit.document import Document
+from xonsh.aliases import Aliases
+from xonsh.completer import Completer
+
+from xontrib_ptk_shell.command_index import CommandIndex
+from xontrib_ptk_shell.completer import PromptToolkitCompleter
+
+
+class CommandsCache:
+    def __init__(self, commands):
+        self.commands = commands
+
+    def iter_commands(self):
+        return {
+            name: (None if is_alias else f"/usr/bin/{name}", is_alias)
+            for name, is_alias in self.commands.items()
+        }.items()
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def commands(monkeypatch, xession):
+    cache = CommandsCache({"git": False, "gitk": False, "Gimp": False, "gst": True})
+    monkeypatch.setattr(xession, "commands_cache", cache, raising=False)
+    monkeypatch.setattr(xession, "aliases", Aliases())
+    xession.env["PATH"] = ["/usr/bin"]
+    return cache
+
+
+def test_binary_search(commands, xession):
+    index = CommandIndex()
+    index.build()
+    xession.env["CASE_SENSITIVE_COMPLETIONS"] = True
+    assert index.complete("gi") == ["git", "gitk"]
+    assert index.complete("gitk") == ["gitk"]
+    assert index.complete("x") == []
+    xession.env["CASE_SENSITIVE_COMPLETIONS"] = False
+    assert index.complete("gi") == ["Gimp", "git", "gitk"]
+    assert all(comp.append_space for comp in index.complete("g"))
+    # paths and python code are left to the completers
+    assert index.complete("./gi") is None
+    assert index.complete("print(") is None
+
+
+def test_rebuilt_in_the_background(commands, xession):
+    index = CommandIndex()
+    # not built yet
+    assert index.complete("gi") is None
+    wait_for(lambda: index.complete("gi") is not None)
+    commands.commands["gitg"] = False
+    assert "gitg" not in index.complete("gi")
+    # a change of $PATH rebuilds it, meanwhile the old one is used
+    xession.env["PATH"] = ["/usr/bin", "/usr/local/bin"]
+    wait_for(lambda: "gitg" in index.complete("gi"))
+    commands.commands["gitx"] = False
+    xession.aliases["gitx"] = "git log"
+    wait_for(lambda: "gitx" in index.complete("gi"))
+    # renaming an alias is found when the index gets old
+    index.max_age = 0.1
+    del xession.aliases["gitx"]
+    commands.commands["gity"] = commands.commands.pop("gitx")
+    xession.aliases["gity"] = "git log"
+    wait_for(lambda: "gity" in index.complete("gi"))
+
+
+def test_first_word_is_completed_from_the_index(commands, xession):
+    xession.env["COMPLETION_COMMAND_INDEX"] = True
+    xession.env["CASE_SENSITIVE_COMPLETIONS"] = True
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    xonsh_completer_mock.complete.return_value = ("gitk-from-completer",), 2
+    ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    ptk_completer.suggestion_completion = lambda _, __: None
+    ptk_completer.commands.build()
+
+    def complete(text):
+        event = MagicMock(completion_requested=True)
+        return [c.text for c in ptk_completer.get_completions(Document(text), event)]
+
+    assert complete("gi") == ["git", "gitk"]
+    assert complete("git") == ["git", "gitk"]
+    assert xonsh_completer_mock.complete.call_count == 0
+    assert complete("ls gi") == ["gitk-from-completer"]
+    assert complete("./gi") == ["gitk-from-completer"]
+    assert xonsh_completer_mock.complete.call_count == 2
@@ -0,0 +1,126 @@
+from unittest.mock import MagicMock
+
+import pytest
+from prompt_toolkit.document import Document
+from xonsh.aliases import Aliases
+from xonsh.completer import Completer
+from xonsh.completers.tools import RichCompletion
+
+from xontrib_ptk_shell.completer import PromptToolkitCompleter
+from xontrib_ptk_shell.completion_cache import CacheInfo
+
+
+class FakeCompleter:
+    """Completes the words of ``names`` starting with the prefix, or always
+    returns ``result`` if it is given."""
+
+    def __init__(self, names, result=None):
+        self.names = names
+        self.result = result
+        self.calls = 0
+
+    def complete(self, prefix, *_, **__):
+        self.calls += 1
+        if self.result is not None:
+            return self.result
+        return {name for name in self.names if name.startswith(prefix)}, len(prefix)
+
+
+@pytest.fixture
+def completer(xession, monkeypatch):
+    """Sets up the completions of a ``PromptToolkitCompleter``"""
+    xession.env["PWD"] = "/"
+    monkeypatch.setattr(xession, "aliases", Aliases())
+    ptk_completer = PromptToolkitCompleter(None, None, None)
+    ptk_completer.cache.maxsize = 4
+
+    def set_names(*names, result=None):
+        fake = FakeCompleter(names, result)
+        ptk_completer.completer = MagicMock(spec=Completer)
+        ptk_completer.completer.complete.side_effect = fake.complete
+        return fake
+
+    set_names.ptk_completer = ptk_completer
+    return set_names
+
+
+def complete(completer, before, after=""):
+    ptk_completer = completer.ptk_completer
+    event = MagicMock(completion_requested=True)
+    document = Document(before + after, len(before))
+    query = ptk_completer.get_query(document, event)
+    result = ptk_completer.lookup(query) or ptk_completer.complete(query)
+    return sorted(result.completions), result.plen
+
+
+def test_cache_hit(completer):
+    fake = completer("foo", "foobar", "bar")
+    assert complete(completer, "ls f") == (["foo", "foobar"], 1)
+    assert complete(completer, "ls f") == (["foo", "foobar"], 1)
+    assert fake.calls == 1
+    info = completer.ptk_completer.cache.info()
+    assert info == CacheInfo(hits=1, misses=1, maxsize=4, currsize=1)
+
+
+def test_cache_narrows_typed_characters(completer):
+    fake = completer("foo", "foobar", "fob", "bar")
+    complete(completer, "ls f")
+    assert complete(completer, "ls foo") == (["foo", "foobar"], 3)
+    assert complete(completer, "ls foob") == (["foobar"], 4)
+    # deleting a character finds the previous result
+    assert complete(completer, "ls foo") == (["foo", "foobar"], 3)
+    assert fake.calls == 1
+
+
+@pytest.mark.parametrize(
+    "typed",
+    [
+        "ls f/",  # might complete something else
+        "ls fx",  # nothing left, the completers may fall back to other matches
+        "ls f -",  # another word
+    ],
+)
+def test_cache_does_not_narrow(typed, completer):
+    fake = completer("foo", "foobar")
+    complete(completer, "ls f")
+    complete(completer, typed)
+    assert fake.calls == 2
+
+
+def test_cache_does_not_narrow_other_matches(completer):
+    # e.g. fuzzy matches, that do not start with the prefix
+    completer(result=({"foo", "xfoo"}, 1))
+    complete(completer, "ls f")
+    fake = completer("foo")
+    assert complete(completer, "ls fo") == (["foo"], 2)
+    assert fake.calls == 1
+
+
+def test_cache_narrows_rich_completions(completer):
+    fake = completer(result=({RichCompletion("foo", prefix_len=1)}, 1))
+    complete(completer, "f")
+    ((comp,), plen) = complete(completer, "fo")
+    assert (comp, comp.prefix_len, plen) == ("foo", 2, 2)
+    assert fake.calls == 1
+
+
+def test_cache_context(completer, xession):
+    fake = completer("foo")
+    complete(completer, "ls f", after=" -l")
+    complete(completer, "ls f")
+    xession.env["PWD"] = "/tmp"
+    complete(completer, "ls f")
+    assert fake.calls == 3
+
+
+def test_cache_size(completer):
+    fake = completer("a", "b", "c", "d", "e")
+    for name in "abcde":
+        complete(completer, f"ls {name}")
+    assert len(completer.ptk_completer.cache) == 4
+    complete(completer, "ls a")
+    assert fake.calls == 6
+
+    completer.ptk_completer.cache.maxsize = 0
+    complete(completer, "ls b")
+    assert fake.calls == 7
@@ -0,0 +1,119 @@
+import json
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from prompt_toolkit.document import Document
+from xonsh.aliases import Aliases
+from xonsh.completer import Completer
+from xonsh.completers.tools import is_exclusive_completer, non_exclusive_completer
+
+from xontrib_ptk_shell.completer import PromptToolkitCompleter
+from xontrib_ptk_shell.completion_trace import (
+    TRACE,
+    CompletionTrace,
+    completion_trace_alias,
+)
+
+
+@pytest.fixture
+def trace():
+    TRACE.clear()
+    TRACE.enabled = True
+    yield TRACE
+    TRACE.enabled = False
+    TRACE.clear()
+
+
+@pytest.fixture
+def ptk_completer(monkeypatch, xession):
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    xonsh_completer_mock.complete.return_value = ("fob", "foo"), 1
+    monkeypatch.setattr(xession, "aliases", Aliases())
+    monkeypatch.setattr(xession, "completers", {}, raising=False)
+    completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    completer.suggestion_completion = lambda _, __: None
+    return completer
+
+
+def complete(completer, text):
+    event = MagicMock(completion_requested=True)
+    return [c.text for c in completer.get_completions(Document(text), event)]
+
+
+def test_nothing_is_recorded_by_default(ptk_completer):
+    assert not TRACE.enabled
+    assert complete(ptk_completer, "ls f") == ["fob", "foo"]
+    assert not TRACE.spans
+
+
+def test_stages_are_recorded(trace, ptk_completer):
+    assert complete(ptk_completer, "ls f") == ["fob", "foo"]
+    names = [span.name for span in trace.spans]
+    assert names == [
+        "alias expansion",
+        "cache lookup",
+        "completers",
+        "suggestion merge",
+        "common prefix",
+        "Completion construction",
+    ]
+    assert trace.spans[-1].args == {"count": 2}
+    assert all(span.duration >= 0 for span in trace.spans)
+
+
+def test_completers_are_timed(trace):
+    def slow(prefix, line, begidx, endidx, ctx):
+        time.sleep(0.05)
+        yield prefix + "oo"
+
+    completers = {"slow": non_exclusive_completer(slow)}
+    trace.instrument(completers)
+    traced = completers["slow"]
+    assert not is_exclusive_completer(traced)
+    trace.instrument(completers)
+    assert completers["slow"] is traced
+    # generating the completions is part of the duration
+    assert traced("f", "f", 0, 1, {}) == ["foo"]
+    (span,) = trace.spans
+    assert (span.name, span.cat) == ("slow", "completer")
+    assert span.duration >= 0.05 * 1e9
+    trace.uninstrument(completers)
+    assert completers["slow"] is slow
+
+
+def test_ring_buffer():
+    trace = CompletionTrace(maxsize=3)
+    trace.enabled = True
+    for idx in range(5):
+        with trace.span(f"stage{idx}"):
+            pass
+    assert [span.name for span in trace.spans] == ["stage2", "stage3", "stage4"]
+    assert "stage4" in trace.summary()
+
+
+def test_chrome_trace_export(trace, tmp_path):
+    with trace.span("sorting", count=3):
+        pass
+    path = tmp_path / "trace.json"
+    out = completion_trace_alias(["export", str(path)])
+    assert out == f"Wrote 1 spans to {path}\n"
+    (event,) = json.loads(path.read_text())["traceEvents"]
+    assert event["name"] == "sorting"
+    assert event["ph"] == "X"
+    assert event["args"] == {"count": 3}
+    assert event["dur"] >= 0
+
+
+def test_alias(xession, monkeypatch):
+    monkeypatch.setattr(xession, "completers", {}, raising=False)
+    try:
+        assert completion_trace_alias(["on"]) is None
+        assert TRACE.enabled
+        assert completion_trace_alias(["off"]) is None
+        assert not TRACE.enabled
+    finally:
+        TRACE.enabled = False
+    assert completion_trace_alias(["show"]) == "No completion timings recorded.\n"
+    out, err, code = completion_trace_alias(["frobnicate"])
+    assert code == 1 and err.startswith("usage:")
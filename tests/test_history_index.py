@@ -0,0 +1,202 @@
+import random
+import re
+import time
+
+import pytest
+
+from xontrib_ptk_shell.history_index import (
+    ContextIndex,
+    FuzzyHistoryIndex,
+    PrefixIndex,
+    TrigramIndex,
+)
+
+
+@pytest.fixture
+def trigram_index():
+    index = TrigramIndex()
+    for entry_id, line in enumerate(["git status", "ls -la", "git commit", "echo git"]):
+        index.add(entry_id, line)
+    return index
+
+
+@pytest.mark.parametrize(
+    "text, exp",
+    [
+        ("git", [0, 2, 3]),
+        ("git c", [2]),
+        ("-la", [1]),
+        ("hg ", []),
+        ("gi", None),
+    ],
+)
+def test_trigram_search(text, exp, trigram_index):
+    assert trigram_index.search(text) == exp
+
+
+def test_trigram_search_sees_new_entries(trigram_index):
+    assert trigram_index.search("commit") == [2]
+    trigram_index.add(-1, "git commit --amend")
+    assert trigram_index.search("commit") == [-1, 2]
+
+
+@pytest.fixture
+def fuzzy_index():
+    index = FuzzyHistoryIndex()
+    # loaded newest first
+    loaded = [
+        ("git status", "/repo"),
+        ("grep -r todo", "/tmp"),
+        ("git status", "/repo"),
+        ("git stash", "/tmp"),
+        ("Get-Help", None),
+    ]
+    for idx, (line, cwd) in enumerate(loaded, start=1):
+        index.add(-idx, line, {"inp": line, "cwd": cwd})
+    return index
+
+
+@pytest.mark.parametrize(
+    "text, cwd, exp",
+    [
+        ("gst", None, ["git status", "git stash"]),
+        ("gst", "/tmp", ["git stash", "git status"]),
+        ("gt", None, ["git status", "git stash", "Get-Help", "grep -r todo"]),
+        ("Ge", None, ["Get-Help"]),
+        ("xyz", None, []),
+        ("", None, []),
+    ],
+)
+def test_fuzzy_search(text, cwd, exp, fuzzy_index):
+    assert fuzzy_index.search(text, cwd=cwd) == exp
+
+
+def test_fuzzy_search_sees_stored_entries(fuzzy_index):
+    fuzzy_index.add(0, "git stash pop", {"inp": "git stash pop", "cwd": "/repo"})
+    assert fuzzy_index.search("gsp") == ["git stash pop"]
+    assert fuzzy_index.search("gst", cwd="/repo") == [
+        "git status",
+        "git stash pop",
+        "git stash",
+    ]
+
+
+def test_fuzzy_search_joins_the_loaded_entries_once(fuzzy_index):
+    fuzzy_index.build()
+    recent, loaded = fuzzy_index._get_segments()
+    fuzzy_index.add(0, "git stash pop", {"inp": "git stash pop", "cwd": "/repo"})
+    assert fuzzy_index.search("gsp") == ["git stash pop"]
+    new_recent, new_loaded = fuzzy_index._get_segments()
+    # only the entries of this session are joined again
+    assert new_loaded is loaded
+    assert new_recent is not recent
+
+
+@pytest.mark.slow
+def test_fuzzy_search_latency():
+    """Every keystroke is answered in time on 1M entries, with all the results."""
+    words = ["git", "status", "docker", "run", "kubectl", "get", "pods", "-n"]
+    index = FuzzyHistoryIndex()
+    lines = []
+    for idx in range(1_000_000):
+        line = " ".join(words[(idx * k) % len(words)] for k in (1, 3, 5))
+        lines.append(f"{line} {idx}")
+        index.add(-idx - 1, lines[-1])
+    index.build()
+
+    for text in ("k", "kg", "kgp", "kgpn", "d", "dr", "drg", "999999"):
+        start = time.perf_counter()
+        found = index.search(text)
+        assert time.perf_counter() - start < 0.25
+        pattern = re.compile(".*".join(map(re.escape, text)))
+        matching = sum(1 for line in lines if pattern.search(line))
+        assert len(found) == min(matching, 20), text
+
+
+def scan_suggestion(entries, prefix):
+    """What AutoSuggestFromHistory does, ``entries`` are newest first."""
+    for entry in entries:
+        for line in reversed(entry.splitlines()):
+            if line.startswith(prefix):
+                return line
+    return None
+
+
+def test_prefix_search_matches_scan():
+    rnd = random.Random(42)
+    entries = [
+        "".join(rnd.choice("ab \n") for _ in range(rnd.randint(1, 6)))
+        for _ in range(2000)
+    ]
+    index = PrefixIndex()
+    for idx, entry in enumerate(entries):
+        index.add(-idx - 1, entry)
+    assert not index.ready
+    index.build()
+    assert index.ready
+
+    prefixes = {entry[:n] for entry in entries for n in range(1, 4)}
+    for prefix in prefixes | {"c", "aaaaaaa"}:
+        assert index.search(prefix) == scan_suggestion(entries, prefix), prefix
+
+    # stored entries are newer than the loaded ones
+    for entry_id, entry in enumerate(["ab", "b\nba", "ab"]):
+        index.add(entry_id, entry)
+        entries.insert(0, entry)
+    for prefix in prefixes:
+        assert index.search(prefix) == scan_suggestion(entries, prefix), prefix
+
+
+@pytest.mark.slow
+def test_prefix_search_latency():
+    """Suggestions must not get slower with the history size."""
+    index = PrefixIndex()
+    for idx in range(1_000_000):
+        index.add(-idx - 1, f"git commit -m 'change {idx}'")
+    index.build()
+
+    for prefix in ("g", "git commit -m 'change 99", "git push", "x"):
+        start = time.perf_counter()
+        index.search(prefix)
+        assert time.perf_counter() - start < 0.001, prefix
+
+
+@pytest.fixture
+def context_index():
+    index = ContextIndex()
+    # loaded newest first
+    loaded = [
+        ("make test", "/repo", 2),
+        ("make build", "/repo", 0),
+        ("make test", "/repo", 0),
+        ("make install", "/tmp", 0),
+        ("make build", "/repo", 0),
+        ("make clean", "/repo", 0),
+        ("ls", None, 0),
+    ]
+    for idx, (line, cwd, rtn) in enumerate(loaded):
+        index.add(-idx - 1, line, {"inp": line, "cwd": cwd, "rtn": rtn})
+    index.build()
+    return index
+
+
+@pytest.mark.parametrize(
+    "prefix, cwd, exp",
+    [
+        # run twice there, and "make test" failed the last time
+        ("make", "/repo", "make build"),
+        ("make t", "/repo", "make test"),
+        ("make", "/tmp", "make install"),
+        ("make i", "/repo", None),
+        ("ls", "/repo", None),
+        ("make", None, None),
+    ],
+)
+def test_context_search(prefix, cwd, exp, context_index):
+    assert context_index.search(prefix, cwd) == exp
+
+
+def test_context_search_sees_stored_entries(context_index):
+    for entry_id in range(3):
+        context_index.add(entry_id, "make lint", {"inp": "make lint", "cwd": "/repo"})
+    assert context_index.search("make", "/repo") == "make lint"
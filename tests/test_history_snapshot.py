@@ -0,0 +1,132 @@
+import pytest
+
+from xontrib_ptk_shell.history_snapshot import (
+    HistorySnapshot,
+    backend_signature,
+    write_snapshot,
+)
+
+
+class FileHistory:
+    """Stands in for a file based xonsh history backend."""
+
+    def __init__(self, filename, inputs):
+        self.filename = str(filename)
+        self.inputs = inputs
+        self.reads = 0
+        self.filename_path = filename
+        filename.write_text("\n".join(map(str, inputs)))
+
+    def all_items(self, newest_first=False):
+        self.reads += 1
+        for inp in self.inputs:
+            yield inp if isinstance(inp, dict) else {"inp": inp}
+
+
+class JsonHistory:
+    """Stands in for the json backend, with one file per session."""
+
+    def __init__(self, data_dir, sessionid):
+        self.filename = str(data_dir / f"xonsh-{sessionid}.json")
+        with open(self.filename, "w") as fp:
+            fp.write("{}")
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return FileHistory(tmp_path / "history.sqlite", ["echo ü", "ls\n", "cd /"])
+
+
+def test_round_trip(tmp_path, backend):
+    path = str(tmp_path / "snapshot")
+    lines = ["echo ü", "", "multi\nline"]
+    signature = backend_signature(backend)
+    write_snapshot(path, signature, lines)
+
+    snapshot = HistorySnapshot.open(path, signature)
+    assert len(snapshot) == 3
+    assert list(snapshot) == lines
+    assert snapshot[-1] == "multi\nline"
+    snapshot.close()
+
+
+def test_outdated_snapshot_is_ignored(tmp_path, backend):
+    path = str(tmp_path / "snapshot")
+    write_snapshot(path, backend_signature(backend), ["ls"])
+
+    backend.filename_path.write_text("changed")
+    assert HistorySnapshot.open(path, backend_signature(backend)) is None
+
+
+def test_json_backend_signature(tmp_path):
+    history_dir = tmp_path / "history_json"
+    history_dir.mkdir()
+    (history_dir / "xonsh-old.json").write_text('{"cmds": []}')
+    live = JsonHistory(history_dir, "live")
+    signature = backend_signature(live)
+    # the other sessions, not the one that is running
+    assert [path for path, _, _ in signature] == [str(history_dir / "xonsh-old.json")]
+    with open(live.filename, "w") as fp:
+        fp.write('{"cmds": [{"inp": "ls"}]}')
+    assert backend_signature(live) == signature
+    # part of the history of the next session
+    assert backend_signature(JsonHistory(history_dir, "next")) != signature
+
+
+@pytest.mark.parametrize("content", [b"", b"garbage", b"XPTKHIST\x00\x00"])
+def test_broken_snapshot_is_ignored(content, tmp_path, backend):
+    path = tmp_path / "snapshot"
+    path.write_bytes(content)
+    assert HistorySnapshot.open(str(path), backend_signature(backend)) is None
+
+
+def test_items_round_trip(tmp_path, backend):
+    path = str(tmp_path / "snapshot")
+    items = [{"cwd": "/tmp", "rtn": 1}, None, {"cwd": "/tmp", "rtn": 0}, {"rtn": 0}]
+    signature = backend_signature(backend)
+    write_snapshot(path, signature, ["a", "b", "c", "d"], items)
+
+    snapshot = HistorySnapshot.open(path, signature)
+    assert list(snapshot.items()) == [
+        ("a", {"cwd": "/tmp", "rtn": 1}),
+        ("b", None),
+        ("c", {"cwd": "/tmp", "rtn": 0}),
+        ("d", {"cwd": None, "rtn": 0}),
+    ]
+    snapshot.close()
+
+
+def test_history_loads_from_snapshot(tmp_path, backend, xession, monkeypatch):
+    from xontrib_ptk_shell.history import PromptToolkitHistory
+
+    monkeypatch.setattr(xession, "history", backend)
+    path = str(tmp_path / "snapshot")
+
+    first = list(PromptToolkitHistory(snapshot_file=path).load_history_strings())
+    assert first == ["echo ü", "ls", "cd /"]
+    assert backend.reads == 1
+
+    second = list(PromptToolkitHistory(snapshot_file=path).load_history_strings())
+    assert second == first
+    assert backend.reads == 1
+
+
+def test_snapshot_keeps_the_context(tmp_path, xession, monkeypatch):
+    from xontrib_ptk_shell.history import PromptToolkitHistory
+
+    inputs = [
+        {"inp": "make test", "cwd": "/proj", "rtn": 0},
+        {"inp": "make lint", "cwd": "/other", "rtn": 0},
+    ]
+    backend = FileHistory(tmp_path / "history.sqlite", inputs)
+    monkeypatch.setattr(xession, "history", backend)
+    xession.env["AUTO_SUGGEST_BY_CONTEXT"] = True
+    path = str(tmp_path / "snapshot")
+
+    suggestions = []
+    for _ in range(2):
+        hist = PromptToolkitHistory(snapshot_file=path)
+        list(hist.load_history_strings())
+        suggestions.append(hist.context_index.search("make", "/other"))
+    assert backend.reads == 1
+    assert suggestions[1] == suggestions[0] == "make lint"
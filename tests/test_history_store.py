@@ -0,0 +1,70 @@
+import sys
+
+import pytest
+
+from xontrib_ptk_shell.history_store import HistoryStrings, WorkingLines
+
+
+@pytest.fixture
+def strings():
+    """``HistoryStrings`` with two loaded and two new entries"""
+    strings = HistoryStrings(["b", "a"])
+    strings.insert(0, "c")
+    strings.insert(0, "d é\udc80")
+    return strings
+
+
+def test_history_strings(strings):
+    exp = ["d é\udc80", "c", "b", "a"]
+    assert len(strings) == 4
+    assert list(strings) == exp
+    assert [strings[i] for i in range(-4, 4)] == exp * 2
+    assert strings[1:] == exp[1:]
+    assert strings[::-1] == exp[::-1]
+    assert list(reversed(strings)) == exp[::-1]
+    with pytest.raises(IndexError):
+        strings[4]
+    with pytest.raises(ValueError):
+        strings.insert(1, "x")
+
+    strings.clear()
+    assert list(strings) == []
+
+
+def test_oldest_first(strings):
+    view = strings.oldest_first()
+    assert view == ["a", "b", "c", "d é\udc80"]
+    assert view[-1] == "d é\udc80"
+    assert view[:2] == ["a", "b"]
+    strings.insert(0, "e")
+    # the view is not a copy
+    assert view[-1] == "e"
+
+
+def test_working_lines(strings):
+    lines = WorkingLines(strings, ["current"])
+    assert list(lines) == ["current"]
+    assert lines.set_history_size(3) == 3
+    assert list(lines) == ["b", "c", "d é\udc80", "current"]
+
+    lines[0] = "edited"
+    lines[-1] = "new"
+    assert list(lines) == ["edited", "c", "d é\udc80", "new"]
+    # editing does not change the history
+    assert strings[2] == "b"
+
+    lines.appendleft("older")
+    assert list(lines) == ["older", "edited", "c", "d é\udc80", "new"]
+    with pytest.raises(IndexError):
+        lines[5]
+
+
+def test_history_strings_memory():
+    """The entries take about their encoded size, instead of a ``str`` each."""
+    entries = [f"git commit -m 'change number {i}'" for i in range(100_000)]
+    strings = HistoryStrings(entries)
+    used = sys.getsizeof(strings._loaded.blob) + sys.getsizeof(
+        strings._loaded.offsets
+    )
+    as_list = sys.getsizeof(entries) + sum(map(sys.getsizeof, entries))
+    assert used < as_list / 1.8
@@ -0,0 +1,75 @@
+import pytest
+from prompt_toolkit.application.current import set_app
+from prompt_toolkit.buffer import CompletionState
+from prompt_toolkit.completion import WordCompleter
+from prompt_toolkit.document import Document
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+from prompt_toolkit.shortcuts import CompleteStyle, PromptSession
+
+from xontrib_ptk_shell.menu_space import MenuSpace, input_height
+
+
+class Output(DummyOutput):
+    """A terminal of 40x80 with the cursor on its last row"""
+
+    def get_rows_below_cursor_position(self):
+        return 1
+
+
+@pytest.fixture
+def session():
+    with create_pipe_input() as inp:
+        yield PromptSession(
+            input=inp,
+            output=Output(),
+            completer=WordCompleter([f"foo{idx}" for idx in range(30)]),
+            reserve_space_for_menu=6,
+        )
+
+
+@pytest.mark.parametrize(
+    "text, columns, prompt_width, expected",
+    [
+        ("", 80, 0, 1),
+        ("a\nb", 80, 0, 2),
+        ("x" * 100, 80, 0, 2),
+        ("x" * 100 + "\n", 50, 0, 3),
+        ("x" * 70, 80, 0, 1),
+        ("x" * 70, 80, 12, 2),
+        ("x\n" + "x" * 70, 80, 12, 2),
+    ],
+)
+def test_input_height(text, columns, prompt_width, expected):
+    assert input_height(text, columns, prompt_width) == expected
+
+
+def test_height(session):
+    space = MenuSpace(session)
+    assert space.install()
+    session.complete_while_typing = False
+    buffer = session.default_buffer
+    with set_app(session.app):
+        assert space.height().min == 0
+        document = Document("a\nb\n" + "x" * 100)
+        buffer._set_text(document.text)
+        buffer.complete_state = CompletionState(document)
+        assert space.height().min == 4 - 1 + 6
+        session.complete_style = CompleteStyle.READLINE_LIKE
+        assert space.height().min == 0
+
+
+def test_height_includes_the_prompt(session):
+    """A long prompt wraps the first line of the input one row earlier"""
+    space = MenuSpace(session)
+    session.complete_while_typing = False
+    session.message = "user@host ~/some/long/path\n" + "x" * 30 + " $ "
+    buffer = session.default_buffer
+    with set_app(session.app):
+        document = Document("a\nb\n" + "x" * 60)
+        buffer._set_text(document.text)
+        buffer.complete_state = CompletionState(document)
+        # the first line of the prompt is on a row of its own
+        assert space.height().min == 3 - 1 + 6
+        buffer._set_text("x" * 60)
+        assert space.height().min == 2 - 1 + 6
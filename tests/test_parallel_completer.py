@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+from xonsh.completers.tools import non_exclusive_completer
+
+from xontrib_ptk_shell.parallel_completer import POOL, ParallelCompletions
+
+
+def completer(*names, delay=0.0, exclusive=True):
+    def complete(prefix, line, begidx, endidx, ctx):
+        time.sleep(delay)
+        return {name for name in names if name.startswith(prefix)}
+
+    return complete if exclusive else non_exclusive_completer(complete)
+
+
+@pytest.fixture
+def completers(monkeypatch, xession):
+    def set_completers(**funcs):
+        monkeypatch.setattr(xession, "completers", funcs, raising=False)
+
+    return set_completers
+
+
+def generate(prefix="f", deadline=0.0):
+    generated = ParallelCompletions(
+        None, (prefix, prefix, 0, len(prefix), {}), threading.Event(), deadline
+    )
+    return [str(comp) for comp, _ in generated], generated.dropped
+
+
+def test_fast_completers_first(completers):
+    """The completions of a slow non-exclusive completer come last"""
+    completers(
+        slow=completer("foo-slow", delay=0.3, exclusive=False),
+        fast=completer("foo", "fob"),
+    )
+    generated = iter(
+        ParallelCompletions(None, ("f", "f", 0, 1, {}), threading.Event(), 0)
+    )
+    start = time.monotonic()
+    assert {str(next(generated)[0]) for _ in range(2)} == {"foo", "fob"}
+    assert time.monotonic() - start < 0.2
+    assert [str(comp) for comp, _ in generated] == ["foo-slow"]
+
+
+def test_exclusive_completers_take_precedence(completers):
+    completers(
+        slow=completer("foo-slow", delay=0.1),
+        fast=completer("foo"),
+    )
+    assert generate() == (["foo-slow"], [])
+    # an exclusive completer without completions lets the others through
+    completers(
+        slow=completer("bar", delay=0.1),
+        fast=completer("foo"),
+    )
+    assert generate() == (["foo"], [])
+
+
+def test_excluded_completers_are_not_run(completers):
+    calls = []
+
+    def bash(prefix, line, begidx, endidx, ctx):
+        calls.append(prefix)
+        return {"foo-bash"}
+
+    # not even while a slow exclusive completer is running
+    completers(slow=completer("foo", delay=0.1), bash=bash)
+    assert generate() == (["foo"], [])
+    assert calls == []
+    # run once the exclusive completer has no completions
+    completers(slow=completer("bar", delay=0.1), bash=bash)
+    assert generate() == (["foo-bash"], [])
+    assert calls == ["f"]
+
+
+def test_completers_share_a_bounded_pool(completers):
+    completers(
+        **{
+            f"c{idx}": completer(f"foo{idx}", delay=0.01, exclusive=False)
+            for idx in range(10)
+        }
+    )
+    assert sorted(generate()[0]) == sorted(f"foo{idx}" for idx in range(10))
+    workers = [t for t in threading.enumerate() if t.name == "xonsh-completer"]
+    assert len(workers) <= POOL.max_workers
+
+
+def test_slow_completers_are_dropped(completers):
+    completers(
+        path=completer("foo", exclusive=False),
+        bash=completer("foo-bash", delay=0.8),
+    )
+    start = time.monotonic()
+    assert generate(deadline=0.1) == (["foo"], ["bash"])
+    assert time.monotonic() - start < 0.5
+
+
+def test_stop_iteration_ends_the_chain(completers):
+    def stop(prefix, line, begidx, endidx, ctx):
+        raise StopIteration
+
+    completers(stop=stop, fast=completer("foo"))
+    assert generate() == ([], [])
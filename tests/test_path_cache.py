@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from prompt_toolkit.document import Document
+from xonsh.aliases import Aliases
+from xonsh.completer import Completer
+
+from xontrib_ptk_shell import path_cache
+from xontrib_ptk_shell.completer import PromptToolkitCompleter
+from xontrib_ptk_shell.path_cache import (
+    DirectoryListings,
+    network_mounts,
+    read_network_mounts,
+    token_directory,
+)
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+
+def touch_dir(path, mtime):
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_network_mounts(tmp_path):
+    mounts = tmp_path / "mounts"
+    mounts.write_text(
+        "/dev/sda1 / ext4 rw 0 0\n"
+        "server:/export /mnt/nfs nfs4 rw 0 0\n"
+        "user@host:/ /mnt/my\\040box fuse.sshfs rw 0 0\n"
+    )
+    assert read_network_mounts(str(mounts)) == ("/mnt/my box", "/mnt/nfs")
+    assert read_network_mounts(str(tmp_path / "missing")) == ()
+
+
+def test_network_mounts_are_read_again(tmp_path, xession):
+    mounts = tmp_path / "mounts"
+    mounts.write_text("/dev/sda1 / ext4 rw 0 0\n")
+    xession.env["COMPLETION_PATH_CACHE_TTL"] = 60
+    assert network_mounts(str(mounts)) == ()
+    mounts.write_text("server:/export /mnt/nfs nfs4 rw 0 0\n")
+    assert network_mounts(str(mounts)) == ()
+    xession.env["COMPLETION_PATH_CACHE_TTL"] = 0
+    assert network_mounts(str(mounts)) == ("/mnt/nfs",)
+
+
+@pytest.mark.parametrize(
+    "prefix, expected",
+    [
+        ("foo", None),
+        ("src/fo", "/home/src"),
+        ("'/mnt/nfs/a b/", "/mnt/nfs/a b"),
+        ("../x", "/"),
+    ],
+)
+def test_token_directory(prefix, expected, xession):
+    xession.env["PWD"] = "/home"
+    assert token_directory(prefix) == expected
+
+
+def test_stamp_of_local_directory(tmp_path):
+    listings = DirectoryListings()
+    touch_dir(tmp_path, 1_000_000_000)
+    assert listings.stamp(str(tmp_path)) == 1_000_000_000
+    touch_dir(tmp_path, 2_000_000_000)
+    assert listings.stamp(str(tmp_path)) == 2_000_000_000
+    assert listings.stamp(str(tmp_path / "missing")) is None
+
+
+def test_network_directories_are_prefetched(tmp_path, monkeypatch):
+    for name in ("src", "scripts", "docs"):
+        (tmp_path / "proj" / name).mkdir(parents=True)
+    monkeypatch.setattr(path_cache, "is_network_path", lambda path: True)
+    listings = DirectoryListings(ttl=60)
+    proj = str(tmp_path / "proj")
+
+    # reading it may stall the prompt
+    assert listings.stamp(proj) is None
+    listings.prefetch(proj, "s")
+    wait_for(lambda: listings.stamp(proj) is not None)
+    wait_for(lambda: len(listings._listings) == 4)
+    assert sorted(listings._listings) == sorted(
+        [str(tmp_path), proj, os.path.join(proj, "src"), os.path.join(proj, "scripts")]
+    )
+    # the modification time is trusted until the ttl passes
+    touch_dir(proj, 1_000_000_000)
+    assert listings.stamp(proj) != 1_000_000_000
+    listings.ttl = 0
+    assert listings.stamp(proj) is None
+
+
+def wait_for_listing(ptk_completer, path):
+    """The completions of the paths in it are checked once it is listed"""
+    listings = ptk_completer.listings._listings
+    wait_for(lambda: path in listings and listings[path].entries)
+
+
+def test_path_completions_are_kept_across_prompts(tmp_path, monkeypatch, xession):
+    (tmp_path / "foo").mkdir()
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    xonsh_completer_mock.complete.return_value = {"foo/"}, 1
+    monkeypatch.setattr(xession, "aliases", Aliases())
+    xession.env["PWD"] = str(tmp_path)
+
+    ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    ptk_completer.suggestion_completion = lambda _, __: None
+
+    def complete(text):
+        event = MagicMock(completion_requested=True)
+        return [c.text for c in ptk_completer.get_completions(Document(text), event)]
+
+    touch_dir(tmp_path, 1_000_000_000)
+    assert complete("ls ./f") == ["foo/"]
+    assert complete("ls f") == ["foo/"]
+    wait_for_listing(ptk_completer, str(tmp_path))
+    ptk_completer.reset()
+    assert complete("ls ./f") == ["foo/"]
+    assert xonsh_completer_mock.complete.call_count == 2
+    # only the completions of paths are kept
+    assert complete("ls f") == ["foo/"]
+    assert xonsh_completer_mock.complete.call_count == 3
+    touch_dir(tmp_path, 2_000_000_000)
+    assert complete("ls ./f") == ["foo/"]
+    assert xonsh_completer_mock.complete.call_count == 4
+
+
+def test_only_directory_listings_are_kept(tmp_path, monkeypatch, xession):
+    for name in ("main.py", "util.py", ".hidden"):
+        (tmp_path / name).write_text("")
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    monkeypatch.setattr(xession, "aliases", Aliases())
+    xession.env["PWD"] = str(tmp_path)
+
+    ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    ptk_completer.suggestion_completion = lambda _, __: None
+
+    def complete(text):
+        event = MagicMock(completion_requested=True)
+        return [c.text for c in ptk_completer.get_completions(Document(text), event)]
+
+    # like the path completer
+    xonsh_completer_mock.complete.return_value = {"./main.py", "./util.py"}, 2
+    complete("ls ./")
+    # like the files changed in a repository, which the directory does not tell
+    xonsh_completer_mock.complete.return_value = {"./main.py"}, 2
+    complete("git add ./")
+    wait_for_listing(ptk_completer, str(tmp_path))
+    ptk_completer.reset()
+    assert xonsh_completer_mock.complete.call_count == 2
+    complete("ls ./")
+    assert xonsh_completer_mock.complete.call_count == 2
+    complete("git add ./")
+    assert xonsh_completer_mock.complete.call_count == 3
+
+
+def test_missing_directory_is_not_prefetched(tmp_path, monkeypatch):
+    started = []
+    monkeypatch.setattr(DirectoryListings, "_start", lambda *args: started.append(args))
+    listings = DirectoryListings(ttl=60)
+    missing = str(tmp_path / "missing")
+    assert listings.stamp(missing) is None
+    for _ in range(3):
+        listings.prefetch(missing, "f")
+    assert not started
+    listings.prefetch(str(tmp_path), "f")
+    assert len(started) == 1
+
+
+def test_directories_are_listed_in_the_background(tmp_path, monkeypatch, xession):
+    (tmp_path / "foo").mkdir()
+    listed_in = []
+    scandir = os.scandir
+
+    def record_scandir(path):
+        listed_in.append(threading.current_thread())
+        return scandir(path)
+
+    monkeypatch.setattr(path_cache.os, "scandir", record_scandir)
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    xonsh_completer_mock.complete.return_value = {"./foo/"}, 2
+    monkeypatch.setattr(xession, "aliases", Aliases())
+    xession.env["PWD"] = str(tmp_path)
+    ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    ptk_completer.suggestion_completion = lambda _, __: None
+
+    event = MagicMock(completion_requested=True)
+    list(ptk_completer.get_completions(Document("ls ./f"), event))
+    wait_for_listing(ptk_completer, str(tmp_path))
+    assert listed_in
+    assert threading.current_thread() not in listed_in
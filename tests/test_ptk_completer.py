@@ -1,3 +1,5 @@
+import itertools
+import time
 from inspect import signature
 from unittest.mock import MagicMock
 
@@ -8,7 +10,11 @@ from xonsh.aliases import Aliases
 from xonsh.completer import Completer
 from xonsh.completers.tools import RichCompletion
 
-from xontrib_ptk_shell.completer import PromptToolkitCompleter
+from xontrib_ptk_shell.completer import (
+    CompletionObjects,
+    PromptToolkitCompleter,
+    common_prefix,
+)
 
 
 @pytest.mark.parametrize(
@@ -30,7 +36,6 @@ def test_rich_completion(completion, lprefix, ptk_completion, monkeypatch, xessi
     xonsh_completer_mock.complete.return_value = {completion}, lprefix
 
     ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
-    ptk_completer.reserve_space = lambda: None
     ptk_completer.suggestion_completion = lambda _, __: None
 
     document_mock = MagicMock()
@@ -184,7 +189,6 @@ def test_alias_expansion(code, index, expected_args, monkeypatch, xession):
     xonsh_completer_mock.complete.return_value = set(), 0
 
     ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
-    ptk_completer.reserve_space = lambda: None
     ptk_completer.suggestion_completion = lambda _, __: None
 
     monkeypatch.setattr(xession, "aliases", Aliases(gb=["git branch"]))
@@ -198,3 +202,184 @@ def test_alias_expansion(code, index, expected_args, monkeypatch, xession):
         signature(Completer.complete).bind(None, *args, **kwargs).arguments
         == expected_args
     )
+
+
+def test_completions_are_cached(monkeypatch, xession):
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    xonsh_completer_mock.complete.return_value = {"foo", "foobar"}, 1
+
+    ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    monkeypatch.setattr(xession, "aliases", Aliases())
+
+    def complete(text):
+        event = MagicMock(completion_requested=True)
+        return [c.text for c in ptk_completer.get_completions(Document(text), event)]
+
+    assert sorted(complete("ls f")) == ["foo", "foobar"]
+    assert sorted(complete("ls f")) == ["foo", "foobar"]
+    # the last completions are narrowed, without looking them up in the cache
+    assert complete("ls foob") == ["foobar"]
+    # deleting a character finds the completions in the cache
+    assert sorted(complete("ls f")) == ["foo", "foobar"]
+    assert xonsh_completer_mock.complete.call_count == 1
+    assert ptk_completer.cache.info()[:2] == (2, 1)
+
+
+def test_truncated_completions_are_not_narrowed(monkeypatch, xession):
+    names = ["gcc", "gdb", "gem", "git", "gitk"]
+    xession.env["COMPLETION_QUERY_LIMIT"] = 3
+
+    def xonsh_complete(prefix, *_, **__):
+        matches = [name for name in names if name.startswith(prefix)]
+        return tuple(matches[:3]), len(prefix)
+
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    xonsh_completer_mock.complete.side_effect = xonsh_complete
+    ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    monkeypatch.setattr(xession, "aliases", Aliases())
+
+    def complete(text):
+        event = MagicMock(completion_requested=True)
+        return [c.text for c in ptk_completer.get_completions(Document(text), event)]
+
+    assert complete("ls g") == ["gcc", "gdb", "gem"]
+    # "git" was cut off, the completers are run again
+    assert complete("ls gi") == ["git", "gitk"]
+    # a complete set is narrowed
+    assert complete("ls git") == ["git", "gitk"]
+    assert xonsh_completer_mock.complete.call_count == 2
+
+
+def test_narrowing_is_disabled_without_cache(monkeypatch, xession):
+    xession.env["COMPLETIONS_CACHE_SIZE"] = 0
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    xonsh_completer_mock.complete.return_value = ("foo", "foobar"), 1
+    ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    monkeypatch.setattr(xession, "aliases", Aliases())
+    event = MagicMock(completion_requested=True)
+    for text in ("ls f", "ls fo"):
+        list(ptk_completer.get_completions(Document(text), event))
+    assert xonsh_completer_mock.complete.call_count == 2
+
+
+def test_narrowing_while_typing_is_fast(monkeypatch, xession):
+    """Completing while typing in a directory with 50k entries"""
+    names = [f"file{idx:05}.txt" for idx in range(50_000)]
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    xonsh_completer_mock.complete.return_value = tuple(names), 1
+
+    ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    ptk_completer.max_completions = len(names) + 1
+    xession.env["COMPLETION_QUERY_LIMIT"] = len(names) + 1
+    monkeypatch.setattr(xession, "aliases", Aliases())
+    xession.env.update(AUTO_SUGGEST=True, AUTO_SUGGEST_IN_COMPLETIONS=True)
+    ptk_completer.suggestion_completion = lambda _, __: "file00000.txt"
+
+    def complete(text):
+        event = MagicMock(completion_requested=True)
+        start = time.perf_counter()
+        completions = ptk_completer.get_completions(Document(text), event)
+        completions = [c.text for c in completions]
+        return completions, time.perf_counter() - start
+
+    completions, full = complete("ls f")
+    assert len(completions) == 50_000
+    assert completions[:3] == ["file00000.txt", "file00001.txt", "file00002.txt"]
+    for text in ("ls fi", "ls fil", "ls file"):
+        complete(text)
+    completions, narrowed = complete("ls file4")
+    assert narrowed < full / 2
+    assert completions[:2] == ["file00000.txt", "file40000.txt"]
+    assert len(completions) == 10_001
+    assert xonsh_completer_mock.complete.call_count == 1
+
+
+def test_huge_completion_sets_are_cheap(monkeypatch, xession):
+    """100k completions, of which the buffer takes the first 10k"""
+    names = tuple(
+        RichCompletion(f"file{idx:06}.txt", prefix_len=1) for idx in range(100_000)
+    )
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    xonsh_completer_mock.complete.return_value = names, 1
+    monkeypatch.setattr(xession, "aliases", Aliases())
+
+    ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    event = MagicMock(completion_requested=True)
+
+    def first_page(text):
+        start = time.perf_counter()
+        completions = ptk_completer.get_completions(Document(text), event)
+        page = [c.text for c in itertools.islice(completions, 50)]
+        return page, time.perf_counter() - start
+
+    start = time.perf_counter()
+    completions = list(ptk_completer.get_completions(Document("ls f"), event))
+    window = time.perf_counter() - start
+    assert len(completions) == ptk_completer.max_completions
+    assert completions[-1].text == "file009999.txt"
+
+    ptk_completer.reset()
+    page, first = first_page("ls f")
+    assert page[:2] == ["file000000.txt", "file000001.txt"]
+    # the first page does not wait for the rest to be converted
+    assert first < window / 5
+
+
+@pytest.mark.parametrize(
+    "completions, expected",
+    [
+        (["foo/bar", "foo/baz"], "foo/"),
+        (["'a b/c'", "'a b/d'"], "a b/"),
+        (["'a b/c'", "a/d"], ""),
+        (["a/b'", "a/b"], "a/"),
+        ([], ""),
+    ],
+)
+def test_common_prefix(completions, expected):
+    assert common_prefix(completions) == expected
+
+
+def test_completion_objects_are_reused():
+    objects = CompletionObjects()
+    rich = RichCompletion("'foo bar'", description="line\nbreak")
+    completion = objects.get(rich, 2, 0)
+    assert completion == PTKCompletion(rich, -2, "foo bar", "line break")
+    same = RichCompletion("'foo bar'", description="line\nbreak")
+    assert objects.get(same, 2, 0) is completion
+    # other attributes or prefixes make another completion
+    assert objects.get(rich.replace(style="bold"), 2, 0) is not completion
+    assert objects.get("'foo bar'", 2, 0) is not completion
+    assert objects.get(rich, 2, 2).display_text == "oo bar"
+    assert objects.get("foo", 1, 0) is objects.get("foo", 1, 0)
+
+
+def test_alias_expansion_is_memoized(monkeypatch, xession):
+    xonsh_completer_mock = MagicMock(spec=Completer)
+    xonsh_completer_mock.complete.return_value = set(), 0
+    aliases = Aliases(gb=["git", "branch"])
+    expand_alias = MagicMock(side_effect=aliases.expand_alias)
+    monkeypatch.setattr(aliases, "expand_alias", expand_alias, raising=False)
+    monkeypatch.setattr(xession, "aliases", aliases)
+
+    ptk_completer = PromptToolkitCompleter(xonsh_completer_mock, None, None)
+    ptk_completer.suggestion_completion = lambda _, __: None
+
+    def line_ex(code):
+        query = ptk_completer.get_query(Document(code), MagicMock())
+        return query.line_ex
+
+    assert line_ex("gb -") == "git branch -"
+    assert line_ex("gb -") == "git branch -"
+    assert expand_alias.call_count == 1
+    # changing the aliases expands the line again
+    aliases["gb"] = ["git", "branch", "-v"]
+    assert line_ex("gb -") == "git branch -v -"
+    del aliases["gb"]
+    assert line_ex("gb -") == "gb -"
+    assert expand_alias.call_count == 3
+    # renaming an alias keeps the same values
+    aliases["gb"] = ["git", "branch"]
+    assert line_ex("gb -") == "git branch -"
+    del aliases["gb"]
+    aliases["gbr"] = ["git", "branch"]
+    assert line_ex("gb -") == "gb -"
@@ -1,4 +1,12 @@
+import asyncio
+import threading
+import time
+from types import MethodType
+
 import pytest
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.document import Document
+from prompt_toolkit.history import History
 
 
 @pytest.fixture
@@ -15,3 +23,275 @@ def test_obj(history_obj):
     assert ["line10"] == history_obj.get_strings()
     assert len(history_obj) == 1
     assert ["line10"] == [x for x in history_obj]
+
+
+class FakeHistory:
+    """Stands in for the xonsh history backend, ``inputs`` are newest first.
+
+    They are either the input strings or the whole backend items.
+    """
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+
+    def all_items(self, newest_first=False):
+        for inp in self.inputs:
+            yield inp if isinstance(inp, dict) else {"inp": inp}
+
+
+@pytest.mark.parametrize(
+    "dedup, exp",
+    [
+        (False, ["ls", "cd", "ls", "pwd", "cd"]),
+        (True, ["ls", "cd", "pwd"]),
+    ],
+)
+def test_load_history_strings(dedup, exp, xession, monkeypatch):
+    from xontrib_ptk_shell.history import PromptToolkitHistory
+
+    inputs = ["ls\n", "ls", "cd  ", "ls", "pwd", "cd"]
+    monkeypatch.setattr(xession, "history", FakeHistory(inputs))
+    hist = PromptToolkitHistory(dedup=dedup)
+    assert list(hist.load_history_strings()) == exp
+
+
+def test_load_history_strings_dedup_from_histcontrol(xession, monkeypatch):
+    from xontrib_ptk_shell.history import PromptToolkitHistory
+
+    monkeypatch.setattr(xession, "history", FakeHistory(["a", "b", "a"]))
+    xession.env["HISTCONTROL"] = {"erasedups"}
+    assert list(PromptToolkitHistory().load_history_strings()) == ["a", "b"]
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("dedup", [False, True])
+def test_load_history_strings_scales_linearly(dedup, xession, monkeypatch):
+    """The cost per entry must not grow with the history size."""
+    from xontrib_ptk_shell.history import PromptToolkitHistory
+
+    def per_entry(size, repeat):
+        inputs = [f"cmd {i % (size // 3 * 2)}" for i in range(size)]
+        monkeypatch.setattr(xession, "history", FakeHistory(inputs))
+        hist = PromptToolkitHistory(dedup=dedup)
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in hist.load_history_strings():
+                pass
+            best = min(best, time.perf_counter() - start)
+        return best / size
+
+    small = per_entry(1_000, repeat=5)
+    large = per_entry(1_000_000, repeat=1)
+    assert large < small * 10
+
+
+class SlowHistory(History):
+    """Yields ``head`` right away and waits for ``release`` before the rest."""
+
+    def __init__(self, head, tail):
+        super().__init__()
+        self.head, self.tail = head, tail
+        self.release = threading.Event()
+
+    def load_history_strings(self):
+        yield from self.head
+        assert self.release.wait(5)
+        yield from self.tail
+
+    def store_string(self, string):
+        pass
+
+
+def test_chunked_threaded_history_publishes_first_chunk_early():
+    from xontrib_ptk_shell.history import ChunkedThreadedHistory
+
+    slow = SlowHistory(["c", "b"], [str(i) for i in range(25)])
+    hist = ChunkedThreadedHistory(slow, first_chunk=2, chunk_size=10)
+
+    async def consume():
+        items = hist.load()
+        # the newest entries are available while the backend is still reading
+        first = [await items.__anext__(), await items.__anext__()]
+        slow.release.set()
+        return first, [item async for item in items]
+
+    first, rest = asyncio.run(consume())
+    assert first == ["c", "b"]
+    assert rest == [str(i) for i in range(25)]
+    assert hist.get_strings() == (first + rest)[::-1]
+
+
+def load_buffer_history(buffer):
+    """What Buffer.load_history_if_not_yet_loaded does within the app"""
+
+    async def load():
+        return [item async for item in buffer.history.load()]
+
+    buffer._working_lines.extendleft(asyncio.run(load()))
+    buffer.working_index = len(buffer._working_lines) - 1
+
+
+@pytest.fixture
+def anywhere_buffer(xession, monkeypatch):
+    """Buffer with the history search methods used for $XONSH_HISTORY_MATCH_ANYWHERE"""
+    from xontrib_ptk_shell.history import (
+        PromptToolkitHistory,
+        _cust_history_backward,
+        _cust_history_forward,
+        _cust_history_matches,
+    )
+
+    def make(inputs):
+        xession.env["XONSH_HISTORY_MATCH_ANYWHERE"] = True
+        monkeypatch.setattr(xession, "history", FakeHistory(inputs))
+        buffer = Buffer(history=PromptToolkitHistory(), enable_history_search=True)
+        load_buffer_history(buffer)
+        buffer._history_matches = MethodType(_cust_history_matches, buffer)
+        buffer.history_backward = MethodType(_cust_history_backward, buffer)
+        buffer.history_forward = MethodType(_cust_history_forward, buffer)
+        return buffer
+
+    return make
+
+
+def test_history_match_anywhere(anywhere_buffer):
+    buffer = anywhere_buffer(["git push", "ls", "git commit", "echo commit", "cd"])
+    buffer.document = Document("commit")
+
+    buffer.history_backward()
+    assert buffer.text == "git commit"
+    buffer.history_backward()
+    assert buffer.text == "echo commit"
+    buffer.history_backward()
+    assert buffer.text == "echo commit"
+    buffer.history_forward()
+    assert buffer.text == "git commit"
+    buffer.history_forward()
+    assert buffer.text == "commit"
+
+    # appended entries are indexed too
+    buffer.reset(append_to_history=True)
+    load_buffer_history(buffer)
+    buffer.document = Document("commi")
+    buffer.history_backward()
+    assert buffer.text == "commit"
+    buffer.history_backward()
+    assert buffer.text == "git commit"
+
+
+def test_history_match_anywhere_checks_only_the_candidates(anywhere_buffer):
+    buffer = anywhere_buffer(
+        [f"cmd --flag {i}" for i in range(10_000)] + ["needle in a haystack"]
+    )
+    checked = []
+    matches = buffer._history_matches
+
+    def count_matches(i):
+        checked.append(i)
+        return matches(i)
+
+    buffer._history_matches = count_matches
+    buffer.document = Document("needle")
+    buffer.history_backward()
+    assert buffer.text == "needle in a haystack"
+    # not every entry newer than it
+    assert checked == [buffer.working_index]
+
+
+def test_fuzzy_history_search(xession, monkeypatch):
+    from xontrib_ptk_shell.history import PromptToolkitHistory
+    from xontrib_ptk_shell.key_bindings import fuzzy_history_search
+
+    xession.env["PTK_HISTORY_FUZZY_SEARCH"] = True
+    inputs = ["git stash", "ls", "git status", "git status"]
+    monkeypatch.setattr(xession, "history", FakeHistory(inputs))
+    buffer = Buffer(history=PromptToolkitHistory())
+    load_buffer_history(buffer)
+    buffer.document = Document("gst", 1)
+
+    fuzzy_history_search(buffer)
+    assert [c.text for c in buffer.complete_state.completions] == [
+        "git stash",
+        "git status",
+    ]
+    assert buffer.text == "git stash"
+
+
+def test_buffer_views_history_strings():
+    from xontrib_ptk_shell.history import (
+        ChunkedThreadedHistory,
+        PromptToolkitHistory,
+        _cust_history_load,
+    )
+    from xontrib_ptk_shell.history_store import WorkingLines
+
+    inner = PromptToolkitHistory(load_prev=False)
+    inner.load_history_strings = lambda: iter(["b", "a"])
+    hist = ChunkedThreadedHistory(inner, first_chunk=1, chunk_size=1)
+    buffer = Buffer(history=hist)
+    buffer.document = Document("c")
+
+    async def load():
+        _cust_history_load(buffer)
+        await buffer._load_history_task
+
+    asyncio.run(load())
+    assert isinstance(buffer._working_lines, WorkingLines)
+    # the wrapped history shares the strings
+    assert inner._loaded_strings is hist._loaded_strings
+    assert list(buffer._working_lines) == ["a", "b", "c"]
+    assert (buffer.text, buffer.cursor_position) == ("c", 1)
+
+    buffer.history_backward()
+    assert buffer.text == "b"
+    buffer.text = "d"
+    buffer.reset(append_to_history=True)
+    assert hist.get_strings() == ["a", "b", "d"]
+    assert list(inner) == ["a", "b", "d"]
+    assert inner[-1] == "d"
+
+
+def test_history_auto_suggest(xession, monkeypatch):
+    from xontrib_ptk_shell.history import HistoryAutoSuggest, PromptToolkitHistory
+
+    xession.env["AUTO_SUGGEST"] = True
+    monkeypatch.setattr(xession, "history", FakeHistory(["git push", "git pull"]))
+    hist = PromptToolkitHistory()
+    buffer = Buffer(history=hist)
+    load_buffer_history(buffer)
+    assert hist.prefix_index.ready
+    suggester = HistoryAutoSuggest()
+
+    def suggest(text):
+        sug = suggester.get_suggestion(buffer, Document(text))
+        return None if sug is None else sug.text
+
+    assert suggest("git p") == "ush"
+    assert suggest("hg") is None
+    # the suggestion is looked up once for the prompt and the completer
+    document = Document("git p")
+    first = suggester.get_suggestion(buffer, document)
+    assert suggester.get_suggestion(buffer, document) is first
+    hist.append_string("git pull --rebase")
+    assert suggest("git p") == "ull --rebase"
+
+
+def test_history_auto_suggest_by_context(xession, monkeypatch):
+    from xontrib_ptk_shell.history import HistoryAutoSuggest, PromptToolkitHistory
+
+    xession.env.update(AUTO_SUGGEST=True, AUTO_SUGGEST_BY_CONTEXT=True, PWD="/a")
+    items = [
+        {"inp": "vim b.txt", "cwd": "/b", "rtn": 0},
+        {"inp": "vim a.txt", "cwd": "/a", "rtn": 0},
+    ]
+    monkeypatch.setattr(xession, "history", FakeHistory(items))
+    buffer = Buffer(history=PromptToolkitHistory())
+    load_buffer_history(buffer)
+
+    def suggest(text):
+        return HistoryAutoSuggest().get_suggestion(buffer, Document(text)).text
+
+    assert suggest("vim") == " a.txt"
+    xession.env["PWD"] = "/c"
+    assert suggest("vim") == " b.txt"
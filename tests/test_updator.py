@@ -0,0 +1,359 @@
+import asyncio
+import functools
+import threading
+import time
+
+import pytest
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+from prompt_toolkit.shortcuts import PromptSession
+from xonsh.prompt.base import ParsedTokens, _ParsedToken
+
+from xontrib_ptk_shell.updator import (
+    AsyncPrompt,
+    CircuitBreaker,
+    Executor,
+    InvalidateScheduler,
+    PromptUpdator,
+    git_index_mtime,
+)
+
+
+class Shell:
+    def __init__(self, prompter):
+        self.prompter = prompter
+
+    def get_lazy_ptk_kwargs(self):
+        return []
+
+
+@pytest.fixture
+def session(xession):
+    xession.env.update(ASYNC_PROMPT_THREAD_WORKERS=4, ASYNC_INVALIDATE_INTERVAL=0.05)
+    with create_pipe_input() as inp:
+        yield PromptSession(input=inp, output=DummyOutput())
+
+
+@pytest.fixture
+def redraws(session, monkeypatch):
+    """The names of the refreshed prompts, per redraw of the app"""
+    refreshed = []
+    calls = []
+
+    def refresh(prompt):
+        refreshed.append(prompt.name)
+
+    monkeypatch.setattr(AsyncPrompt, "refresh", refresh)
+
+    def invalidate():
+        calls.append(sorted(refreshed))
+        refreshed.clear()
+
+    monkeypatch.setattr(session.app, "invalidate", invalidate)
+    return calls
+
+
+def slow_field(value):
+    def field():
+        time.sleep(0.01)
+        return value
+
+    return field
+
+
+def test_one_redraw_thread_per_prompt(session, redraws, monkeypatch):
+    """Twelve fields in three prompts, that are redrawn without a thread each"""
+    started = []
+    start = threading.Thread.start
+
+    def count_start(thread):
+        started.append(thread.name)
+        start(thread)
+
+    monkeypatch.setattr(threading.Thread, "start", count_start)
+    updator = PromptUpdator(Shell(session))
+    prompts = {}
+    for name in ("message", "rprompt", "bottom_toolbar"):
+        prompt = prompts[name] = updator.add(name)
+        prompt.tokens = ParsedTokens(
+            [_ParsedToken("", f"field{idx}") for idx in range(4)], ""
+        )
+        for idx in range(4):
+            prompt.submit_section(slow_field(f"{name}{idx}"), f"{name}{idx}", idx)
+
+    async def run():
+        updator.start()
+        await asyncio.sleep(0.5)
+
+    asyncio.run(run())
+    for name, prompt in prompts.items():
+        assert prompt.tokens.process() == "".join(f"{name}{idx}" for idx in range(4))
+    # only the workers of the pool
+    assert len(started) <= 4
+    assert 1 <= len(redraws) < 12
+    assert {name for names in redraws for name in names} == set(prompts)
+
+
+def test_coroutine_fields_use_no_threads(session, redraws, monkeypatch):
+    started = []
+    start = threading.Thread.start
+
+    def count_start(thread):
+        started.append(thread.name)
+        start(thread)
+
+    monkeypatch.setattr(threading.Thread, "start", count_start)
+    cancelled = []
+
+    async def field(value):
+        await asyncio.sleep(0.01)
+        return value
+
+    async def hanging_field():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    updator = PromptUpdator(Shell(session))
+    prompt = updator.add("message")
+    prompt.tokens = ParsedTokens([_ParsedToken("", f"f{idx}") for idx in range(4)], "")
+    for idx in range(3):
+        prompt.submit_section(functools.partial(field, f"v{idx}"), f"f{idx}", idx)
+    prompt.submit_section(hanging_field, "f3", 3)
+
+    async def run():
+        updator.start()
+        await asyncio.sleep(0.2)
+
+    # the prompt is done, its tasks are cancelled
+    asyncio.run(run())
+    assert prompt.tokens.process() == "v0v1v2"
+    assert cancelled == [True]
+    assert redraws
+    # only for loading the lazy attributes of the prompt
+    assert len(started) <= 1
+
+
+def test_redraw_without_a_loop(session, redraws):
+    scheduler = InvalidateScheduler(session)
+    prompt = AsyncPrompt("rprompt", session, None, scheduler)
+    prompt.invalidate()
+    assert redraws == [["rprompt"]]
+
+
+def test_git_index_mtime(tmp_path):
+    (tmp_path / "repo" / ".git").mkdir(parents=True)
+    (tmp_path / "repo" / "src").mkdir()
+    git_dir = tmp_path / "repo" / ".git"
+    # not added to yet
+    assert git_index_mtime(str(tmp_path / "repo" / "src")) == git_dir.stat().st_mtime_ns
+    index = tmp_path / "repo" / ".git" / "index"
+    index.write_text("")
+    expected = index.stat().st_mtime_ns
+    assert git_index_mtime(str(tmp_path / "repo" / "src")) == expected
+    assert git_index_mtime(str(tmp_path)) is None
+
+
+@pytest.mark.parametrize("relative", [False, True])
+def test_git_index_mtime_of_a_worktree(tmp_path, relative):
+    git_dir = tmp_path / "repo" / ".git" / "worktrees" / "feature"
+    git_dir.mkdir(parents=True)
+    index = git_dir / "index"
+    index.write_text("")
+    worktree = tmp_path / "feature"
+    worktree.mkdir()
+    pointer = "../repo/.git/worktrees/feature" if relative else str(git_dir)
+    (worktree / ".git").write_text(f"gitdir: {pointer}\n")
+    assert git_index_mtime(str(worktree)) == index.stat().st_mtime_ns
+    # an unresolved pointer still changes with the file
+    (worktree / ".git").write_text("gitdir: missing\n")
+    expected = (worktree / ".git").stat().st_mtime_ns
+    assert git_index_mtime(str(worktree)) == expected
+
+
+def test_fresh_field_values_are_reused(xession):
+    xession.env.update(
+        ASYNC_PROMPT_THREAD_WORKERS=2,
+        ASYNC_PROMPT_CACHE_TTL={"gitstatus": 60},
+        ASYNC_PROMPT_CACHE_KEYS={"gitstatus": ("cwd",)},
+        PWD="/repo",
+    )
+    executor = Executor()
+    calls = []
+
+    def field():
+        calls.append(None)
+        return f"v{len(calls)}"
+
+    def submit(name="gitstatus"):
+        # every submit is for a new prompt
+        executor.new_cycle()
+        future, value, _ = executor.submit(field, name)
+        if future is not None:
+            future.result()
+        return future is not None, value
+
+    assert submit() == (True, "{gitstatus}")
+    # served without evaluating it again
+    assert submit() == (False, "v1")
+    assert len(calls) == 1
+    xession.env["PWD"] = "/other"
+    assert submit() == (True, "{RESET}{#d3d3d3}v1{RESET}")
+    assert submit() == (False, "v2")
+    # fields without a ttl are always evaluated again
+    assert submit("cwd") == (True, "{cwd}")
+    assert submit("cwd")[0]
+
+
+@pytest.mark.parametrize("is_coroutine", [False, True])
+def test_shared_fields_are_evaluated_once(session, redraws, is_coroutine):
+    calls = []
+
+    def sync_field():
+        calls.append(None)
+        time.sleep(0.01)
+        return "user"
+
+    async def async_field():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return "user"
+
+    field = async_field if is_coroutine else sync_field
+    updator = PromptUpdator(Shell(session))
+    prompts = []
+    for name in ("message", "rprompt", "bottom_toolbar"):
+        prompt = updator.add(name)
+        prompt.tokens = ParsedTokens([_ParsedToken("", "user_name")], "")
+        prompt.submit_section(field, "user_name", 0)
+        prompts.append(prompt)
+
+    async def run():
+        updator.start()
+        await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    assert [prompt.tokens.process() for prompt in prompts] == ["user"] * 3
+
+
+def run_prompts(updator):
+    """Run the prompts until all their fields are updated"""
+
+    async def run():
+        updator.start()
+        await asyncio.wait(list(updator.futures.values()), timeout=5)
+
+    asyncio.run(run())
+
+
+def test_hung_thread_does_not_block_the_pool(session, redraws, xession):
+    xession.env.update(ASYNC_PROMPT_THREAD_WORKERS=1, ASYNC_PROMPT_TIMEOUT=0.05)
+    release = threading.Event()
+    calls = []
+    jobs = []
+
+    def hanging_field():
+        calls.append(None)
+        release.wait(5)
+        return "kube"
+
+    fallback = "{BACKGROUND_YELLOW}{TIMEOUT:kube}{RESET}"
+    updator = PromptUpdator(Shell(session))
+
+    def prompt_once():
+        prompt = updator.add("message")
+        prompt.tokens = ParsedTokens(
+            [_ParsedToken("", "kube"), _ParsedToken("", "user")], ""
+        )
+        value = prompt.submit_section(hanging_field, "kube", 0)
+        jobs.append(updator.executor.jobs.get("kube"))
+        prompt.submit_section(slow_field("user"), "user", 1)
+        run_prompts(updator)
+        return value, prompt.tokens.process()
+
+    try:
+        # the other field is run by another worker
+        assert prompt_once() == ("{kube}", fallback + "user")
+        # not evaluated again while it is running
+        assert prompt_once() == (fallback, "user")
+        assert len(calls) == 1
+    finally:
+        release.set()
+    # the thread of the first prompt
+    jobs[0][0].result(5)
+    # evaluated again once it returned
+    assert prompt_once()[1] == "kubeuser"
+    assert len(calls) == 2
+
+
+def test_circuit_breaker(session, redraws, xession):
+    xession.env.update(
+        ASYNC_PROMPT_FIELD_TIMEOUT={"kube": 0.02},
+        ASYNC_PROMPT_BREAKER_THRESHOLD=2,
+        ASYNC_PROMPT_BREAKER_COOLDOWN=30,
+    )
+    calls = []
+    now = [0.0]
+
+    async def hanging_field():
+        calls.append(None)
+        await asyncio.sleep(10)
+
+    updator = PromptUpdator(Shell(session))
+    updator.executor.breaker.clock = lambda: now[0]
+
+    def prompt_once():
+        prompt = updator.add("message")
+        prompt.tokens = ParsedTokens([_ParsedToken("", "kube")], "")
+        value = prompt.submit_section(hanging_field, "kube", 0)
+        run_prompts(updator)
+        return value, prompt.tokens.process()
+
+    fallback = "{BACKGROUND_YELLOW}{TIMEOUT:kube}{RESET}"
+    assert prompt_once() == ("{kube}", fallback)
+    assert prompt_once() == ("{kube}", fallback)
+    # open, the fallback is shown without evaluating it
+    assert prompt_once() == (fallback, "")
+    assert len(calls) == 2
+    now[0] += 30
+    # tried once more after the cooldown
+    assert prompt_once() == ("{kube}", fallback)
+    assert len(calls) == 3
+    assert prompt_once()[0] == fallback
+
+
+def test_breaker_is_closed_on_success(xession):
+    xession.env.update(ASYNC_PROMPT_BREAKER_THRESHOLD=2)
+    breaker = CircuitBreaker()
+    breaker.timed_out("kube")
+    breaker.succeeded("kube")
+    breaker.timed_out("kube")
+    assert not breaker.is_open("kube")
+    breaker.timed_out("kube")
+    assert breaker.is_open("kube")
+
+
+def test_field_shown_twice_in_a_prompt(session, redraws):
+    calls = []
+    submitted = threading.Event()
+
+    def field():
+        calls.append(None)
+        submitted.wait(5)
+        return "0"
+
+    updator = PromptUpdator(Shell(session))
+    prompt = updator.add("message")
+    prompt.tokens = ParsedTokens(
+        [_ParsedToken("", "ret_code"), _ParsedToken(" "), _ParsedToken("", "ret_code")],
+        "",
+    )
+    prompt.submit_section(field, "ret_code", 0)
+    prompt.submit_section(field, "ret_code", 2)
+    submitted.set()
+    run_prompts(updator)
+    assert prompt.tokens.process() == "0 0"
+    assert len(calls) == 1
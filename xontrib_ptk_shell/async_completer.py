@@ -0,0 +1,155 @@
+"""Run the xonsh completers in a thread, without blocking the prompt."""
+
+import asyncio
+import collections
+import threading
+import typing as tp
+
+from prompt_toolkit.application.current import get_app
+from prompt_toolkit.completion import Completer
+from xonsh.built_ins import XSH
+
+from .completer import (
+    SPLIT_CHARS,
+    CompletionQuery,
+    PromptToolkitCompleter,
+    sort_key,
+    with_suggestion,
+)
+from .completion_trace import TRACE
+
+
+class AsyncCompleter(Completer):
+    """Replacement for prompt_toolkit's ``ThreadedCompleter``.
+
+    The completions are streamed to the menu while the xonsh completers
+    generate them. When the text changes, the completers' thread is stopped
+    and its completions are dropped, so that prompt_toolkit starts over with
+    the new text. While typing, the completers are run only after
+    ``$COMPLETION_IN_THREAD_DEBOUNCE`` seconds without a keystroke.
+
+    Parameters
+    ----------
+    completer
+        the completer whose completions are streamed
+    get_document
+        returns the current document, defaults to that of the current buffer
+    poll_interval
+        seconds between the checks whether the text changed
+    """
+
+    def __init__(
+        self,
+        completer: PromptToolkitCompleter,
+        get_document: tp.Optional[tp.Callable] = None,
+        poll_interval=0.02,
+    ):
+        self.completer = completer
+        self.get_document = get_document or (
+            lambda: get_app().current_buffer.document
+        )
+        self.poll_interval = poll_interval
+
+    def get_completions(self, document, complete_event):
+        return self.completer.get_completions(document, complete_event)
+
+    def _is_stale(self, document) -> bool:
+        return self.get_document() != document
+
+    async def get_completions_async(self, document, complete_event):
+        completer = self.completer
+        query = completer.get_query(document, complete_event)
+        if query is None:
+            return
+        result = completer.lookup(query)
+        if result is not None:
+            for completion in completer.to_ptk_completions(
+                query, result.completions, result.plen
+            ):
+                yield completion
+            return
+
+        if not complete_event.completion_requested:
+            await asyncio.sleep(XSH.env.get("COMPLETION_IN_THREAD_DEBOUNCE", 0.05))
+            if self._is_stale(document):
+                return
+
+        loop = asyncio.get_running_loop()
+        pending: tp.Deque[tp.Tuple[tp.Any, int]] = collections.deque()
+        done = asyncio.Event()
+        stop = threading.Event()
+        error: tp.List[Exception] = []
+
+        def run():
+            try:
+                for item in completer.stream(query, stop):
+                    pending.append(item)
+            except Exception as ex:
+                error.append(ex)
+            finally:
+                try:
+                    loop.call_soon_threadsafe(done.set)
+                except RuntimeError:
+                    pass  # the event loop is closed
+
+        # not in the loop's executor, closing the loop would wait for it
+        threading.Thread(target=run, name="xonsh-completer", daemon=True).start()
+        try:
+            batches = self._receive(document, pending, done, error)
+            async for completion in self._present(query, batches):
+                yield completion
+        finally:
+            stop.set()
+
+    async def _receive(self, document, pending: tp.Deque, done, error: tp.List):
+        """Yield the pending ``(completion, plen)`` in batches every
+        ``poll_interval``, until they are all generated or the text changed."""
+        while True:
+            try:
+                await asyncio.wait_for(done.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            finished = done.is_set()
+            if self._is_stale(document):
+                return
+            if error:
+                raise error[0]
+            batch = []
+            while pending:
+                batch.append(pending.popleft())
+            if batch:
+                yield batch
+            if finished:
+                return
+
+    async def _present(self, query: CompletionQuery, batches):
+        """Like ``PromptToolkitCompleter.to_ptk_completions`` for the batches.
+
+        Since not all completions are known yet, the displayed part is cut
+        after the last split symbol of the prefix instead of their common prefix.
+        Each batch is sorted like the cached completions, but the batches are
+        shown in the order they were generated in.
+        """
+        completer = self.completer
+        prefix = query.prefix
+        pre = max(prefix.rfind(char) for char in SPLIT_CHARS) + 1
+        sug_comp = None
+        if with_suggestion():
+            sug_comp = completer.suggestion_completion(query.document, query.line)
+            if sug_comp is not None:
+                yield completer.to_ptk_completion(sug_comp, len(prefix), pre)
+
+        def construct(item):
+            return completer.to_ptk_completion(item[0], item[1], pre)
+
+        async for batch in batches:
+            batch.sort(key=lambda item: sort_key(item[0]))
+            items = (item for item in batch if item[0] != sug_comp)
+            if TRACE.enabled:
+                completions = TRACE.timed_map(
+                    "Completion construction", construct, items
+                )
+            else:
+                completions = map(construct, items)
+            for completion in completions:
+                yield completion
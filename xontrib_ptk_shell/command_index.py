@@ -0,0 +1,137 @@
+"""Index of the command names, for completing the first word of a command.
+
+Completing the first word is the most frequent completion. The xonsh
+completers filter all the commands on ``$PATH`` and the aliases for it on
+every keystroke. This keeps them sorted, so the commands starting with a
+prefix are found by a binary search. The index is rebuilt in the background
+when ``$PATH`` or the number of aliases change, or when it gets older than
+``max_age`` seconds, since executables may have been installed or aliases
+renamed. Meanwhile the previous index is used.
+"""
+
+import bisect
+import re
+import threading
+import time
+import typing as tp
+
+from xonsh.built_ins import XSH
+from xonsh.completers.tools import RichCompletion
+
+# what looks like the name of a command, not a path or python code
+COMMAND_NAME = re.compile(r"[\w.+-]+")
+
+
+class Index(tp.NamedTuple):
+    # the state of the environment it was built for
+    signature: tp.Tuple
+    built: float
+    # the completions sorted by their names
+    names: tp.List[str]
+    completions: tp.List[RichCompletion]
+    # the same sorted by their case folded names
+    folded_names: tp.List[str]
+    folded: tp.List[RichCompletion]
+
+
+def _signature() -> tp.Tuple:
+    env = XSH.env
+    aliases = XSH.aliases
+    # only the names of the aliases are indexed, and counting them is cheap
+    return (
+        tuple(env.get("PATH") or ()),
+        id(aliases),
+        len(aliases or ()),
+        bool(env.get("CMD_COMPLETIONS_SHOW_DESC")),
+    )
+
+
+def _search(names: tp.List[str], completions: tp.List, prefix: str) -> tp.List:
+    start = bisect.bisect_left(names, prefix)
+    # the names starting with the prefix sort before it followed by the last
+    # character
+    end = bisect.bisect_left(names, prefix + "\U0010ffff", start)
+    return completions[start:end]
+
+
+class CommandIndex:
+    """Sorted names of the commands and aliases.
+
+    Parameters
+    ----------
+    max_age
+        seconds after which the index is rebuilt, to find new executables
+    """
+
+    def __init__(self, max_age=5.0):
+        self.max_age = max_age
+        self._index: tp.Optional[Index] = None
+        self._building = False
+        self._lock = threading.Lock()
+
+    def build(self, signature: tp.Optional[tp.Tuple] = None) -> Index:
+        """Read the commands, like ``xonsh.completers.commands.complete_command``."""
+        signature = _signature() if signature is None else signature
+        show_desc = signature[-1]
+        completions = []
+        for name, (path, is_alias) in XSH.commands_cache.iter_commands():
+            description = ""
+            if show_desc:
+                description = "Alias" if is_alias else path
+            completions.append(
+                RichCompletion(name, append_space=True, description=description)
+            )
+        completions.sort()
+        folded = sorted(completions, key=str.casefold)
+        index = Index(
+            signature,
+            time.monotonic(),
+            [str(comp) for comp in completions],
+            completions,
+            [comp.casefold() for comp in folded],
+            folded,
+        )
+        self._index = index
+        return index
+
+    def _refresh(self, signature: tp.Tuple):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def run():
+            try:
+                self.build(signature)
+            finally:
+                with self._lock:
+                    self._building = False
+
+        threading.Thread(target=run, name="xonsh-command-index", daemon=True).start()
+
+    def get(self) -> tp.Optional[Index]:
+        """The index, ``None`` until it was built the first time.
+
+        A new one is built in the background when it is outdated.
+        """
+        index = self._index
+        signature = _signature()
+        if (
+            index is None
+            or index.signature != signature
+            or time.monotonic() - index.built > self.max_age
+        ):
+            self._refresh(signature)
+        return index
+
+    def complete(self, prefix: str) -> tp.Optional[tp.List[RichCompletion]]:
+        """The commands starting with ``prefix``, ``None`` if the index is
+        not built yet or ``prefix`` is not a command name."""
+        if not COMMAND_NAME.fullmatch(prefix):
+            return None
+        index = self.get()
+        if index is None:
+            return None
+        if XSH.env.get("CASE_SENSITIVE_COMPLETIONS"):
+            return _search(index.names, index.completions, prefix)
+        return _search(index.folded_names, index.folded, prefix.casefold())
@@ -1,12 +1,187 @@
 """Completer implementation to use with prompt_toolkit."""
+import functools
+import itertools
 import os
+import threading
+import time
+import typing as tp
 
-from prompt_toolkit.application.current import get_app
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 from prompt_toolkit.completion import Completer, Completion
+from prompt_toolkit.document import Document
 from xonsh.built_ins import XSH
 from xonsh.completers.tools import RichCompletion
 
+from .command_index import CommandIndex
+from .completion_cache import CachedCompletions, CompletionCache, typed_word
+from .completion_trace import TRACE
+from .history import HistoryAutoSuggest
+from .parallel_completer import ParallelCompletions
+from .path_cache import DirectoryListings, token_directory
+
+# the common prefix is displayed up to the last of these
+SPLIT_CHARS = r"/\.:@,"
+_QUOTES = "'\""
+
+
+class CompletionQuery(tp.NamedTuple):
+    """What to complete, with the aliases of the current line expanded."""
+
+    document: Document
+    line: str
+    prefix: str
+    line_ex: str
+    begidx: int
+    endidx: int
+    multiline_text: str
+    cursor_index: int
+    # the directory of the completed path, and its modification time if known
+    directory: tp.Optional[str] = None
+    stamp: tp.Optional[int] = None
+
+    @property
+    def before(self) -> str:
+        """The text before the cursor."""
+        return self.multiline_text[: self.cursor_index]
+
+    @property
+    def after(self) -> str:
+        """The text after the cursor."""
+        return self.multiline_text[self.cursor_index :]
+
+
+def with_suggestion() -> bool:
+    """Whether the auto-suggestion is shown among the completions."""
+    env = XSH.env
+    return bool(env.get("AUTO_SUGGEST") and env.get("AUTO_SUGGEST_IN_COMPLETIONS"))
+
+
+def sort_key(completion: str) -> str:
+    # like xonsh.completer.Completer.complete
+    return completion.lstrip("'\"").lower()
+
+
+def _sort(completions: tp.Iterable) -> tp.Tuple:
+    return tuple(sorted(completions, key=sort_key))
+
+
+def common_prefix(completions: tp.Sequence[str]) -> str:
+    """The common prefix of the completions without quotes, up to the
+    last ``SPLIT_CHARS``."""
+    common = os.path.commonprefix(completions)
+    # unless some start with a quote, stripping them only changes the last part
+    if not common or common[0] in _QUOTES:
+        common = os.path.commonprefix([a.strip(_QUOTES) for a in completions])
+    # Find last split symbol, do not trim the last part
+    while common:
+        if common[-1] in SPLIT_CHARS:
+            break
+        common = common[:-1]
+    return common
+
+
+class AliasExpansions:
+    """Memo of ``Aliases.expand_alias`` for the lines being completed.
+
+    Only the first word of a line is expanded, so a memoized expansion is
+    used as long as the alias of that word did not change.
+
+    Parameters
+    ----------
+    maxsize
+        number of memoized lines, the memo is cleared when it grows larger
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._aliases = None
+        # (line, cursor index) -> the alias of its first word, and the expansion
+        self._memo: tp.Dict[tp.Tuple[str, int], tp.Tuple[tp.Any, str]] = {}
+
+    def expand(self, line: str, cursor_index: int) -> str:
+        aliases = XSH.aliases
+        if aliases is not self._aliases:
+            self._aliases = aliases
+            self._memo.clear()
+        words = line.split(maxsplit=1)
+        alias = aliases.get(words[0]) if words else None
+        key = (line, cursor_index)
+        memoized = self._memo.get(key)
+        if memoized is not None and memoized[0] == alias:
+            return memoized[1]
+        if len(self._memo) >= self.maxsize:
+            self._memo.clear()
+        expanded = aliases.expand_alias(line, cursor_index)
+        self._memo[key] = (alias, expanded)
+        return expanded
+
+
+def to_ptk_completion(comp, plen: int, pre: int) -> Completion:
+    # do not display quote
+    if isinstance(comp, RichCompletion):
+        # ptk doesn't render newlines. This can be removed once it is supported.
+        desc = (
+            comp.description.replace(os.linesep, " ")
+            if comp.description
+            else None
+        )
+        return Completion(
+            comp,
+            -comp.prefix_len if comp.prefix_len is not None else -plen,
+            display=comp.display or comp[pre:].strip("'\""),
+            display_meta=desc,
+            style=comp.style or "",
+        )
+    elif isinstance(comp, Completion):
+        return comp
+    disp = comp[pre:].strip("'\"")
+    return Completion(comp, -plen, display=disp)
+
+
+class CompletionObjects:
+    """The prompt_toolkit ``Completion`` of each completion.
+
+    The same completions are generated again and again, like the commands
+    and the environment variables, so their ``Completion`` is only created
+    once. Rich completions are told apart by all their attributes.
+
+    Parameters
+    ----------
+    maxsize
+        number of kept ``Completion`` objects, they are all dropped when it
+        grows larger
+    """
+
+    def __init__(self, maxsize=20_000):
+        self.maxsize = maxsize
+        self._objects: tp.Dict[tp.Tuple, Completion] = {}
+
+    def get(self, comp, plen: int, pre: int) -> Completion:
+        if isinstance(comp, RichCompletion):
+            key: tp.Tuple = (
+                comp,
+                plen,
+                pre,
+                comp.prefix_len,
+                comp.display,
+                comp.description,
+                comp.style,
+                comp.append_closing_quote,
+                comp.append_space,
+            )
+        elif type(comp) is str:
+            key = (comp, plen, pre)
+        else:
+            return to_ptk_completion(comp, plen, pre)
+        try:
+            completion = self._objects.get(key)
+        except TypeError:  # formatted text as display
+            return to_ptk_completion(comp, plen, pre)
+        if completion is None:
+            if len(self._objects) >= self.maxsize:
+                self._objects.clear()
+            completion = self._objects[key] = to_ptk_completion(comp, plen, pre)
+        return completion
+
 
 class PromptToolkitCompleter(Completer):
     """Simple prompt_toolkit Completer object.
@@ -14,6 +189,9 @@ class PromptToolkitCompleter(Completer):
     It just redirects requests to normal Xonsh completer.
     """
 
+    # like ``Buffer.max_number_of_completions``, more are not shown
+    max_completions = 10_000
+
     def __init__(self, completer, ctx, shell):
         """Takes instance of xonsh.completer.Completer, the xonsh execution
         context, and the shell instance itself.
@@ -21,22 +199,54 @@ class PromptToolkitCompleter(Completer):
         self.completer = completer
         self.ctx = ctx
         self.shell = shell
-        self.hist_suggester = AutoSuggestFromHistory()
+        self.hist_suggester = HistoryAutoSuggest()
+        self.cache = CompletionCache()
+        self.expansions = AliasExpansions()
+        self.listings = DirectoryListings()
+        self.completion_objects = CompletionObjects()
+        self.commands = CommandIndex()
+        # text before and after the cursor, and the completions last shown for it
+        self._last: tp.Optional[tp.Tuple[str, str, CachedCompletions]] = None
+        # the completions of paths, that may be directory listings
+        self._unchecked: tp.List[tp.Tuple[CompletionQuery, CachedCompletions]] = []
 
-    def get_completions(self, document, complete_event):
-        """Returns a generator for list of completions."""
-        env = XSH.env
-        should_complete = complete_event.completion_requested or env.get(
+    def reset(self):
+        """Forget the completions of the last prompt, except for the listings
+        of directories that did not change since."""
+        for query, result in self._unchecked:
+            result.listing = self.listings.lists(
+                query.directory, query.prefix, result.completions, query.stamp
+            )
+        self._unchecked.clear()
+        self.cache.clear(keep_stamped=True)
+        self._last = None
+
+    def _narrow_last(self, before: str, after: str) -> tp.Optional[CachedCompletions]:
+        """Filter the last completions, if only word characters were typed since.
+
+        Like the cache, this is disabled with a ``$COMPLETIONS_CACHE_SIZE`` of 0.
+        """
+        last = self._last
+        if last is None or last[1] != after or not self.cache.enabled:
+            return None
+        typed = typed_word(before, last[0])
+        if not typed:
+            return None
+        return last[2].narrow(before, typed)
+
+    def get_query(self, document, complete_event) -> tp.Optional[CompletionQuery]:
+        """Return what to complete, or ``None`` if nothing should be completed."""
+        should_complete = complete_event.completion_requested or XSH.env.get(
             "UPDATE_COMPLETIONS_ON_KEYPRESS"
         )
         #  Only generate completions when the user hits tab.
         if not should_complete or self.completer is None:
-            return
-        # generate actual completions
+            return None
         line = document.current_line
 
         endidx = document.cursor_position_col
-        line_ex = XSH.aliases.expand_alias(line, endidx)
+        with TRACE.span("alias expansion"):
+            line_ex = self.expansions.expand(line, endidx)
 
         begidx = line[:endidx].rfind(" ") + 1 if line[:endidx].rfind(" ") >= 0 else 0
         prefix = line[begidx:endidx]
@@ -52,68 +262,191 @@ class PromptToolkitCompleter(Completer):
                 + multiline_text[line_start + len(line) :]
             )
             cursor_index += expand_offset
-
-        # get normal completions
-        completions, plen = self.completer.complete(
+        directory = token_directory(prefix)
+        stamp = None if directory is None else self.listings.stamp(directory)
+        return CompletionQuery(
+            document,
+            line,
             prefix,
             line_ex,
             begidx + expand_offset,
             endidx + expand_offset,
-            self.ctx,
-            multiline_text=multiline_text,
-            cursor_index=cursor_index,
+            multiline_text,
+            cursor_index,
+            directory,
+            stamp,
         )
 
-        # completions from auto suggest
-        sug_comp = None
-        if env.get("AUTO_SUGGEST") and env.get("AUTO_SUGGEST_IN_COMPLETIONS"):
-            sug_comp = self.suggestion_completion(document, line)
-            if sug_comp is None:
-                pass
-            elif len(completions) == 0:
-                completions = (sug_comp,)
+    def lookup(self, query: CompletionQuery) -> tp.Optional[CachedCompletions]:
+        """Return the completions if they are known without running the completers.
+
+        While a word is typed, the last completions are narrowed.
+        The first word of a command may be completed from the command index.
+        """
+        before, after = query.before, query.after
+        with TRACE.span("cache lookup"):
+            result = self._narrow_last(before, after)
+            if result is not None:
+                # found again when the typed characters are deleted
+                self.cache.put(before, after, result, query.stamp)
             else:
-                completions = set(completions)
-                completions.discard(sug_comp)
-                completions = (sug_comp,) + tuple(sorted(completions))
-        # reserve space, if needed.
-        if len(completions) <= 1:
-            pass
-        elif len(os.path.commonprefix(completions)) <= len(prefix):
-            self.reserve_space()
-        # Find common prefix (strip quoting)
-        c_prefix = os.path.commonprefix([a.strip("'\"") for a in completions])
-        # Find last split symbol, do not trim the last part
-        while c_prefix:
-            if c_prefix[-1] in r"/\.:@,":
+                result = self.cache.get(before, after, query.stamp)
+        if result is None and XSH.env.get("COMPLETION_COMMAND_INDEX"):
+            with TRACE.span("command index"):
+                result = self.complete_command(query)
+            if result is not None:
+                self._remember(query, result)
+        if result is not None:
+            self._last = (before, after, result)
+        elif query.directory is not None and query.stamp is None:
+            # the completers are run, meanwhile the directories around are read
+            name = os.path.basename(query.prefix)
+            self.listings.prefetch(query.directory, name)
+        return result
+
+    def complete_command(
+        self, query: CompletionQuery
+    ) -> tp.Optional[CachedCompletions]:
+        """Complete the first word of the input from the command index."""
+        prefix = query.prefix
+        if not prefix or query.before != prefix or query.after[:1].strip():
+            return None
+        completions = self.commands.complete(prefix)
+        if completions is None:
+            return None
+        return CachedCompletions.create(
+            _sort(completions), len(prefix), query.before
+        )
+
+    def _remember(self, query: CompletionQuery, result: CachedCompletions):
+        before, after = query.before, query.after
+        if query.stamp is not None:
+            # checked once the prompt is done, by then the directory is listed
+            self.listings.list_later(query.directory)
+            self._unchecked.append((query, result))
+        self.cache.put(before, after, result, query.stamp)
+        self._last = (before, after, result)
+
+    def complete(self, query: CompletionQuery) -> CachedCompletions:
+        """Run the xonsh completers."""
+        TRACE.instrument()
+        with TRACE.span("completers"):
+            completions, plen = self.completer.complete(
+                query.prefix,
+                query.line_ex,
+                query.begidx,
+                query.endidx,
+                self.ctx,
+                multiline_text=query.multiline_text,
+                cursor_index=query.cursor_index,
+            )
+        result = CachedCompletions.create(
+            tuple(completions),
+            plen,
+            query.before,
+            XSH.env.get("COMPLETION_QUERY_LIMIT"),
+        )
+        self._remember(query, result)
+        return result
+
+    def stream(
+        self, query: CompletionQuery, stop: threading.Event
+    ) -> tp.Iterator[tp.Tuple[tp.Any, int]]:
+        """Run the xonsh completers, yielding ``(completion, plen)`` while they
+        are generated. Meant to be run in a thread.
+
+        Stops without a result once ``stop`` is set. The completions are
+        cached if all of them were generated.
+        """
+        generate = getattr(self.completer, "generate_completions", None)
+        if generate is None:
+            result = self.complete(query)
+            for completion in result.completions:
+                yield completion, result.plen
+            return
+
+        TRACE.instrument()
+        start = time.perf_counter_ns()
+        env = XSH.env
+        ctx = self.ctx or {}
+        context = self.completer.parse(query.multiline_text, query.cursor_index, ctx)
+        old_args = (query.prefix, query.line_ex, query.begidx, query.endidx, ctx)
+        limit = env.get("COMPLETION_QUERY_LIMIT")
+        trace = env.get("XONSH_TRACE_COMPLETIONS")
+        if env.get("COMPLETION_IN_PARALLEL"):
+            generated: tp.Iterable = ParallelCompletions(
+                context, old_args, stop, env.get("COMPLETION_DEADLINE")
+            )
+        else:
+            generated = generate(context, old_args, trace)
+        completions: tp.Dict[tp.Any, None] = {}
+        plen = 0
+        for completion, plen in generated:
+            if stop.is_set():
+                return
+            if completion in completions:
+                continue
+            completions[completion] = None
+            yield completion, plen
+            if limit and len(completions) >= limit:
                 break
-            c_prefix = c_prefix[:-1]
+        if TRACE.enabled:
+            TRACE.add("completers", start, count=len(completions))
+        dropped = getattr(generated, "dropped", None)
+        if dropped and trace:
+            print(f"TRACE COMPLETIONS: Dropped the slow completers {dropped}")
+        # without the dropped completers, the next request should run them again
+        if not stop.is_set() and not dropped:
+            with TRACE.span("sorting", count=len(completions)):
+                completions = _sort(completions)
+            result = CachedCompletions.create(completions, plen, query.before, limit)
+            self._remember(query, result)
+
+    def get_completions(self, document, complete_event):
+        """Returns a generator for list of completions."""
+        query = self.get_query(document, complete_event)
+        if query is None:
+            return
+        result = self.lookup(query)
+        if result is None:
+            result = self.complete(query)
+        yield from self.to_ptk_completions(query, result.completions, result.plen)
+
+    def to_ptk_completions(self, query: CompletionQuery, completions, plen):
+        """Yield the completions in the format of prompt_toolkit.
+
+        Only the first ``max_completions`` are used, since the buffer ignores
+        the rest. The ``Completion`` objects are created as they are consumed.
+        The auto-suggestion is put in front of the sorted completions.
+        """
+        document, prefix = query.document, query.prefix
+        limit = self.max_completions
+        with TRACE.span("suggestion merge"):
+            # completions from auto suggest
+            sug_comp = None
+            if with_suggestion():
+                sug_comp = self.suggestion_completion(document, query.line)
+            if sug_comp is None:
+                window = tuple(itertools.islice(completions, limit))
+            else:
+                others = (comp for comp in completions if comp != sug_comp)
+                window = (sug_comp,) + tuple(itertools.islice(others, limit - 1))
+        with TRACE.span("common prefix"):
+            c_prefix = common_prefix(window)
         # yield completions
         if sug_comp is None:
-            pre = min(document.cursor_position_col - begidx, len(c_prefix))
+            pre = min(len(prefix), len(c_prefix))
         else:
             pre = len(c_prefix)
-        for comp in completions:
-            # do not display quote
-            if isinstance(comp, RichCompletion):
-                # ptk doesn't render newlines. This can be removed once it is supported.
-                desc = (
-                    comp.description.replace(os.linesep, " ")
-                    if comp.description
-                    else None
-                )
-                yield Completion(
-                    comp,
-                    -comp.prefix_len if comp.prefix_len is not None else -plen,
-                    display=comp.display or comp[pre:].strip("'\""),
-                    display_meta=desc,
-                    style=comp.style or "",
-                )
-            elif isinstance(comp, Completion):
-                yield comp
-            else:
-                disp = comp[pre:].strip("'\"")
-                yield Completion(comp, -plen, display=disp)
+        if TRACE.enabled:
+            construct = functools.partial(self.to_ptk_completion, plen=plen, pre=pre)
+            yield from TRACE.timed_map("Completion construction", construct, window)
+            return
+        for comp in window:
+            yield self.to_ptk_completion(comp, plen, pre)
+
+    def to_ptk_completion(self, comp, plen: int, pre: int) -> Completion:
+        return self.completion_objects.get(comp, plen, pre)
 
     def suggestion_completion(self, document, line):
         """Provides a completion based on the current auto-suggestion."""
@@ -124,25 +457,3 @@ class PromptToolkitCompleter(Completer):
         comp, _, _ = sug.text.partition(" ")
         _, _, prev = line.rpartition(" ")
         return prev + comp
-
-    def reserve_space(self):
-        """Adjust the height for showing autocompletion menu."""
-        app = get_app()
-        render = app.renderer
-
-        window = None
-        try:
-            # this raises error sometimes when COMPLETE_WHILE_TYPE is enabled
-            window = app.layout.current_window
-        except Exception:
-            pass
-
-        if window and window.render_info:
-            h = window.render_info.content_height
-            r = XSH.env.get("COMPLETIONS_MENU_ROWS")
-            size = h + r
-            last_h = render._last_screen.height if render._last_screen else 0
-            last_h = max(render._min_available_height, last_h)
-            if last_h < size:
-                if render._last_screen:
-                    render._last_screen.height = size
@@ -0,0 +1,227 @@
+"""Cache of the completions computed by the xonsh completer."""
+
+import collections
+import re
+import threading
+import typing as tp
+
+from xonsh.built_ins import XSH
+from xonsh.completers.tools import RichCompletion, get_filter_function
+
+# environment variables that change the completions of the same text
+_ENV_NAMES = (
+    "CASE_SENSITIVE_COMPLETIONS",
+    "COMPLETIONS_BRACKETS",
+    "FUZZY_PATH_COMPLETION",
+    "SUBSEQUENCE_PATH_COMPLETION",
+)
+# typing these can not change what is being completed, only narrow it
+_TRAILING_WORD = re.compile(r"[\w-]*\Z")
+
+Completions = tp.Tuple[tp.Any, ...]
+
+
+class CacheInfo(tp.NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+def typed_word(before: str, previous: str) -> int:
+    """Number of word characters typed after the ``previous`` text before
+    the cursor. ``0`` if anything else changed."""
+    typed = len(before) - len(previous)
+    if typed <= 0 or not before.startswith(previous):
+        return 0
+    if len(_TRAILING_WORD.search(before).group()) < typed:
+        return 0
+    return typed
+
+
+class CachedCompletions:
+    """Completions and the length of the text before the cursor they replace."""
+
+    __slots__ = ("completions", "plen", "listing", "_replaced", "_narrowable")
+
+    def __init__(
+        self,
+        completions: Completions,
+        plen: int,
+        replaced: tp.Optional[str] = None,
+        narrowable: tp.Optional[bool] = None,
+    ):
+        self.completions = completions
+        self.plen = plen
+        # whether they are the entries of the directory of the completed path,
+        # which stay valid as long as it does not change
+        self.listing = False
+        # the text the completions replace, ``None`` if it is not known
+        self._replaced = replaced
+        self._narrowable = narrowable
+
+    @classmethod
+    def create(
+        cls,
+        completions: Completions,
+        plen: int,
+        before: str,
+        limit: tp.Optional[int] = None,
+    ):
+        """``limit`` is the ``$COMPLETION_QUERY_LIMIT`` the completions were
+        cut off at. Such a truncated set is never narrowed, since the matches
+        past the cut-off are missing."""
+        if limit and len(completions) >= limit:
+            return cls(completions, plen, narrowable=False)
+        if 0 <= plen <= len(before):
+            return cls(completions, plen, before[len(before) - plen :])
+        return cls(completions, plen, narrowable=False)
+
+    @property
+    def narrowable(self) -> bool:
+        """Whether all completions start with the ``plen`` characters they replace.
+
+        Checking this takes a pass over the completions, so it is only done
+        once they are narrowed.
+        """
+        if self._narrowable is None:
+            matches = get_filter_function()
+            replaced = self._replaced
+            plen = self.plen
+            self._narrowable = all(
+                isinstance(comp, str)
+                and getattr(comp, "prefix_len", None) in (None, plen)
+                and matches(comp, replaced)
+                for comp in self.completions
+            )
+        return self._narrowable
+
+    def narrow(self, before: str, typed: int) -> tp.Optional["CachedCompletions"]:
+        """Filter the completions for the text ``before`` the cursor, that has
+        ``typed`` more word characters. The order is kept.
+
+        Returns ``None`` if the completers have to be run instead.
+        """
+        if not self.narrowable:
+            return None
+        plen = self.plen + typed
+        replaced = before[len(before) - plen :]
+        matches = get_filter_function()
+        completions = tuple(
+            comp.replace(prefix_len=plen)
+            if isinstance(comp, RichCompletion) and comp.prefix_len is not None
+            else comp
+            for comp in self.completions
+            if matches(comp, replaced)
+        )
+        if not completions:
+            return None
+        narrowed = CachedCompletions(completions, plen, replaced, narrowable=True)
+        narrowed.listing = self.listing
+        return narrowed
+
+
+class CompletionCache:
+    """LRU cache of ``Completer.complete`` results, keyed by the text before
+    and after the cursor, the current directory and the completion settings.
+
+    The completions narrowed by ``CachedCompletions.narrow`` while a word is
+    typed are cached too, so that deleting the typed characters finds them.
+
+    Parameters
+    ----------
+    maxsize
+        number of cached results. Defaults to ``$COMPLETIONS_CACHE_SIZE``,
+        ``0`` disables the cache.
+    """
+
+    def __init__(self, maxsize: tp.Optional[int] = None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "collections.OrderedDict[tp.Any, CachedCompletions]" = (
+            collections.OrderedDict()
+        )
+        # completions may be computed in a background thread
+        self._lock = threading.Lock()
+
+    def _get_maxsize(self) -> int:
+        if self.maxsize is not None:
+            return self.maxsize
+        return XSH.env.get("COMPLETIONS_CACHE_SIZE", 128)
+
+    def info(self) -> CacheInfo:
+        """Hit and miss counters, like ``functools.lru_cache``."""
+        return CacheInfo(self.hits, self.misses, self._get_maxsize(), len(self))
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self._get_maxsize() > 0
+
+    def clear(self, keep_stamped=False):
+        """Drop the cached results, e.g. since the file system may have changed.
+
+        With ``keep_stamped``, the listings of directories cached with the
+        ``stamp`` of the directory are kept, since that changes with the
+        directory.
+        """
+        with self._lock:
+            if keep_stamped:
+                dropped = [
+                    key
+                    for key, entry in self._entries.items()
+                    if key[2][-1] is None or not entry.listing
+                ]
+                for key in dropped:
+                    del self._entries[key]
+            else:
+                self._entries.clear()
+
+    def _key(self, before: str, after: str, stamp):
+        env = XSH.env
+        names = tuple(env.get(name) for name in _ENV_NAMES)
+        return (before, after, (env.get("PWD"), names, stamp))
+
+    def get(
+        self, before: str, after: str, stamp: tp.Optional[int] = None
+    ) -> tp.Optional[CachedCompletions]:
+        """Return the cached completions for the text ``before`` and ``after``
+        the cursor, ``None`` if the completers have to be run.
+
+        ``stamp`` is the modification time of the directory of the completed
+        path, if known.
+        """
+        maxsize = self._get_maxsize()
+        if maxsize <= 0:
+            return None
+        key = self._key(before, after, stamp)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(
+        self,
+        before: str,
+        after: str,
+        entry: CachedCompletions,
+        stamp: tp.Optional[int] = None,
+    ):
+        """Cache the completions computed for the text around the cursor."""
+        maxsize = self._get_maxsize()
+        if maxsize > 0:
+            self._store(self._key(before, after, stamp), entry, maxsize)
+
+    def _store(self, key, entry: CachedCompletions, maxsize: int):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > maxsize:
+                self._entries.popitem(last=False)
@@ -0,0 +1,247 @@
+"""Timings of the completion stages, to see where the latency goes.
+
+Tracing is off by default, then every stage only checks ``TRACE.enabled``.
+Once it is switched on with ``completion-trace on``, the duration of each stage
+and each xonsh completer is recorded into a ring buffer. The recorded timings
+are summarized with ``completion-trace show``, and exported with
+``completion-trace export FILE`` in the Chrome trace format, which is read by
+``chrome://tracing`` and https://ui.perfetto.dev.
+"""
+
+import collections
+import collections.abc as cabc
+import functools
+import json
+import os
+import threading
+import time
+import typing as tp
+
+from xonsh.built_ins import XSH
+
+
+class Span(tp.NamedTuple):
+    name: str
+    # "stage" or "completer"
+    cat: str
+    # ``time.perf_counter_ns`` when it started
+    start: int
+    duration: int
+    thread: int
+    args: tp.Dict[str, tp.Any]
+
+
+class _Timer:
+    __slots__ = ("trace", "name", "cat", "args", "start")
+
+    def __init__(self, trace: "CompletionTrace", name: str, cat: str, args):
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *_):
+        self.trace.add(self.name, self.start, cat=self.cat, **self.args)
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+def _materialize(out):
+    """Generate all completions of a completer's result, so that generating
+    them is part of its duration."""
+    if isinstance(out, cabc.Sequence):
+        res, lprefix = out
+        if isinstance(res, cabc.Iterator):
+            return list(res), lprefix
+    elif isinstance(out, cabc.Iterator):
+        return list(out)
+    return out
+
+
+class CompletionTrace:
+    """Ring buffer of the durations of the completion stages.
+
+    Parameters
+    ----------
+    maxsize
+        number of spans kept, the oldest are dropped
+    """
+
+    def __init__(self, maxsize=4096):
+        self.enabled = False
+        self.spans: tp.Deque[Span] = collections.deque(maxlen=maxsize)
+
+    def span(self, name: str, cat="stage", **args):
+        """Context manager recording the duration of its block."""
+        if not self.enabled:
+            return _NO_TIMER
+        return _Timer(self, name, cat, args)
+
+    def add(
+        self,
+        name: str,
+        start: int,
+        end: tp.Optional[int] = None,
+        cat="stage",
+        **args,
+    ):
+        """Record a span from ``start`` to ``end``, or to now.
+        The ``args`` are shown with it."""
+        if end is None:
+            end = time.perf_counter_ns()
+        self.spans.append(
+            Span(name, cat, start, end - start, threading.get_ident(), args)
+        )
+
+    def timed_map(self, name: str, func: tp.Callable, items: tp.Iterable):
+        """Yield ``func(item)`` for each of the ``items``, recording the total
+        duration of the calls once they are all consumed."""
+        start = time.perf_counter_ns()
+        total = count = 0
+        try:
+            for item in items:
+                begin = time.perf_counter_ns()
+                result = func(item)
+                total += time.perf_counter_ns() - begin
+                count += 1
+                yield result
+        finally:
+            self.add(name, start, start + total, count=count)
+
+    def clear(self):
+        self.spans.clear()
+
+    def instrument(self, completers: tp.Optional[tp.MutableMapping] = None):
+        """Time the xonsh ``completers``, defaults to ``XSH.completers``.
+
+        Completers added since are instrumented on the next call, it does
+        nothing unless tracing is enabled. Their results are generated
+        right away, to measure how long that takes.
+        """
+        if not self.enabled:
+            return
+        completers = XSH.completers if completers is None else completers
+        for name, func in tuple(completers.items()):
+            if getattr(func, "_traced_by", None) is not self:
+                completers[name] = self._traced(name, func)
+
+    def uninstrument(self, completers: tp.Optional[tp.MutableMapping] = None):
+        """Restore the completers replaced by ``instrument``."""
+        completers = XSH.completers if completers is None else completers
+        for name, func in tuple(completers.items()):
+            if getattr(func, "_traced_by", None) is self:
+                completers[name] = func.__wrapped__
+
+    def _traced(self, name: str, func: tp.Callable) -> tp.Callable:
+        trace = self
+
+        # keeps the attributes telling whether it is contextual or exclusive
+        @functools.wraps(func)
+        def traced(*args):
+            if not trace.enabled:
+                return func(*args)
+            with trace.span(name, cat="completer"):
+                return _materialize(func(*args))
+
+        traced._traced_by = self  # type: ignore
+        return traced
+
+    def summary(self) -> str:
+        """Count, mean and maximum duration of each stage and completer,
+        the slowest first."""
+        durations: tp.Dict[tp.Tuple[str, str], tp.List[int]] = {}
+        for span in tuple(self.spans):
+            durations.setdefault((span.cat, span.name), []).append(span.duration)
+        if not durations:
+            return "No completion timings recorded.\n"
+        rows = sorted(durations.items(), key=lambda item: -sum(item[1]))
+        width = max(len(name) for _, name in durations)
+        header = f"{'name':<{width}}  {'kind':<9} {'count':>6} {'mean':>9} {'max':>9}"
+        lines = [header]
+        for (cat, name), values in rows:
+            mean = sum(values) / len(values) / 1e6
+            most = max(values) / 1e6
+            lines.append(
+                f"{name:<{width}}  {cat:<9} {len(values):>6} "
+                f"{mean:>7.3f}ms {most:>7.3f}ms"
+            )
+        return "\n".join(lines) + "\n"
+
+    def chrome_trace(self) -> tp.Dict[str, tp.Any]:
+        """The spans as complete events of the Chrome trace event format."""
+        pid = os.getpid()
+        events = [
+            {
+                "name": span.name,
+                "cat": span.cat,
+                "ph": "X",
+                # in microseconds
+                "ts": span.start / 1e3,
+                "dur": span.duration / 1e3,
+                "pid": pid,
+                "tid": span.thread,
+                "args": span.args,
+            }
+            for span in tuple(self.spans)
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, path: str):
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file, default=str)
+
+
+TRACE = CompletionTrace()
+
+_USAGE = """\
+usage: completion-trace on|off|show|clear|export FILE
+
+Record how long each stage of tab-completion and each completer takes.
+
+  on           start recording
+  off          stop recording
+  show         summarize the recorded timings
+  clear        forget the recorded timings
+  export FILE  write the recorded timings as Chrome trace JSON
+"""
+
+
+def completion_trace_alias(args, stdin=None):
+    """Alias to switch the completion timings on and off, and to show them."""
+    cmd = args[0] if args else "show"
+    if cmd == "on":
+        TRACE.enabled = True
+        TRACE.instrument()
+    elif cmd == "off":
+        TRACE.enabled = False
+        TRACE.uninstrument()
+    elif cmd == "show":
+        return TRACE.summary()
+    elif cmd == "clear":
+        TRACE.clear()
+    elif cmd == "export" and len(args) == 2:
+        try:
+            TRACE.export(args[1])
+        except OSError as ex:
+            return None, f"completion-trace: {ex}\n", 1
+        return f"Wrote {len(TRACE.spans)} spans to {args[1]}\n"
+    elif cmd in ("-h", "--help"):
+        return _USAGE
+    else:
+        return None, _USAGE, 1
+    return None
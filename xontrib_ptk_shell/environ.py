@@ -123,6 +123,14 @@ class PTKSetting(Xettings):  # sub-classing -> sub-group
         "shell.\n\nPressing the right arrow key inserts the currently "
         "displayed suggestion. ",
     )
+    AUTO_SUGGEST_BY_CONTEXT = Var.with_default(
+        False,
+        "Prefer the auto-suggestions that were run in the current directory, "
+        "ranked by how often they were run there, whether their last run "
+        "succeeded and how recent they are. By default, and for the prefixes "
+        "not run in the current directory, the most recent history entry "
+        "with the typed prefix is suggested.",
+    )
     AUTO_SUGGEST_IN_COMPLETIONS = Var.with_default(
         False,
         "Places the auto-suggest result as the first option in the completions. "
@@ -136,6 +144,32 @@ class PTKSetting(Xettings):  # sub-classing -> sub-group
         "through the history of the terminal. Only usable with "
         "``$SHELL_TYPE=prompt_toolkit``",
     )
+    PTK_HISTORY_CHUNK_SIZE = Var.with_default(
+        10000,
+        "Number of history entries handed over to the prompt at once, "
+        "after the first ``$PTK_HISTORY_FIRST_CHUNK`` entries were loaded. "
+        "Larger chunks make loading big histories faster.",
+    )
+    PTK_HISTORY_FIRST_CHUNK = Var.with_default(
+        1000,
+        "Number of the newest history entries that are handed over to the prompt "
+        "before the rest of the history is loaded in the background. "
+        "These are available for history navigation and auto-suggestion right away.",
+    )
+    PTK_HISTORY_FUZZY_SEARCH = Var.with_default(
+        False,
+        "Index the history for the fuzzy search bound to ``Ctrl-X Ctrl-R``. "
+        "It lists the history entries containing the typed characters in order, "
+        "ranked by how recent and frequent they are "
+        "and whether they were run in the current directory.",
+    )
+    PTK_HISTORY_SNAPSHOT = Var.with_default(
+        False,
+        "Keep a snapshot of the history entries, with their directory and "
+        "return code, in ``$XONSH_DATA_DIR``. "
+        "New shells load it instead of reading the history backend "
+        "as long as the history files did not change.",
+    )
     PTK_STYLE_OVERRIDES = Var(
         is_str_str_dict,
         to_str_str_dict,
@@ -187,6 +221,44 @@ class AsyncPromptSetting(PTKSetting):
         "This is to group such calls into one that happens within that timeframe. "
         "The number is set in seconds.",
     )
+    ASYNC_PROMPT_CACHE_TTL = Var.with_default(
+        {},
+        "Seconds the value of a prompt field is reused across prompts, by field "
+        "name, e.g. ``{'gitstatus': 30}``. The value is not reused once one of "
+        "its ``$ASYNC_PROMPT_CACHE_KEYS`` changed. Outdated values are shown "
+        "faded, while the field is evaluated again in the background.",
+    )
+    ASYNC_PROMPT_CACHE_KEYS = Var.with_default(
+        {},
+        "What the cached value of a prompt field depends on, by field name, "
+        "e.g. ``{'gitstatus': ('cwd', 'git_index')}``. One of ``cwd`` (the "
+        "current directory), ``git_index`` (the modification time of the git "
+        "index) and ``command`` (the last command run). "
+        "By default it is ``('cwd', 'command')``.",
+    )
+    ASYNC_PROMPT_TIMEOUT = Var.with_default(
+        0.0,
+        "Seconds a prompt field is waited for, before its value is shown as "
+        "``{TIMEOUT:field}``. A field running in a thread cannot be stopped, "
+        "it is not evaluated again until it is done. "
+        "By default the fields are waited for as long as they take.",
+    )
+    ASYNC_PROMPT_FIELD_TIMEOUT = Var.with_default(
+        {},
+        "The ``$ASYNC_PROMPT_TIMEOUT`` of single prompt fields, by field name, "
+        "e.g. ``{'kube_context': 2}``.",
+    )
+    ASYNC_PROMPT_BREAKER_THRESHOLD = Var.with_default(
+        3,
+        "Number of timeouts in a row, after which a prompt field is not "
+        "evaluated for ``$ASYNC_PROMPT_BREAKER_COOLDOWN`` seconds. "
+        "Its timeout value is shown instead.",
+    )
+    ASYNC_PROMPT_BREAKER_COOLDOWN = Var.with_default(
+        60.0,
+        "Seconds a prompt field is not evaluated, once it timed out "
+        "``$ASYNC_PROMPT_BREAKER_THRESHOLD`` times in a row.",
+    )
     ASYNC_PROMPT_THREAD_WORKERS = Var(
         is_int,
         to_int_or_none,
@@ -198,7 +270,9 @@ class AsyncPromptSetting(PTKSetting):
     ENABLE_ASYNC_PROMPT = Var.with_default(
         False,
         "When enabled the prompt is rendered using threads. "
-        "$PROMPT_FIELD that take long will be updated in the background and will not affect prompt speed. ",
+        "$PROMPT_FIELD that take long will be updated in the background and will not affect prompt speed. "
+        "Fields defined with ``async def`` are awaited on the event loop of the prompt instead, "
+        "and cancelled once the prompt is done.",
     )
 
 
@@ -206,6 +280,12 @@ class AsyncPromptSetting(PTKSetting):
 class PTKCompletionSetting(Xettings):
     """Prompt Toolkit tab-completion"""
 
+    COMPLETIONS_CACHE_SIZE = Var.with_default(
+        128,
+        "Number of completion results cached while editing a prompt. "
+        "Typing more characters of a word narrows the cached completions "
+        "instead of running the completers again. Set to ``0`` to disable.",
+    )
     COMPLETIONS_CONFIRM = Var.with_default(
         True,
         "While tab-completions menu is displayed, press <Enter> to confirm "
@@ -242,6 +322,24 @@ class PTKCompletionSetting(Xettings):
         "``$COMPLETIONS_DISPLAY`` is ``single`` or ``multi``. This only affects the "
         "prompt-toolkit shell.",
     )
+    COMPLETION_COMMAND_INDEX = Var.with_default(
+        False,
+        "Complete the first word of a command from a sorted index of the "
+        "commands and aliases, instead of running the completers. It is "
+        "rebuilt in the background when ``$PATH`` or the aliases change. "
+        "Python names are not completed then, and the commands are only "
+        "matched by their prefix.",
+    )
+    COMPLETION_PATH_CACHE_TTL = Var.with_default(
+        5.0,
+        "Seconds the modification time of a directory on a network filesystem "
+        "(NFS, SSHFS, SMB, ...) is trusted. The completions of the paths in a "
+        "directory are kept across prompts until its modification time changes, "
+        "which is checked every time on local filesystems. On network "
+        "filesystems, the directories around the completed path are read in "
+        "the background. The network mounts are read again after as many "
+        "seconds.",
+    )
     COMPLETION_MODE = Var(
         is_completion_mode,
         to_completion_mode,
@@ -257,7 +355,30 @@ class PTKCompletionSetting(Xettings):
         False,
         "When generating the completions takes time, "
         "it’s better to do this in a background thread. "
-        "When this is True, background threads is used for completion.",
+        "When this is True, background threads is used for completion. "
+        "The completions are shown while they are generated, sorted within "
+        "each part that arrives at once. So they may be ordered differently "
+        "than when they are completed again from the cache.",
+    )
+    COMPLETION_IN_PARALLEL = Var.with_default(
+        False,
+        "Run each completer in its own thread and show its completions as soon "
+        "as it finished, so that fast completers are not held back by slow "
+        "ones. Exclusive completers still take precedence over the ones after "
+        "them. Only used if ``$COMPLETION_IN_THREAD`` is True.",
+    )
+    COMPLETION_DEADLINE = Var.with_default(
+        1.0,
+        "Seconds to wait for slow completers if ``$COMPLETION_IN_PARALLEL`` "
+        "is True. The completers still running then are dropped from the "
+        "completions. Set to ``0`` to wait for all of them.",
+    )
+    COMPLETION_IN_THREAD_DEBOUNCE = Var.with_default(
+        0.05,
+        "Seconds to wait for the next keystroke before running the completers "
+        "in a background thread, when completions are updated while typing. "
+        "The completions of the previous text are dropped once it changes. "
+        "Only used if ``$COMPLETION_IN_THREAD`` is True.",
     )
     UPDATE_COMPLETIONS_ON_KEYPRESS = Var.with_default(
         False,
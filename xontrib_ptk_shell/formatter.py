@@ -1,9 +1,12 @@
 """PTK specific PromptFormatter class."""
 
 import functools
+import inspect
+import sys
 import typing as tp
 
 from xonsh.prompt.base import DEFAULT_PROMPT, PromptFormatter
+from xonsh.tools import print_exception
 
 from xontrib_ptk_shell.updator import AsyncPrompt, PromptUpdator
 
@@ -55,12 +58,35 @@ class PTKPromptFormatter(PromptFormatter):
     def _get_field_value(
         self, field, async_prompt=None, idx=None, spec=None, conv=None, **_
     ):
-        func = functools.partial(super()._get_field_value, field)
+        func = functools.partial(self._pick_field_value, field)
         if async_prompt is not None and self.fields.needs_calling(field):
-            # create a thread and return an intermediate result
+            if inspect.iscoroutinefunction(self.fields[field]):
+                # awaited on the event loop of the prompt, without a thread
+                func = functools.partial(self._get_async_field_value, field)
+            # run it in the background and return an intermediate result
             return async_prompt.submit_section(func, field, idx, spec, conv)
         return func()
 
+    def _pick_field_value(self, field):
+        try:
+            return self.fields.pick(field)
+        except Exception:  # noqa
+            return self._field_error(field)
+
+    async def _get_async_field_value(self, field):
+        """Like ``_pick_field_value`` for fields defined with ``async def``."""
+        try:
+            return await self.fields[field]()
+        except Exception:  # noqa
+            return self._field_error(field)
+
+    @staticmethod
+    def _field_error(field) -> str:
+        """Report the error of a field, and return the value shown instead."""
+        print(f"prompt: error: on field {field!r}", file=sys.stderr)
+        print_exception()
+        return f"{{BACKGROUND_RED}}{{ERROR:{field}}}{{RESET}}"
+
     def start_update(self):
         """Start listening on the prompt section futures."""
         self.updator.start()
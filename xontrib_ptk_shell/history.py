@@ -1,21 +1,125 @@
 """History object for use with prompt_toolkit."""
 
+import asyncio
+import bisect
+import itertools
+import os
+import threading
+import typing as tp
+
 import prompt_toolkit.history
+from prompt_toolkit.application.current import get_app
+from prompt_toolkit.auto_suggest import AutoSuggestFromHistory, Suggestion
 from xonsh.built_ins import XSH
+from xonsh.tools import print_exception
+
+from .history_index import (
+    ContextIndex,
+    FuzzyHistoryIndex,
+    PrefixIndex,
+    TrigramIndex,
+)
+from .history_snapshot import HistorySnapshot, backend_signature, write_snapshot
+from .history_store import HistoryStrings, OldestFirst, WorkingLines
+
+
+HistoryItem = tp.Tuple[str, tp.Optional[dict]]
+
+
+def iter_history_items(
+    items: tp.Iterable[HistoryItem], dedup=False
+) -> tp.Iterator[HistoryItem]:
+    """Strip and filter the ``(input, backend item)`` pairs of the history
+    (newest first) in a single pass.
+
+    Adjacent duplicates are always dropped. With ``dedup`` only the newest
+    occurrence of every line is kept.
+    """
+    last = None
+    seen: tp.Optional[tp.Set[str]] = set() if dedup else None
+    for inp, item in items:
+        line = inp.rstrip()
+        if line == last:
+            continue
+        last = line
+        if seen is not None:
+            if line in seen:
+                continue
+            seen.add(line)
+        yield line, item
 
 
 class PromptToolkitHistory(prompt_toolkit.history.History):
     """History class that implements the prompt-toolkit history interface
     with the xonsh backend.
+
+    Every entry gets an id, the loaded entries count down from ``-1`` and
+    the stored ones count up from ``0``. So the ids are in chronological order
+    and stay valid while new entries are added.
+
+    The entries are kept in a compact ``HistoryStrings``, that is indexed
+    without copying it.
     """
 
-    def __init__(self, load_prev=True, *args, **kwargs):
-        """Initialize history object."""
+    def __init__(self, load_prev=True, dedup=None, snapshot_file=None, *args, **kwargs):
+        """Initialize history object.
+
+        Parameters
+        ----------
+        load_prev
+            whether to load the entries from xonsh history backend
+        dedup
+            drop every older duplicate of an entry while loading.
+            Defaults to ``"erasedups" in $HISTCONTROL``
+        snapshot_file
+            path of the snapshot used to speed up loading.
+            Defaults to a file in ``$XONSH_DATA_DIR`` if ``$PTK_HISTORY_SNAPSHOT``
+        """
         super().__init__()
         self.load_prev = load_prev
+        self.dedup = dedup
+        self.snapshot_file = snapshot_file
+        self.substring_index: tp.Optional[TrigramIndex] = None
+        self.fuzzy_index: tp.Optional[FuzzyHistoryIndex] = None
+        self.prefix_index: tp.Optional[PrefixIndex] = None
+        self.context_index: tp.Optional[ContextIndex] = None
+        self._loaded_count = 0
+        self._stored_count = 0
+        self._loaded_strings = HistoryStrings()
+
+    @property
+    def next_id(self) -> int:
+        """Id that the next stored entry will get."""
+        return self._stored_count
+
+    @property
+    def indexes(self) -> tp.List[tp.Any]:
+        """The indexes that are kept up-to-date with the history entries."""
+        indexes = (
+            self.substring_index,
+            self.fuzzy_index,
+            self.prefix_index,
+            self.context_index,
+        )
+        return [index for index in indexes if index is not None]
+
+    async def load(self):
+        if not self._loaded:
+            self._loaded_strings.extend(self.load_history_strings())
+            self._loaded = True
+        for item in self._loaded_strings:
+            yield item
+
+    def get_strings(self) -> OldestFirst:
+        return self._loaded_strings.oldest_first()
 
     def store_string(self, entry):
-        pass
+        indexes = self.indexes
+        if indexes:
+            item = {"inp": entry, "cwd": XSH.env.get("PWD")}
+            for index in indexes:
+                index.add(self._stored_count, entry, item)
+        self._stored_count += 1
 
     def load_history_strings(self):
         """Loads synchronous history strings"""
@@ -24,20 +128,258 @@ class PromptToolkitHistory(prompt_toolkit.history.History):
         hist = XSH.history
         if hist is None:
             return
-        for cmd in hist.all_items(newest_first=True):
-            line = cmd["inp"].rstrip()
-            strs = self.get_strings()
-            if len(strs) == 0 or line != strs[-1]:
-                yield line
+        env = XSH.env
+        dedup = self.dedup
+        if dedup is None:
+            dedup = "erasedups" in env.get("HISTCONTROL", ())
+        if env.get("XONSH_HISTORY_MATCH_ANYWHERE") and self.substring_index is None:
+            self.substring_index = TrigramIndex()
+        if env.get("PTK_HISTORY_FUZZY_SEARCH") and self.fuzzy_index is None:
+            self.fuzzy_index = FuzzyHistoryIndex()
+        if env.get("AUTO_SUGGEST") and self.prefix_index is None:
+            self.prefix_index = PrefixIndex()
+        if env.get("AUTO_SUGGEST_BY_CONTEXT") and self.context_index is None:
+            self.context_index = ContextIndex()
+        indexes = self.indexes
+        for line, item in iter_history_items(self._load_items(hist), dedup=dedup):
+            self._loaded_count += 1
+            for index in indexes:
+                index.add(-self._loaded_count, line, item)
+            yield line
+        for index in indexes:
+            if hasattr(index, "build"):
+                index.build()
+
+    def _get_snapshot_file(self) -> tp.Optional[str]:
+        if self.snapshot_file is not None:
+            return self.snapshot_file
+        env = XSH.env
+        if env.get("PTK_HISTORY_SNAPSHOT") and env.get("XONSH_DATA_DIR"):
+            return os.path.join(env["XONSH_DATA_DIR"], "ptk-history-snapshot.bin")
+        return None
+
+    def _load_items(self, hist) -> tp.Iterator[HistoryItem]:
+        """Entries from the snapshot if it is up-to-date, otherwise from the backend.
+
+        The items from the snapshot only have the ``cwd`` and ``rtn`` of the
+        entries.
+        """
+        path = self._get_snapshot_file()
+        if path is None:
+            for cmd in hist.all_items(newest_first=True):
+                yield cmd["inp"], cmd
+            return
+
+        # taken before reading, so that writes in between invalidate the snapshot
+        signature = backend_signature(hist)
+        snapshot = HistorySnapshot.open(path, signature)
+        if snapshot is not None:
+            try:
+                yield from snapshot.items()
+            finally:
+                snapshot.close()
+            return
+
+        loaded = []
+        loaded_items = []
+        items = ((cmd["inp"], cmd) for cmd in hist.all_items(newest_first=True))
+        for line, cmd in iter_history_items(items):
+            loaded.append(line)
+            # only what the indexes use, not the whole output of the commands
+            loaded_items.append({"cwd": cmd.get("cwd"), "rtn": cmd.get("rtn")})
+            yield line, cmd
+        if signature is not None:
+            try:
+                write_snapshot(path, signature, loaded, loaded_items)
+            except OSError:
+                print_exception("Failed to write the history snapshot")
 
     def __getitem__(self, index):
         return self.get_strings()[index]
 
     def __len__(self):
-        return len(self.get_strings())
+        return len(self._loaded_strings)
 
     def __iter__(self):
-        return iter(self.get_strings())
+        return reversed(self._loaded_strings)
+
+
+class ChunkedThreadedHistory(prompt_toolkit.history.ThreadedHistory):
+    """``ThreadedHistory`` that hands the loaded entries over in chunks.
+
+    The newest ``first_chunk`` entries are published as soon as they are read,
+    so that history navigation and auto-suggest work right after the prompt
+    appears. The rest follows in batches of ``chunk_size`` entries instead of
+    taking the lock and waking up the consumers once per entry.
+
+    The entries are kept in the ``HistoryStrings`` of the wrapped history
+    (if it has one), so they are stored only once.
+    """
+
+    def __init__(
+        self,
+        history: prompt_toolkit.history.History,
+        first_chunk: int = 1000,
+        chunk_size: int = 10000,
+    ):
+        super().__init__(history)
+        self.first_chunk = max(first_chunk, 1)
+        self.chunk_size = max(chunk_size, 1)
+        strings = getattr(history, "_loaded_strings", None)
+        if not isinstance(strings, HistoryStrings):
+            strings = HistoryStrings()
+        self._loaded_strings = strings
+
+    def get_strings(self) -> OldestFirst:
+        return self._loaded_strings.oldest_first()
+
+    def _start_loading(self):
+        if not self._load_thread:
+            self._load_thread = threading.Thread(
+                target=self._in_load_thread, daemon=True
+            )
+            self._load_thread.start()
+
+    async def load_sizes(self) -> tp.AsyncIterator[int]:
+        """Like ``load()``, but yield the number of loaded entries after
+        every chunk instead of the entries themselves."""
+        self._start_loading()
+        loop = asyncio.get_running_loop()
+        event = threading.Event()
+        event.set()
+        self._string_load_events.append(event)
+        try:
+            while True:
+                # with a timeout, so that the executor thread does not hang on exit
+                got_event = await loop.run_in_executor(
+                    None, lambda: event.wait(timeout=0.5)
+                )
+                if not got_event:
+                    continue
+                with self._lock:
+                    size = len(self._loaded_strings)
+                    done = self._loaded
+                    event.clear()
+                yield size
+                if done:
+                    break
+        finally:
+            self._string_load_events.remove(event)
+
+    def _notify(self):
+        for event in self._string_load_events:
+            event.set()
+
+    def _in_load_thread(self):
+        try:
+            # Start empty. In case `append_string()` was called
+            # before `load()` happened.
+            with self._lock:
+                self._loaded_strings.clear()
+
+            items = iter(self.history.load_history_strings())
+            size = self.first_chunk
+            while True:
+                chunk = list(itertools.islice(items, size))
+                if not chunk:
+                    break
+                with self._lock:
+                    self._loaded_strings.extend(chunk)
+                self._notify()
+                size = self.chunk_size
+        finally:
+            with self._lock:
+                self._loaded = True
+            self._notify()
+
+
+class HistoryAutoSuggest(AutoSuggestFromHistory):
+    """``AutoSuggestFromHistory`` that looks the suggestion up in the indexes
+    of the history. The best ranked line run in the current directory is
+    preferred over the most recent line of the history.
+    Until the indexes are built, the history is walked newest first,
+    stopping at the first match.
+
+    The suggestions looked up in the indexes are memoized until an entry is
+    stored, since the same one is shown and completed for each text.
+
+    Parameters
+    ----------
+    maxsize
+        number of memoized suggestions, they are all dropped when it grows larger
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._memo: tp.Dict[tp.Tuple, tp.Optional[Suggestion]] = {}
+
+    def get_suggestion(self, buffer, document):
+        text = document.text.rsplit("\n", 1)[-1]
+        if not text.strip():
+            return None
+        hist = getattr(buffer.history, "history", buffer.history)
+        index = getattr(hist, "prefix_index", None)
+        if index is not None and index.ready:
+            context = getattr(hist, "context_index", None)
+            if context is not None and not context.ready:
+                context = None
+            pwd = XSH.env.get("PWD")
+            key = (text, id(index), id(context), getattr(hist, "next_id", None), pwd)
+            if key in self._memo:
+                return self._memo[key]
+            line = None
+            if context is not None:
+                line = context.search(text, pwd)
+            if line is None:
+                line = index.search(text)
+            suggestion = None if line is None else Suggestion(line[len(text) :])
+            if len(self._memo) >= self.maxsize:
+                self._memo.clear()
+            self._memo[key] = suggestion
+            return suggestion
+        for string in reversed(buffer.history.get_strings()):
+            for line in reversed(string.splitlines()):
+                if line.startswith(text):
+                    return Suggestion(line[len(text) :])
+        return None
+
+
+def _cust_history_load(self):
+    """``Buffer.load_history_if_not_yet_loaded`` that makes the working lines
+    a view of the ``HistoryStrings``, instead of copying every entry into them.
+
+    This gets monkeypatched into the prompt_toolkit prompter. Other histories
+    than ``ChunkedThreadedHistory`` are loaded the usual way. It relies on
+    ``Buffer._working_lines`` and ``Buffer._load_history_task``, as they are
+    in prompt_toolkit 3.0 (checked up to 3.0.52)."""
+    if self._load_history_task is not None:
+        return
+    load_sizes = getattr(self.history, "load_sizes", None)
+    if load_sizes is None:
+        return type(self).load_history_if_not_yet_loaded(self)
+
+    lines = WorkingLines(self.history._loaded_strings, self._working_lines)
+    self._working_lines = lines
+
+    async def load_history():
+        async for size in load_sizes():
+            # the entries are shown before the current input
+            added = lines.set_history_size(size)
+            # the setter moves the cursor to the start of the input
+            cursor = self.cursor_position
+            self.working_index += added
+            self.cursor_position = cursor
+
+    def load_history_done(fut):
+        try:
+            fut.result()
+        except (asyncio.CancelledError, GeneratorExit):
+            pass
+        except Exception:
+            print_exception("Loading history failed")
+
+    self._load_history_task = get_app().create_background_task(load_history())
+    self._load_history_task.add_done_callback(load_history_done)
 
 
 def _cust_history_matches(self, i):
@@ -50,3 +392,80 @@ def _cust_history_matches(self, i):
         self.history_search_text is None
         or self.history_search_text in self._working_lines[i]
     )
+
+
+def _indexed_history_search(buffer) -> tp.Tuple[tp.Optional[tp.List[int]], int]:
+    """Look up the history search text in the substring index.
+
+    Returns the sorted ids of the candidate entries and the offset to convert
+    them to indexes of ``buffer._working_lines``. The ids are ``None`` if the
+    search can not be answered from the index.
+    """
+    text = buffer.history_search_text
+    hist = getattr(buffer.history, "history", buffer.history)
+    index = getattr(hist, "substring_index", None)
+    if text is None or index is None:
+        return None, 0
+    # the working lines are the history entries (oldest first) + the current input
+    offset = hist.next_id - len(buffer._working_lines) + 1
+    return index.search(text), offset
+
+
+def _cust_history_backward(self, count=1):
+    """``Buffer.history_backward`` that only visits the entries found by the
+    substring index of the history.
+
+    This gets monkeypatched into the prompt_toolkit prompter if
+    ``XONSH_HISTORY_MATCH_ANYWHERE=True``"""
+    self._set_history_search()
+    ids, offset = _indexed_history_search(self)
+    if ids is None:
+        return type(self).history_backward(self, count)
+
+    found_something = False
+    pos = bisect.bisect_left(ids, self.working_index + offset)
+    while pos > 0 and count > 0:
+        pos -= 1
+        i = ids[pos] - offset
+        if i < 0:
+            break
+        if self._history_matches(i):
+            self.working_index = i
+            count -= 1
+            found_something = True
+
+    # If we move to another entry, move cursor to the end of the line.
+    if found_something:
+        self.cursor_position = len(self.text)
+
+
+def _cust_history_forward(self, count=1):
+    """``Buffer.history_forward`` counterpart of ``_cust_history_backward``."""
+    self._set_history_search()
+    ids, offset = _indexed_history_search(self)
+    if ids is None:
+        return type(self).history_forward(self, count)
+
+    found_something = False
+    last = len(self._working_lines) - 1
+    pos = bisect.bisect_right(ids, self.working_index + offset)
+    while count > 0:
+        if pos < len(ids) and ids[pos] - offset < last:
+            i = ids[pos] - offset
+            pos += 1
+        elif self.working_index < last:
+            # the current input is not part of the index
+            i = last
+        else:
+            break
+        if self._history_matches(i):
+            self.working_index = i
+            count -= 1
+            found_something = True
+        elif i == last:
+            break
+
+    # If we found an entry, move cursor to the end of the first line.
+    if found_something:
+        self.cursor_position = 0
+        self.cursor_position += self.document.get_end_of_line_position()
@@ -0,0 +1,473 @@
+"""Indexes over the history entries to search them without scanning.
+
+The indexes are fed by ``PromptToolkitHistory`` through ``add(entry_id, line, item)``
+where ``item`` is the entry of the xonsh history backend (if available).
+Indexes with a ``build()`` method get it called once all entries are loaded.
+"""
+
+import array
+import bisect
+import heapq
+import itertools
+import math
+import re
+import time
+import typing as tp
+
+from .history_store import _Column
+
+
+def _trigrams(text: str) -> tp.Set[str]:
+    return {text[idx : idx + 3] for idx in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Substring index over the history entries.
+
+    Each entry is registered under the trigrams it contains. The entries that
+    may contain a search text of three or more characters are then found by
+    intersecting a few posting lists. Entries are identified by ids that
+    ascend from the oldest to the newest entry.
+    """
+
+    __slots__ = ("_postings", "_size", "_cache")
+
+    def __init__(self):
+        self._postings: tp.Dict[str, array.array] = {}
+        self._size = 0
+        # (search text, index size) and the result of the last search
+        self._cache: tp.Tuple[tp.Any, tp.List[int]] = (None, [])
+
+    def __len__(self):
+        return self._size
+
+    def add(self, entry_id: int, line: str, item: tp.Optional[dict] = None):
+        """Index the entry. Can be called while searching from another thread."""
+        postings = self._postings
+        for gram in _trigrams(line):
+            ids = postings.get(gram)
+            if ids is None:
+                ids = postings[gram] = array.array("i")
+            ids.append(entry_id)
+        self._size += 1
+
+    def search(self, text: str) -> tp.Optional[tp.List[int]]:
+        """Sorted ids of the entries that may contain the ``text``.
+
+        Returns ``None`` if the ``text`` is too short to be looked up.
+        """
+        if len(text) < 3:
+            return None
+        key = (text, self._size)
+        if self._cache[0] == key:
+            return self._cache[1]
+
+        lists = []
+        for gram in _trigrams(text):
+            ids = self._postings.get(gram)
+            if ids is None:
+                lists = []
+                break
+            lists.append(ids)
+
+        found: tp.Set[int] = set()
+        if lists:
+            lists.sort(key=len)
+            found.update(lists[0])
+            for ids in lists[1:]:
+                if not found:
+                    break
+                found.intersection_update(ids)
+        result = sorted(found)
+        self._cache = (key, result)
+        return result
+
+
+def _line_offsets(lines: tp.Sequence[str]) -> array.array:
+    """Start of each line in the newline joined ``lines``, plus the end."""
+    offsets = array.array("q", [0])
+    offsets.extend(itertools.accumulate(len(line) + 1 for line in lines))
+    return offsets
+
+
+class _Segment(tp.NamedTuple):
+    """Entries joined by newlines, to be matched by a single regex in C."""
+
+    blob: str
+    offsets: array.array
+    lower: str
+    lower_offsets: array.array
+    slots: tp.Sequence[int]
+
+    @classmethod
+    def create(cls, lines: tp.Sequence[str], slots: tp.Sequence[int]):
+        blob = "\n".join(lines)
+        offsets = _line_offsets(lines)
+        lower = blob.lower()
+        lower_offsets = offsets
+        if len(lower) != len(blob):
+            # some characters change their length when lowered
+            lower_offsets = _line_offsets([line.lower() for line in lines])
+        return cls(blob, offsets, lower, lower_offsets, slots)
+
+
+class FuzzyHistoryIndex:
+    """Frecency ranked fuzzy search over the distinct history entries.
+
+    An entry matches if it contains the characters of the search text in
+    order (case-insensitive unless the text has uppercase characters).
+    Matching is done by one regex over the joined entries, most recent first,
+    until ``candidates`` entries matched or all were searched. Only those
+    matches are ranked, so at least ``limit`` results are found if there are
+    that many matching entries. The rank is
+    based on how compact the match is, the recency and frequency of the entry,
+    and whether it was run in the current directory.
+
+    The entries are joined into two segments: the ones used in this session,
+    rejoined after each stored entry, and the loaded ones, joined once loading
+    is done (``build``).
+    """
+
+    __slots__ = (
+        "candidates",
+        "_slots",
+        "_lines",
+        "_counts",
+        "_last_ids",
+        "_cwds",
+        "_cwd_ids",
+        "_recent",
+        "_recent_segment",
+        "_loaded_segment",
+    )
+
+    def __init__(self, candidates=1000):
+        self.candidates = candidates
+        self._slots: tp.Dict[str, int] = {}
+        self._lines: tp.List[str] = []
+        self._counts = array.array("i")
+        self._last_ids = array.array("q")
+        # ids of the cwd the entries were last run in. -1 if it is not known
+        self._cwds = array.array("i")
+        self._cwd_ids: tp.Dict[str, int] = {}
+        # slots of the entries used in this session, most recent last
+        self._recent: tp.List[int] = []
+        self._recent_segment: tp.Optional[_Segment] = None
+        self._loaded_segment: tp.Optional[_Segment] = None
+
+    def __len__(self):
+        return len(self._lines)
+
+    def _cwd_id(self, cwd: tp.Optional[str]) -> int:
+        if not cwd:
+            return -1
+        return self._cwd_ids.setdefault(cwd, len(self._cwd_ids))
+
+    def add(self, entry_id: int, line: str, item: tp.Optional[dict] = None):
+        """Add an entry. The entries are loaded newest first and stored oldest first."""
+        if not line.strip():
+            return
+        cwd = self._cwd_id(item.get("cwd") if item else None)
+        slot = self._slots.get(line)
+        if slot is None:
+            slot = self._slots[line] = len(self._lines)
+            self._lines.append(line)
+            self._counts.append(1)
+            self._last_ids.append(entry_id)
+            self._cwds.append(cwd)
+        else:
+            self._counts[slot] += 1
+            if entry_id > self._last_ids[slot]:
+                self._last_ids[slot] = entry_id
+                if cwd != -1:
+                    self._cwds[slot] = cwd
+            elif self._cwds[slot] == -1:
+                self._cwds[slot] = cwd
+        if entry_id >= 0:
+            self._recent.append(slot)
+            self._recent_segment = None
+
+    def build(self):
+        """Join the loaded entries, once all of them are added."""
+        self._loaded_segment = self._join_loaded()
+
+    def _join_loaded(self) -> _Segment:
+        lines = self._lines[:]  # entries may get added from the loader thread
+        # the loaded entries are in the order of their slots, newest first
+        return _Segment.create(lines, range(len(lines)))
+
+    def _get_segments(self) -> tp.Tuple[_Segment, _Segment]:
+        recent_segment = self._recent_segment
+        if recent_segment is None:
+            lines = self._lines
+            recent = list(dict.fromkeys(reversed(self._recent)))
+            recent_segment = self._recent_segment = _Segment.create(
+                [lines[slot] for slot in recent], recent
+            )
+        loaded_segment = self._loaded_segment
+        if loaded_segment is None:
+            # searched while loading, the rest is joined by ``build``
+            loaded_segment = self._loaded_segment = self._join_loaded()
+        return recent_segment, loaded_segment
+
+    @staticmethod
+    def _compile(text: str) -> tp.Pattern:
+        # a[^\nb]*b... can not backtrack, unlike a.*?b... that fails slowly
+        # on long lines
+        parts = [re.escape(text[0])]
+        for char in text[1:]:
+            parts.append(f"[^\\n{re.escape(char)}]*{re.escape(char)}")
+        return re.compile("".join(parts))
+
+    def _find(self, text: str) -> tp.Iterator[tp.Tuple[int, int, int]]:
+        """Yield ``(slot, start, end)`` of the matches, most recent entry first."""
+        ignore_case = text == text.lower()
+        pattern = self._compile(text)
+        for segment in self._get_segments():
+            if ignore_case:
+                blob, offsets = segment.lower, segment.lower_offsets
+            else:
+                blob, offsets = segment.blob, segment.offsets
+            pos = 0
+            while True:
+                match = pattern.search(blob, pos)
+                if match is None:
+                    break
+                idx = bisect.bisect_right(offsets, match.start()) - 1
+                start = offsets[idx]
+                pos = offsets[idx + 1]
+                yield segment.slots[idx], match.start() - start, match.end() - start
+
+    def search(
+        self, text: str, cwd: tp.Optional[str] = None, limit=20
+    ) -> tp.List[str]:
+        """Return up to ``limit`` entries matching ``text``, best match first."""
+        if not text:
+            return []
+        cwd_id = self._cwd_ids.get(cwd) if cwd else None
+        seen: tp.Set[int] = set()
+        scored = []
+        for slot, start, end in self._find(text):
+            if slot in seen:
+                continue
+            rank = len(seen)
+            seen.add(slot)
+            line = self._lines[slot]
+            quality = len(text) / (end - start)
+            if start == 0 or not line[start - 1].isalnum():
+                quality *= 1.5
+            score = quality * (1 + math.log(self._counts[slot])) / (1 + rank / 50)
+            if self._cwds[slot] == cwd_id:
+                score *= 2
+            scored.append((score, -rank, line))
+            if len(seen) >= self.candidates:
+                break
+        scored.sort(reverse=True)
+        return [line for _, _, line in scored[:limit]]
+
+
+_BLOCK = 32
+# sorts after every line that starts with the prefix it is appended to
+_MAX_CHAR = "\U0010ffff"
+# lines sorted while holding the GIL, a few milliseconds worth
+_SORT_CHUNK = 1 << 14
+
+
+def _argmin(ranks: array.array, lo: int, hi: int) -> int:
+    return min(range(lo, hi), key=ranks.__getitem__)
+
+
+def _sorted_in_chunks(lines: tp.List[str]) -> tp.Iterator[str]:
+    """``sorted(lines)``, by merging sorted chunks. The GIL is released
+    between the chunks, instead of being held for the whole sort."""
+    chunks = []
+    for start in range(0, len(lines), _SORT_CHUNK):
+        chunks.append(sorted(lines[start : start + _SORT_CHUNK]))
+        time.sleep(0)
+    return heapq.merge(*chunks)
+
+
+def _block_table(ranks: array.array) -> tp.List[array.array]:
+    """Sparse table over the blocks of ``ranks``: ``table[k][i]`` is the
+    position of the lowest rank in the blocks ``i`` to ``i + 2 ** k``."""
+    size = len(ranks)
+    level = array.array(
+        "i",
+        (_argmin(ranks, lo, min(lo + _BLOCK, size)) for lo in range(0, size, _BLOCK)),
+    )
+    table = [level]
+    width = 1
+    while 2 * width <= len(level):
+        level = array.array(
+            "i",
+            (a if ranks[a] < ranks[b] else b for a, b in zip(level, level[width:])),
+        )
+        table.append(level)
+        width *= 2
+    return table
+
+
+class PrefixIndex:
+    """Most recent history line starting with a prefix, for auto-suggest.
+
+    Like ``AutoSuggestFromHistory``, every line of the entries is a candidate.
+    The loaded lines are sorted once loading is done (``build``), so that the
+    lines with a prefix form a range. The most recent line of a range is
+    found with a sparse table over blocks of lines, in constant time.
+    The lines stored in this session are newer than all loaded lines and are
+    kept in a sorted list, updated on every ``add``.
+    """
+
+    __slots__ = ("_pending", "_loaded", "_session", "_stamps")
+
+    def __init__(self):
+        # line -> rank (0 is the most recent) of the loaded lines, until built
+        self._pending: tp.Optional[tp.Dict[str, int]] = {}
+        self._loaded: tp.Tuple[_Column, array.array, tp.List[array.array]] = (
+            _Column(),
+            array.array("i"),
+            [],
+        )
+        self._session: tp.List[str] = []
+        # line -> (entry id, line number) of its most recent use
+        self._stamps: tp.Dict[str, tp.Tuple[int, int]] = {}
+
+    @property
+    def ready(self) -> bool:
+        """Whether the loaded lines are searchable."""
+        return self._pending is None
+
+    def add(self, entry_id: int, line: str, item: tp.Optional[dict] = None):
+        """Add an entry. The entries are loaded newest first and stored oldest first."""
+        if entry_id >= 0:
+            for lineno, text in enumerate(line.splitlines()):
+                if text not in self._stamps:
+                    bisect.insort(self._session, text)
+                self._stamps[text] = (entry_id, lineno)
+        elif self._pending is not None:
+            # the later lines of an entry are suggested first
+            for text in reversed(line.splitlines()):
+                self._pending.setdefault(text, len(self._pending))
+
+    def build(self):
+        """Sort the loaded lines, called once they are all added."""
+        pending = self._pending
+        if pending is None:
+            return
+        column = _Column()
+        ranks = array.array("i")
+        # the merge runs in the interpreter, so other threads still get turns
+        for text in _sorted_in_chunks(list(pending)):
+            column.append(text)
+            ranks.append(pending[text])
+        self._loaded = (column, ranks, _block_table(ranks))
+        self._pending = None
+
+    @staticmethod
+    def _range(lines: tp.Sequence[str], prefix: str) -> tp.Tuple[int, int]:
+        lo = bisect.bisect_left(lines, prefix)
+        return lo, bisect.bisect_left(lines, prefix + _MAX_CHAR, lo)
+
+    def search(self, prefix: str) -> tp.Optional[str]:
+        """Return the most recent line that starts with ``prefix``."""
+        session = self._session
+        lo, hi = self._range(session, prefix)
+        if lo < hi:
+            return max(session[lo:hi], key=self._stamps.__getitem__)
+
+        lines, ranks, table = self._loaded
+        lo, hi = self._range(lines, prefix)
+        if lo == hi:
+            return None
+        first, last = -(-lo // _BLOCK), hi // _BLOCK
+        if first >= last:
+            return lines[_argmin(ranks, lo, hi)]
+        # the partial blocks at both ends and the full blocks in between
+        level = (last - first).bit_length() - 1
+        candidates = [
+            table[level][first],
+            table[level][last - (1 << level)],
+        ]
+        if lo < first * _BLOCK:
+            candidates.append(_argmin(ranks, lo, first * _BLOCK))
+        if last * _BLOCK < hi:
+            candidates.append(_argmin(ranks, last * _BLOCK, hi))
+        return lines[min(candidates, key=ranks.__getitem__)]
+
+
+class ContextIndex:
+    """Auto-suggestions ranked by the directory they were run in.
+
+    For every directory, the distinct lines run there are ordered by a score
+    of how often they were run there, whether their last run succeeded, and
+    how recently they were run. The order is computed once per directory (and
+    again after entries are added), so a suggestion is the first line of that
+    order with the prefix. Only the most recent ``per_cwd`` lines of each
+    directory are kept.
+    """
+
+    __slots__ = ("per_cwd", "failed_weight", "_tables", "_orders", "_ready")
+
+    def __init__(self, per_cwd=1000, failed_weight=0.25):
+        self.per_cwd = per_cwd
+        self.failed_weight = failed_weight
+        # cwd -> line -> [count, entry id of the last run, its return code]
+        self._tables: tp.Dict[str, tp.Dict[str, list]] = {}
+        self._orders: tp.Dict[str, tp.List[str]] = {}
+        self._ready = False
+
+    @property
+    def ready(self) -> bool:
+        """Whether the loaded entries are searchable."""
+        return self._ready
+
+    def add(self, entry_id: int, line: str, item: tp.Optional[dict] = None):
+        """Add an entry. Entries without the directory they were run in are skipped."""
+        cwd = item.get("cwd") if item else None
+        if not cwd:
+            return
+        rtn = item.get("rtn")
+        table = self._tables.setdefault(cwd, {})
+        for text in line.splitlines():
+            if not text.strip():
+                continue
+            stats = table.get(text)
+            if stats is None:
+                if entry_id < 0 and len(table) >= self.per_cwd:
+                    continue
+                table[text] = [1, entry_id, rtn]
+            else:
+                stats[0] += 1
+                if entry_id > stats[1]:
+                    stats[1:] = entry_id, rtn
+        self._orders.pop(cwd, None)
+
+    def build(self):
+        """Called once the loaded entries are all added."""
+        self._ready = True
+
+    def _get_order(self, cwd: str) -> tp.List[str]:
+        order = self._orders.get(cwd)
+        if order is None:
+            table = self._tables.get(cwd, {})
+            by_recency = sorted(table, key=lambda text: table[text][1], reverse=True)
+            scores = {}
+            for age, text in enumerate(by_recency):
+                count, _, rtn = table[text]
+                score = (1 + math.log(count)) / (1 + age / 50)
+                if rtn:
+                    score *= self.failed_weight
+                scores[text] = score
+            order = self._orders[cwd] = sorted(
+                by_recency, key=scores.__getitem__, reverse=True
+            )
+        return order
+
+    def search(self, prefix: str, cwd: tp.Optional[str]) -> tp.Optional[str]:
+        """Return the best ranked line run in ``cwd`` that starts with ``prefix``."""
+        if not cwd:
+            return None
+        for text in self._get_order(cwd):
+            if text.startswith(prefix):
+                return text
+        return None
@@ -0,0 +1,225 @@
+"""Persistent snapshot of the history entries loaded by ``PromptToolkitHistory``.
+
+New shells read the snapshot instead of decoding every session of the xonsh
+history backend. It is only used while the files backing the history are
+unchanged, otherwise it gets rebuilt on the next load.
+
+The file layout is::
+
+    MAGIC | header size (u32) | header (JSON) | offsets (u64 * (count + 1))
+          | cwd ids (i32 * count) | return codes (i64 * count) | UTF-8 blob
+
+Entries are stored newest first. The offsets index allows random access to
+the memory-mapped file without decoding the entries in front of it.
+The directories the entries were run in are listed once in the header,
+and referenced by their position (``-1`` if unknown).
+"""
+
+import array
+import glob
+import json
+import mmap
+import os
+import struct
+import sys
+import typing as tp
+
+MAGIC = b"XPTKHIST"
+VERSION = 2
+_HEADER_SIZE = struct.Struct("<I")
+_OFFSET_TYPE = "Q"
+_CWD_TYPE = "i"
+_RTN_TYPE = "q"
+# an entry without a return code
+_NO_RTN = -(2**63)
+
+
+def backend_signature(hist) -> tp.Optional[tp.List[tp.List]]:
+    """Return ``[path, mtime_ns, size]`` of the files backing the xonsh history.
+
+    ``None`` means the backend is not file based and can not be validated.
+    """
+    filename = getattr(hist, "filename", None)
+    if not filename:
+        return None
+    if filename.endswith(".json"):
+        # json backend: one file per session in ``$XONSH_DATA_DIR/history_json``.
+        # That of the running session is new at each start, and has no entries
+        # yet when the history is loaded.
+        paths = sorted(glob.glob(os.path.join(os.path.dirname(filename), "*.json")))
+        paths = [path for path in paths if path != filename]
+    else:
+        paths = [filename]
+
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        signature.append([path, st.st_mtime_ns, st.st_size])
+    return signature
+
+
+def _to_little_endian(values: array.array):
+    if sys.byteorder != "little":
+        values.byteswap()
+
+
+def _read_array(mm: mmap.mmap, typecode: str, pos: int, count: int) -> array.array:
+    values = array.array(typecode)
+    values.frombytes(mm[pos : pos + count * values.itemsize])
+    _to_little_endian(values)
+    return values
+
+
+def write_snapshot(
+    path: str,
+    signature,
+    lines: tp.Sequence[str],
+    items: tp.Optional[tp.Sequence[tp.Optional[dict]]] = None,
+):
+    """Atomically (re)write the snapshot file with the given lines.
+
+    The ``cwd`` and ``rtn`` of the backend ``items`` of the lines are kept too.
+    """
+    blobs = [line.encode("utf-8", "surrogatepass") for line in lines]
+    offsets = array.array(_OFFSET_TYPE, [0])
+    pos = 0
+    for blob in blobs:
+        pos += len(blob)
+        offsets.append(pos)
+
+    cwd_ids: tp.Dict[str, int] = {}
+    cwds = array.array(_CWD_TYPE)
+    rtns = array.array(_RTN_TYPE)
+    for item in items or [None] * len(blobs):
+        cwd = item.get("cwd") if item else None
+        cwds.append(cwd_ids.setdefault(cwd, len(cwd_ids)) if cwd else -1)
+        rtn = item.get("rtn") if item else None
+        rtns.append(rtn if isinstance(rtn, int) and rtn != _NO_RTN else _NO_RTN)
+    for values in (offsets, cwds, rtns):
+        _to_little_endian(values)
+
+    header = json.dumps(
+        {
+            "version": VERSION,
+            "count": len(blobs),
+            "signature": signature,
+            "cwds": list(cwd_ids),
+        }
+    ).encode()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        with open(tmp, "wb") as fp:
+            fp.write(MAGIC)
+            fp.write(_HEADER_SIZE.pack(len(header)))
+            fp.write(header)
+            fp.write(offsets.tobytes())
+            fp.write(cwds.tobytes())
+            fp.write(rtns.tobytes())
+            fp.writelines(blobs)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class HistorySnapshot:
+    """Read-only view over a memory-mapped snapshot file."""
+
+    __slots__ = ("_mm", "_offsets", "_cwds", "_cwd_ids", "_rtns", "_start", "count")
+
+    def __init__(
+        self,
+        mm: mmap.mmap,
+        offsets: array.array,
+        start: int,
+        cwds: tp.Sequence[str] = (),
+        cwd_ids: tp.Optional[array.array] = None,
+        rtns: tp.Optional[array.array] = None,
+    ):
+        self._mm = mm
+        self._offsets = offsets
+        self._start = start
+        self.count = len(offsets) - 1
+        self._cwds = cwds
+        self._cwd_ids = cwd_ids
+        self._rtns = rtns
+
+    @classmethod
+    def open(cls, path: str, signature) -> tp.Optional["HistorySnapshot"]:
+        """Open the snapshot if it exists and matches the given ``signature``."""
+        if signature is None:
+            return None
+        try:
+            with open(path, "rb") as fp:
+                mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            return cls._parse(mm, signature)
+        except (ValueError, KeyError, IndexError, TypeError, struct.error):
+            pass
+        mm.close()
+        return None
+
+    @classmethod
+    def _parse(cls, mm: mmap.mmap, signature):
+        pos = len(MAGIC)
+        if mm[:pos] != MAGIC:
+            raise ValueError("not a history snapshot")
+        (size,) = _HEADER_SIZE.unpack_from(mm, pos)
+        pos += _HEADER_SIZE.size
+        header = json.loads(mm[pos : pos + size])
+        pos += size
+        if header["version"] != VERSION or header["signature"] != signature:
+            raise ValueError("outdated history snapshot")
+
+        count = header["count"]
+        offsets = _read_array(mm, _OFFSET_TYPE, pos, count + 1)
+        pos += len(offsets) * offsets.itemsize
+        cwd_ids = _read_array(mm, _CWD_TYPE, pos, count)
+        pos += len(cwd_ids) * cwd_ids.itemsize
+        rtns = _read_array(mm, _RTN_TYPE, pos, count)
+        pos += len(rtns) * rtns.itemsize
+        if len(offsets) != count + 1 or len(mm) != pos + offsets[-1]:
+            raise ValueError("truncated history snapshot")
+        return cls(mm, offsets, pos, header["cwds"], cwd_ids, rtns)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("history snapshot index out of range")
+        start = self._start
+        return self._mm[
+            start + self._offsets[index] : start + self._offsets[index + 1]
+        ].decode("utf-8", "surrogatepass")
+
+    def __iter__(self) -> tp.Iterator[str]:
+        for idx in range(self.count):
+            yield self[idx]
+
+    def item(self, index: int) -> tp.Optional[dict]:
+        """The ``cwd`` and ``rtn`` of the entry, like a backend item has them."""
+        cwd_id = self._cwd_ids[index] if self._cwd_ids is not None else -1
+        rtn = self._rtns[index] if self._rtns is not None else _NO_RTN
+        if cwd_id < 0 and rtn == _NO_RTN:
+            return None
+        return {
+            "cwd": self._cwds[cwd_id] if cwd_id >= 0 else None,
+            "rtn": None if rtn == _NO_RTN else rtn,
+        }
+
+    def items(self) -> tp.Iterator[tp.Tuple[str, tp.Optional[dict]]]:
+        """The entries with their items."""
+        for idx in range(self.count):
+            yield self[idx], self.item(idx)
+
+    def close(self):
+        self._mm.close()
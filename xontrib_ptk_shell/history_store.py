@@ -0,0 +1,202 @@
+"""Compact storage for the history strings.
+
+prompt_toolkit keeps the history as a list of ``str`` and the buffer copies
+every entry into its working lines. Here the entries are kept UTF-8 encoded
+in a single buffer per column and are only decoded when accessed.
+"""
+
+import array
+import typing as tp
+from collections.abc import Sequence
+
+
+class _Column:
+    """Strings encoded into one buffer, located by their offsets."""
+
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self):
+        self.blob = bytearray()
+        self.offsets = array.array("Q", [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.blob[start:end].decode("utf-8", "surrogatepass")
+
+    def append(self, string: str):
+        # the blob is extended first, so that readers in other threads
+        # never see an offset that is out of bounds
+        self.blob += string.encode("utf-8", "surrogatepass")
+        self.offsets.append(len(self.blob))
+
+
+class HistoryStrings(Sequence):
+    """Replacement for the list of strings kept by prompt_toolkit's ``History``.
+
+    Like that list, it is ordered newest first. The loaded entries are appended
+    and the new ones are inserted at the front, so they are kept in two columns
+    that only grow at their end.
+    """
+
+    __slots__ = ("_loaded", "_stored")
+
+    def __init__(self, strings: tp.Iterable[str] = ()):
+        self._loaded = _Column()
+        self._stored = _Column()
+        self.extend(strings)
+
+    def __len__(self):
+        return len(self._stored) + len(self._loaded)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(*index.indices(len(self)))]
+        stored = len(self._stored)
+        size = stored + len(self._loaded)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("history index out of range")
+        if index < stored:
+            return self._stored[stored - 1 - index]
+        return self._loaded[index - stored]
+
+    def __iter__(self) -> tp.Iterator[str]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __reversed__(self) -> tp.Iterator[str]:
+        for idx in range(len(self) - 1, -1, -1):
+            yield self[idx]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self)} entries)"
+
+    def append(self, string: str):
+        """Add an older entry to the end."""
+        self._loaded.append(string)
+
+    def extend(self, strings: tp.Iterable[str]):
+        for string in strings:
+            self._loaded.append(string)
+
+    def insert(self, index: int, string: str):
+        """Add a new entry. Only inserting at the front is supported."""
+        if index != 0:
+            raise ValueError("entries can only be inserted at the front")
+        self._stored.append(string)
+
+    def clear(self):
+        self._loaded = _Column()
+        self._stored = _Column()
+
+    def oldest_first(self) -> "OldestFirst":
+        """View of the entries in the order of ``History.get_strings``."""
+        return OldestFirst(self)
+
+
+class OldestFirst(Sequence):
+    """Reversed view of ``HistoryStrings``, without copying them."""
+
+    __slots__ = ("_strings",)
+
+    def __init__(self, strings: HistoryStrings):
+        self._strings = strings
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(*index.indices(len(self)))]
+        size = len(self._strings)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("history index out of range")
+        return self._strings[size - 1 - index]
+
+    def __iter__(self):
+        return reversed(self._strings)
+
+    def __reversed__(self):
+        return iter(self._strings)
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class WorkingLines:
+    """Stand-in for the ``deque`` of ``Buffer._working_lines`` that views the
+    ``HistoryStrings`` instead of holding a copy of every entry.
+
+    The first ``history_size`` lines are the history entries (oldest first),
+    followed by the ``tail`` lines that are the current input.
+    Only the edited history entries are kept as ``str``.
+    """
+
+    __slots__ = ("_strings", "_size", "_edited", "_tail")
+
+    def __init__(self, strings: HistoryStrings, tail: tp.Iterable[str]):
+        self._strings = strings
+        self._size = 0
+        # newest first index of the entry -> edited text
+        self._edited: tp.Dict[int, str] = {}
+        self._tail = list(tail)
+
+    @property
+    def history_size(self) -> int:
+        return self._size
+
+    def set_history_size(self, size: int) -> int:
+        """Show that many history entries. Returns the number of added lines."""
+        added = size - self._size
+        self._size = size
+        return added
+
+    def __len__(self):
+        return self._size + len(self._tail)
+
+    def _locate(self, index: int) -> int:
+        """Return the newest first index of the history entry, or
+        the negative index into the tail."""
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("working lines index out of range")
+        if index < self._size:
+            return self._size - 1 - index
+        return index - size
+
+    def __getitem__(self, index: int) -> str:
+        pos = self._locate(index)
+        if pos < 0:
+            return self._tail[pos]
+        if pos in self._edited:
+            return self._edited[pos]
+        return self._strings[pos]
+
+    def __setitem__(self, index: int, value: str):
+        pos = self._locate(index)
+        if pos < 0:
+            self._tail[pos] = value
+        else:
+            self._edited[pos] = value
+
+    def __iter__(self) -> tp.Iterator[str]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def appendleft(self, item: str):
+        """Add an older line, the way ``Buffer`` loads the history."""
+        self._edited[self._size] = item
+        self._size += 1
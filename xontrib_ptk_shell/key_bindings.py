@@ -2,6 +2,7 @@
 
 from prompt_toolkit import search
 from prompt_toolkit.application.current import get_app
+from prompt_toolkit.completion import Completion
 from prompt_toolkit.enums import DEFAULT_BUFFER
 from prompt_toolkit.filters import (
     Condition,
@@ -142,6 +143,38 @@ def end_of_line():
     return bool(at_end and not last_line)
 
 
+def _get_fuzzy_index(buffer):
+    """The fuzzy search index of the buffer's ``PromptToolkitHistory``"""
+    # unwrap ThreadedHistory
+    hist = getattr(buffer.history, "history", buffer.history)
+    return getattr(hist, "fuzzy_index", None)
+
+
+@Condition
+def fuzzy_history_search_enabled():
+    """Check if the history is indexed for the fuzzy search"""
+    return _get_fuzzy_index(get_app().current_buffer) is not None
+
+
+def fuzzy_history_search(buffer):
+    """Show the history entries that fuzzy match the current input in the
+    completion menu, best match selected.
+    """
+    index = _get_fuzzy_index(buffer)
+    text = buffer.text
+    matches = index.search(text.strip(), cwd=XSH.env.get("PWD"))
+    if not matches:
+        return
+    buffer.cursor_position = len(text)
+    buffer._set_completions(
+        [
+            Completion(line, -len(text), display=line.replace("\n", " "))
+            for line in matches
+        ]
+    )
+    buffer.go_to_completion(0)
+
+
 @Condition
 def should_confirm_completion():
     """Check if completion needs confirmation"""
@@ -271,6 +304,11 @@ def load_xonsh_bindings(ptk_bindings: KeyBindingsBase) -> KeyBindingsBase:
         """Open current buffer in editor"""
         event.current_buffer.open_in_editor(event.cli)
 
+    @handle(Keys.ControlX, Keys.ControlR, filter=fuzzy_history_search_enabled)
+    def _fuzzy_history_search(event):
+        """Fuzzy search the history, ranked by frecency"""
+        fuzzy_history_search(event.current_buffer)
+
     @handle(Keys.BackTab, filter=insert_mode)
     def insert_literal_tab(event):
         """Insert literal tab on Shift+Tab instead of autocompleting"""
@@ -27,9 +27,11 @@ def _load_xontrib_(xsh: XonshSession, **_):
     register_events(xsh.builtins.events)
 
     from . import abbrevs, environ
+    from .completion_trace import completion_trace_alias
 
     environ.register(xsh.env)
     ctx.update(abbrevs.register(xsh))
+    xsh.aliases["completion-trace"] = completion_trace_alias
     return ctx
 
 
@@ -41,3 +43,9 @@ def _unload_xontrib_(xsh: XonshSession, **_):
 
     if ptk_idx is not None:
         xsh.shells.pop(ptk_idx)
+
+    from .completion_trace import TRACE
+
+    TRACE.enabled = False
+    TRACE.uninstrument()
+    xsh.aliases.pop("completion-trace", None)
@@ -0,0 +1,83 @@
+"""Room for the completion menu below the input."""
+
+import typing as tp
+
+from prompt_toolkit.application.current import get_app
+from prompt_toolkit.formatted_text import fragment_list_to_text, to_formatted_text
+from prompt_toolkit.layout import Dimension
+from prompt_toolkit.layout.containers import Window
+from prompt_toolkit.shortcuts import CompleteStyle, PromptSession
+from prompt_toolkit.utils import get_cwidth
+
+
+def input_height(text: str, columns: int, prompt_width=0) -> int:
+    """Number of rows of the ``text`` when its lines wrap at ``columns``.
+    The first line starts after the ``prompt_width`` columns of the prompt."""
+    columns = max(columns, 1)
+    widths = [get_cwidth(line) for line in text.split("\n")]
+    widths[0] += prompt_width
+    return sum(max(1, -(-width // columns)) for width in widths)
+
+
+def prompt_width(session: PromptSession) -> int:
+    """Width of the last line of the prompt, in front of the input."""
+    text = fragment_list_to_text(to_formatted_text(session.message))
+    return get_cwidth(text.rsplit("\n", 1)[-1])
+
+
+class MenuSpace:
+    """Minimal height of the input window, so that the completion menu fits
+    below all lines of the input.
+
+    prompt_toolkit only reserves ``reserve_space_for_menu`` rows, including
+    the rows of the input. This replaces the height of the input window, which
+    is given once the layout is rendered, instead of raising the height of the
+    last rendered screen after the completions are generated.
+    The input rows are computed once per text, prompt and terminal width.
+
+    Parameters
+    ----------
+    session
+        the prompt session, ``reserve_space_for_menu`` is the number of rows
+        of the menu
+    """
+
+    def __init__(self, session: PromptSession):
+        self.session = session
+        self._rows: tp.Optional[tp.Tuple[str, int, int, int]] = None
+
+    def install(self) -> bool:
+        """Use it for the height of the input window of the ``session``."""
+        for window in self.session.layout.find_all_windows():
+            buffer = getattr(window.content, "buffer", None)
+            if isinstance(window, Window) and buffer is self.session.default_buffer:
+                window.height = self.height
+                return True
+        return False
+
+    def input_rows(self, text: str, columns: int, prompt_width=0) -> int:
+        key = (text, columns, prompt_width)
+        cached = self._rows
+        if cached is None or cached[:3] != key:
+            cached = self._rows = (*key, input_height(*key))
+        return cached[3]
+
+    def height(self) -> Dimension:
+        session = self.session
+        menu_rows = session.reserve_space_for_menu
+        if (
+            not menu_rows
+            or session.completer is None
+            or session.complete_style == CompleteStyle.READLINE_LIKE
+        ):
+            return Dimension()
+        app = get_app()
+        buffer = session.default_buffer
+        if app.is_done or not (
+            buffer.complete_while_typing() or buffer.complete_state is not None
+        ):
+            return Dimension()
+        columns = app.output.get_size().columns
+        rows = self.input_rows(buffer.text, columns, prompt_width(session))
+        # the menu rows include the first row of the input
+        return Dimension(min=rows - 1 + menu_rows)
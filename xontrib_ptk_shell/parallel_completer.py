@@ -0,0 +1,245 @@
+"""Run the xonsh completers concurrently, showing the fast ones first.
+
+Only the completers that ``Completer.generate_completions`` would run are
+started: a completer is started once the exclusive completers before it
+finished without ending the chain.
+
+``run_completer`` is a copy of one step of the private
+``Completer.generate_completions`` of xonsh, and uses its private
+``Completer._format_completion``. It has to follow their changes.
+"""
+
+import collections.abc as cabc
+import concurrent.futures as cf
+import queue
+import threading
+import time
+import typing as tp
+
+from xonsh.built_ins import XSH
+from xonsh.completer import Completer
+from xonsh.completers.tools import (
+    get_filter_function,
+    is_contextual_completer,
+    is_exclusive_completer,
+)
+from xonsh.tools import print_exception
+
+Items = tp.List[tp.Tuple[tp.Any, int]]
+
+
+class DaemonPool:
+    """A bounded pool of daemon threads.
+
+    A completer that hangs must not keep the shell from exiting,
+    like it would in a ``ThreadPoolExecutor``. Like there, the workers are
+    started on demand, when none of them is idle.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._queue: "queue.SimpleQueue[tp.Tuple[cf.Future, tp.Callable, tuple]]" = (
+            queue.SimpleQueue()
+        )
+        self._idle = threading.Semaphore(0)
+        self._lock = threading.Lock()
+        self._workers = 0
+
+    def run(self, future: cf.Future, func: tp.Callable, *args):
+        """Run ``func`` for ``future`` in a worker, unless it gets cancelled first."""
+        self._queue.put((future, func, args))
+        if self._idle.acquire(blocking=False):
+            return
+        with self._lock:
+            if self._workers < self.max_workers:
+                self._workers += 1
+                threading.Thread(
+                    target=self._work, name="xonsh-completer", daemon=True
+                ).start()
+
+    def _work(self):
+        while True:
+            future, func, args = self._queue.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args))
+                except BaseException as ex:
+                    future.set_exception(ex)
+            del future, func, args
+            self._idle.release()
+
+
+POOL = DaemonPool(max_workers=4)
+
+
+def run_completer(name: str, func, context, old_args) -> tp.Tuple[Items, bool]:
+    """One step of ``Completer.generate_completions``.
+
+    Returns the formatted ``(completion, lprefix)`` of the completer,
+    and whether it requested to stop collecting completions.
+    """
+    contextual = is_contextual_completer(func)
+    if (context if contextual else old_args) is None:
+        return [], False
+    completing_contextual_command = (
+        contextual and context is not None and context.command is not None
+    )
+    if completing_contextual_command:
+        prefix = context.command.prefix
+    elif old_args is not None:
+        prefix = old_args[0]
+    else:
+        prefix = ""
+    items: Items = []
+    try:
+        out = func(context) if contextual else func(*old_args)
+        is_filtered = True
+        custom_lprefix = False
+        lprefix = len(prefix)
+        if isinstance(out, cabc.Sequence):
+            res, lprefix_filtered = out
+            if isinstance(lprefix_filtered, bool):
+                is_filtered = lprefix_filtered
+            else:
+                lprefix = lprefix_filtered
+                custom_lprefix = True
+        else:
+            res = out
+        filter_func = get_filter_function()
+        for comp in res or ():
+            if not is_filtered and not filter_func(comp, prefix):
+                continue
+            if not str(comp).strip():
+                continue
+            items.append(
+                Completer._format_completion(
+                    comp,
+                    context,
+                    completing_contextual_command,
+                    lprefix or 0,
+                    custom_lprefix,
+                )
+            )
+    except StopIteration:
+        return items, True
+    except Exception as ex:
+        print_exception(
+            f"Completer {name} raises exception when gets "
+            f"old_args={old_args and old_args[:-1]} / "
+            f"completion_context={context!r}:\n"
+            f"{type(ex)} - {ex}"
+        )
+        return [], False
+    return items, False
+
+
+def _ends_chain(func, future: cf.Future) -> bool:
+    """Whether the finished completer ends the chain of completers."""
+    items, stop_chain = future.result()
+    return stop_chain or bool(items and is_exclusive_completer(func))
+
+
+class ParallelCompletions:
+    """Iterates ``(completion, lprefix)`` like ``Completer.generate_completions``,
+    but runs the completers in the threads of ``POOL``.
+
+    The non-exclusive completers run at the same time as the ones after them.
+    The completers after an exclusive one are only started once it finished
+    without completions, since the ones it excludes may have side effects
+    (e.g. bash completion runs a subprocess).
+
+    The completions of a completer are yielded once it finished, and all the
+    exclusive completers before it finished without completions. So a slow
+    completer only holds back the completers after it if it is exclusive.
+    Completers still running after ``deadline`` seconds are dropped and their
+    names are added to ``dropped``.
+
+    Parameters
+    ----------
+    context
+        the parsed ``CompletionContext``
+    old_args
+        the arguments of the completers that are not contextual
+    stop
+        stops waiting for the completers once set
+    deadline
+        seconds to wait for slow completers, ``0`` waits for all of them
+    poll_interval
+        seconds between the checks of ``stop``
+    """
+
+    def __init__(
+        self,
+        context,
+        old_args,
+        stop: threading.Event,
+        deadline: float,
+        poll_interval=0.05,
+    ):
+        self.context = context
+        self.old_args = old_args
+        self.stop = stop
+        self.deadline = deadline
+        self.poll_interval = poll_interval
+        self.dropped: tp.List[str] = []
+
+    def __iter__(self) -> tp.Iterator[tp.Tuple[tp.Any, int]]:
+        tasks = [(name, func, cf.Future()) for name, func in XSH.completers.items()]
+        return self._collect(tasks)
+
+    def _start_ready(self, tasks, started: tp.List[bool]):
+        """Start the completers in order, up to an exclusive one that is still
+        running, or that ended the chain."""
+        for idx, (name, func, future) in enumerate(tasks):
+            if not started[idx]:
+                started[idx] = True
+                POOL.run(future, run_completer, name, func, self.context, self.old_args)
+            if future.done():
+                if _ends_chain(func, future):
+                    break
+            elif is_exclusive_completer(func):
+                break
+
+    def _collect(self, tasks):
+        end = time.monotonic() + self.deadline if self.deadline > 0 else None
+        handled = [False] * len(tasks)
+        started = [False] * len(tasks)
+        expired = False
+        while True:
+            if not expired:
+                self._start_ready(tasks, started)
+            for idx, (name, func, future) in enumerate(tasks):
+                if handled[idx]:
+                    continue
+                if not future.done():
+                    if expired:
+                        handled[idx] = True
+                        future.cancel()
+                        self.dropped.append(name)
+                    elif is_exclusive_completer(func):
+                        # the completers after it may not be used
+                        break
+                    continue
+                handled[idx] = True
+                yield from future.result()[0]
+                if _ends_chain(func, future):
+                    # the chain ends here, the running completers before it
+                    # are still collected
+                    for _, _, later in tasks[idx + 1 :]:
+                        later.cancel()
+                    del tasks[idx + 1 :], handled[idx + 1 :], started[idx + 1 :]
+                    break
+            if all(handled) or self.stop.is_set():
+                return
+            running = [
+                future
+                for done, (_, _, future) in zip(handled, tasks)
+                if not done and not future.done()
+            ]
+            timeout = self.poll_interval
+            if end is not None:
+                timeout = min(timeout, end - time.monotonic())
+                if timeout <= 0:
+                    expired = True
+                    continue
+            cf.wait(running, timeout, return_when=cf.FIRST_COMPLETED)
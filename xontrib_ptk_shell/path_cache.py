@@ -0,0 +1,265 @@
+"""Listings of the directories that paths are completed in.
+
+Listing a directory on a network filesystem may take long. The modification
+time of a directory changes whenever an entry is added, removed or renamed,
+so it tells when completions of the paths in it have to be generated again.
+On local filesystems it is checked every time, on network filesystems at
+most every ``$COMPLETION_PATH_CACHE_TTL`` seconds.
+The directories are only listed in background threads.
+"""
+
+import itertools
+import os
+import threading
+import time
+import typing as tp
+
+from xonsh.built_ins import XSH
+
+NETWORK_FILESYSTEMS = frozenset(
+    {
+        "9p",
+        "afs",
+        "ceph",
+        "cifs",
+        "davfs",
+        "fuse.rclone",
+        "fuse.sshfs",
+        "glusterfs",
+        "ncpfs",
+        "nfs",
+        "nfs4",
+        "smb3",
+        "smbfs",
+        "sshfs",
+    }
+)
+
+
+def _get_ttl() -> float:
+    return XSH.env.get("COMPLETION_PATH_CACHE_TTL", 5.0)
+
+
+# mounts file -> (when it was read, network mount points)
+_mounts: tp.Dict[str, tp.Tuple[float, tp.Tuple[str, ...]]] = {}
+
+
+def network_mounts(mounts_file="/proc/self/mounts") -> tp.Tuple[str, ...]:
+    """Mount points of the network filesystems, longest first.
+
+    They are read again after ``$COMPLETION_PATH_CACHE_TTL`` seconds, to see
+    the filesystems mounted since.
+    """
+    now = time.monotonic()
+    cached = _mounts.get(mounts_file)
+    if cached is not None and now - cached[0] < _get_ttl():
+        return cached[1]
+    points = read_network_mounts(mounts_file)
+    _mounts[mounts_file] = (now, points)
+    return points
+
+
+def read_network_mounts(mounts_file: str) -> tp.Tuple[str, ...]:
+    try:
+        with open(mounts_file) as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return ()
+    points = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) > 2 and fields[2] in NETWORK_FILESYSTEMS:
+            # spaces in the mount point are escaped as \040
+            points.append(fields[1].replace("\\040", " "))
+    return tuple(sorted(points, key=len, reverse=True))
+
+
+def is_network_path(path: str) -> bool:
+    for point in network_mounts():
+        if path == point or path.startswith(point.rstrip("/") + "/"):
+            return True
+    return False
+
+
+def token_directory(prefix: str) -> tp.Optional[str]:
+    """The directory the paths starting with ``prefix`` are in,
+    ``None`` if ``prefix`` does not look like a path."""
+    prefix = prefix.lstrip("'\"")
+    if os.sep not in prefix:
+        return None
+    directory = os.path.dirname(os.path.expanduser(prefix))
+    cwd = XSH.env.get("PWD") or os.getcwd()
+    return os.path.normpath(os.path.join(cwd, directory))
+
+
+def _unquote(completion: str) -> str:
+    if completion[:2] in ("r'", 'r"', "R'", 'R"'):
+        completion = completion[1:]
+    return completion.strip("'\"")
+
+
+# the modification time of a directory that does not exist
+MISSING = -1
+
+
+class Listing(tp.NamedTuple):
+    mtime: int
+    # when the modification time was read
+    checked: float
+    # names of the entries, and whether they are directories
+    entries: tp.Tuple[tp.Tuple[str, bool], ...] = ()
+
+
+class DirectoryListings:
+    """Modification times and listings of directories, shared between threads.
+
+    Parameters
+    ----------
+    ttl
+        seconds the modification time of a directory on a network filesystem
+        is trusted, defaults to ``$COMPLETION_PATH_CACHE_TTL``
+    maxsize
+        number of directories kept
+    """
+
+    def __init__(self, ttl: tp.Optional[float] = None, maxsize=512):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._listings: tp.Dict[str, Listing] = {}
+        self._lock = threading.Lock()
+        self._pending: tp.Set[str] = set()
+
+    def _get_ttl(self) -> float:
+        if self.ttl is not None:
+            return self.ttl
+        return _get_ttl()
+
+    def _store(self, path: str, listing: Listing):
+        with self._lock:
+            if len(self._listings) >= self.maxsize and path not in self._listings:
+                self._listings.clear()
+            self._listings[path] = listing
+
+    def stamp(self, path: str) -> tp.Optional[int]:
+        """The modification time of the directory, ``None`` if it is not known.
+
+        Directories on network filesystems are not read here, since that may
+        stall the prompt. ``prefetch`` reads them in the background.
+        """
+        listing = self._listings.get(path)
+        if is_network_path(path):
+            age = time.monotonic() - listing.checked if listing else None
+            if age is not None and age < self._get_ttl() and listing.mtime != MISSING:
+                return listing.mtime
+            return None
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            if listing is None or listing.mtime != MISSING:
+                self._store(path, Listing(MISSING, time.monotonic()))
+            return None
+        if listing is None or listing.mtime != mtime:
+            self._store(path, Listing(mtime, time.monotonic()))
+        return mtime
+
+    def entries(self, path: str) -> tp.Tuple[tp.Tuple[str, bool], ...]:
+        """List the directory, unless it did not change since it was listed."""
+        listing = self._listings.get(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if listing is not None and listing.entries and listing.mtime == mtime:
+                entries = listing.entries
+            else:
+                with os.scandir(path) as it:
+                    entries = tuple((entry.name, entry.is_dir()) for entry in it)
+        except OSError:
+            self._store(path, Listing(MISSING, time.monotonic()))
+            return ()
+        self._store(path, Listing(mtime, time.monotonic(), entries))
+        return entries
+
+    def is_missing(self, path: str) -> bool:
+        """Whether the directory was found missing within the ttl."""
+        listing = self._listings.get(path)
+        return (
+            listing is not None
+            and listing.mtime == MISSING
+            and time.monotonic() - listing.checked < self._get_ttl()
+        )
+
+    def list_later(self, path: str):
+        """List the directory in the background, unless it was listed since it
+        last changed."""
+        listing = self._listings.get(path)
+        if listing is None or not listing.entries:
+            self._start(self.entries, path)
+
+    def lists(
+        self, directory: str, prefix: str, completions: tp.Iterable, stamp: int
+    ) -> bool:
+        """Whether the ``completions`` of the path ``prefix`` are the entries of
+        its ``directory`` starting with its last part, like the path completer
+        generates them. Other completers, e.g. of the changed files of a
+        repository, may depend on more than the directory.
+
+        The directory is not read here. It is only checked if it was listed
+        (see ``list_later``) while its modification time was ``stamp``.
+        """
+        listing = self._listings.get(directory)
+        if listing is None or listing.mtime != stamp or not listing.entries:
+            return False
+        entries = listing.entries
+        fold = (
+            str if XSH.env.get("CASE_SENSITIVE_COMPLETIONS", True) else str.casefold
+        )
+        typed = fold(os.path.basename(prefix.lstrip("'\"")))
+        names = {fold(name) for name, _ in entries}
+        expected = {
+            name
+            for name in names
+            if name.startswith(typed) and (typed[:1] == "." or name[:1] != ".")
+        }
+        completed = set()
+        for completion in completions:
+            path = _unquote(str(completion)).rstrip(os.sep)
+            name = os.path.basename(path)
+            if name not in (".", ".."):
+                completed.add(fold(name))
+        return bool(completed) and completed == expected
+
+    def _start(self, target: tp.Callable, path: str, *args):
+        with self._lock:
+            if path in self._pending:
+                return
+            self._pending.add(path)
+
+        def run():
+            try:
+                target(path, *args)
+            finally:
+                with self._lock:
+                    self._pending.discard(path)
+
+        threading.Thread(target=run, name="xonsh-prefetch", daemon=True).start()
+
+    def prefetch(self, directory: str, name: str = "", limit=16):
+        """List the ``directory`` in the background. Then list its parent and
+        up to ``limit`` of its subdirectories starting with ``name`` in
+        parallel, since they are likely completed next."""
+        if self.is_missing(directory):
+            return
+        self._start(self._prefetch, directory, name, limit)
+
+    def _prefetch(self, directory: str, name: str, limit: int):
+        paths = []
+        parent = os.path.dirname(directory.rstrip(os.sep))
+        if parent and parent != directory:
+            paths.append(parent)
+        subdirs = (
+            os.path.join(directory, entry)
+            for entry, is_dir in self.entries(directory)
+            if is_dir and entry.startswith(name)
+        )
+        paths.extend(itertools.islice(subdirs, limit))
+        for path in paths:
+            self._start(self.entries, path)
@@ -6,10 +6,8 @@ from functools import wraps
 from types import MethodType
 
 from prompt_toolkit import ANSI
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 from prompt_toolkit.enums import EditingMode
 from prompt_toolkit.formatted_text import PygmentsTokens, to_formatted_text
-from prompt_toolkit.history import ThreadedHistory
 from prompt_toolkit.key_binding.bindings.emacs import (
     load_emacs_shift_selection_bindings,
 )
@@ -30,10 +28,19 @@ from xonsh.shell import transform_command
 from xonsh.style_tools import DEFAULT_STYLE_DICT, _TokenType, partial_color_tokenize
 from xonsh.tools import carriage_return, print_exception, print_warning
 
+from .async_completer import AsyncCompleter
 from .completer import PromptToolkitCompleter
 from .formatter import PTKPromptFormatter
-from .history import PromptToolkitHistory, _cust_history_matches
+from .history import (
+    ChunkedThreadedHistory,
+    PromptToolkitHistory,
+    _cust_history_backward,
+    _cust_history_forward,
+    _cust_history_load,
+    _cust_history_matches,
+)
 from .key_bindings import load_xonsh_bindings
+from .menu_space import MenuSpace
 
 try:
     from prompt_toolkit.clipboard import DummyClipboard
@@ -177,7 +184,11 @@ class PromptToolkitShell(BaseShell):
         if ON_WINDOWS:
             winutils.enable_virtual_terminal_processing()
         self._first_prompt = True
-        self.history = ThreadedHistory(PromptToolkitHistory())
+        self.history = ChunkedThreadedHistory(
+            PromptToolkitHistory(),
+            first_chunk=XSH.env.get("PTK_HISTORY_FIRST_CHUNK"),
+            chunk_size=XSH.env.get("PTK_HISTORY_CHUNK_SIZE"),
+        )
         self.push = self._push
 
         ptk_args.setdefault("history", self.history)
@@ -187,14 +198,26 @@ class PromptToolkitShell(BaseShell):
             ptk_args.setdefault("clipboard", PyperclipClipboard())
         self.prompter: PromptSession = PromptSession(**ptk_args)
 
+        self.menu_space = MenuSpace(self.prompter)
+        self.menu_space.install()
         self.prompt_formatter = PTKPromptFormatter(self)
         self.pt_completer = PromptToolkitCompleter(self.completer, self.ctx, self)
+        self.pt_completer.max_completions = (
+            self.prompter.default_buffer.max_number_of_completions
+        )
+        self.async_completer = AsyncCompleter(self.pt_completer)
         ptk_bindings = self.prompter.app.key_bindings
         self.key_bindings = load_xonsh_bindings(ptk_bindings)
         self._overrides_deprecation_warning_shown = False
 
         # Store original `_history_matches` in case we need to restore it
         self._history_matches_orig = self.prompter.default_buffer._history_matches
+        # view the history strings instead of copying them into the buffer
+        buffer = self.prompter.default_buffer
+        if hasattr(buffer, "_load_history_task") and hasattr(buffer, "_working_lines"):
+            buffer.load_history_if_not_yet_loaded = MethodType(
+                _cust_history_load, buffer
+            )
         # This assumes that PromptToolkitShell is a singleton
         events.on_ptk_create.fire(
             prompter=self.prompter,
@@ -298,11 +321,16 @@ class PromptToolkitShell(BaseShell):
         if HAS_PYGMENTS:
             self.styler.style_name = env.get("XONSH_COLOR_STYLE")
         completer = None if completions_display == "none" else self.pt_completer
+        if completer is not None and complete_in_thread:
+            # streams the completions from a thread by itself
+            completer = self.async_completer
+            complete_in_thread = False
 
         events.on_timingprobe.fire(name="on_pre_prompt_tokenize")
 
         # clear prompt level cache
         env["PROMPT_FIELDS"].reset()
+        self.pt_completer.reset()
 
         get_bottom_toolbar_tokens = self.bottom_toolbar_tokens
         if env.get("UPDATE_PROMPT_ON_KEYPRESS"):
@@ -320,15 +348,16 @@ class PromptToolkitShell(BaseShell):
         else:
             editing_mode = EditingMode.EMACS
 
+        buffer = self.prompter.default_buffer
         if env.get("XONSH_HISTORY_MATCH_ANYWHERE"):
-            self.prompter.default_buffer._history_matches = MethodType(
-                _cust_history_matches, self.prompter.default_buffer
-            )
-        elif (
-            self.prompter.default_buffer._history_matches
-            is not self._history_matches_orig
-        ):
-            self.prompter.default_buffer._history_matches = self._history_matches_orig
+            buffer._history_matches = MethodType(_cust_history_matches, buffer)
+            buffer.history_backward = MethodType(_cust_history_backward, buffer)
+            buffer.history_forward = MethodType(_cust_history_forward, buffer)
+        elif buffer._history_matches is not self._history_matches_orig:
+            buffer._history_matches = self._history_matches_orig
+            # fallback to the methods defined on the class
+            vars(buffer).pop("history_backward", None)
+            vars(buffer).pop("history_forward", None)
 
         menu_rows = env.get("COMPLETIONS_MENU_ROWS", None)
         if menu_rows:
@@ -393,7 +422,8 @@ class PromptToolkitShell(BaseShell):
         """Enters a loop that reads and execute input from user."""
         if intro:
             print(intro)
-        auto_suggest = AutoSuggestFromHistory()
+        # shared with the completer, which completes the same suggestion
+        auto_suggest = self.pt_completer.hist_suggester
         while not XSH.exit:
             try:
                 line = self.singleline(auto_suggest=auto_suggest)
@@ -1,8 +1,14 @@
-"""Has classes that help updating Prompt sections using Threads."""
+"""Has classes that help updating Prompt sections using Threads and coroutines."""
 
+import asyncio
 import concurrent.futures
+import functools
+import inspect
+import os
 import threading
+import time
 import typing as tp
+import weakref
 
 from prompt_toolkit import PromptSession
 from prompt_toolkit.formatted_text import PygmentsTokens
@@ -11,45 +17,470 @@ from xonsh.prompt.base import ParsedTokens
 from xonsh.style_tools import partial_color_tokenize, style_as_faded
 
 
-class Executor:
-    """Caches thread results across prompts."""
+def git_index_mtime(path: str) -> tp.Optional[int]:
+    """Modification time of the index of the git repository at ``path``,
+    which changes with each commit, checkout, add, ...
+
+    Without an index, that of the git directory itself is returned.
+    """
+    while True:
+        dot_git = os.path.join(path, ".git")
+        if os.path.exists(dot_git):
+            git_dir = dot_git
+            if os.path.isfile(dot_git):
+                # worktrees and submodules point to their git directory
+                git_dir = resolve_gitdir(dot_git)
+            for stat_path in (os.path.join(git_dir, "index"), git_dir, dot_git):
+                try:
+                    return os.stat(stat_path).st_mtime_ns
+                except OSError:
+                    pass
+            return None
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def resolve_gitdir(git_file: str) -> str:
+    """The directory in the ``gitdir:`` line of a ``.git`` file, or the file
+    itself if it has none."""
+    try:
+        with open(git_file) as fp:
+            line = fp.readline()
+    except OSError:
+        return git_file
+    if not line.startswith("gitdir:"):
+        return git_file
+    git_dir = line[len("gitdir:") :].strip()
+    return os.path.join(os.path.dirname(git_file), git_dir)
+
+
+def last_command() -> tp.Optional[tp.Tuple[int, tp.Any]]:
+    """Number of commands run, and the return code of the last one."""
+    hist = XSH.history
+    try:
+        return len(hist), getattr(hist, "last_cmd_rtn", None)
+    except TypeError:
+        return None
+
+
+# what a cached value of a field may depend on
+INVALIDATION_KEYS: tp.Dict[str, tp.Callable[[], tp.Any]] = {
+    "cwd": lambda: XSH.env.get("PWD"),
+    "git_index": lambda: git_index_mtime(XSH.env.get("PWD") or os.getcwd()),
+    "command": last_command,
+}
+DEFAULT_KEYS = ("cwd", "command")
+
+
+class CachedField(tp.NamedTuple):
+    value: tp.Any
+    # shown until it is evaluated again
+    faded: tp.Any
+    # when it started to be evaluated, and the invalidation keys then
+    started: float
+    keys: tp.Tuple
+
+
+class FieldCache:
+    """The last values of the fields, kept across prompts.
+
+    A value is fresh for ``$ASYNC_PROMPT_CACHE_TTL[field]`` seconds, unless
+    one of the invalidation keys in ``$ASYNC_PROMPT_CACHE_KEYS[field]``
+    changed. Fresh values are used without evaluating the field again.
+    Others are shown faded, until the field is evaluated in the background.
+    """
 
     def __init__(self):
-        self.thread_pool = concurrent.futures.ThreadPoolExecutor(
-            max_workers=XSH.env["ASYNC_PROMPT_THREAD_WORKERS"]
+        self._fields: tp.Dict[str, CachedField] = {}
+
+    @staticmethod
+    def ttl(field: str) -> float:
+        return (XSH.env.get("ASYNC_PROMPT_CACHE_TTL") or {}).get(field, 0)
+
+    @staticmethod
+    def keys(field: str) -> tp.Tuple:
+        """The current values of the invalidation keys of the field."""
+        names = (XSH.env.get("ASYNC_PROMPT_CACHE_KEYS") or {}).get(field, DEFAULT_KEYS)
+        return tuple(
+            INVALIDATION_KEYS[name]() for name in names if name in INVALIDATION_KEYS
         )
 
-        # the attribute, .cache is cleared between calls.
-        # This caches results from callback alone by field name.
-        self.thread_results = {}
+    def get(self, field: str) -> tp.Optional[CachedField]:
+        return self._fields.get(field)
+
+    def fresh(self, field: str, keys: tp.Tuple) -> tp.Optional[CachedField]:
+        """The value of the field, if it is still valid."""
+        ttl = self.ttl(field)
+        cached = self._fields.get(field)
+        if (
+            ttl
+            and cached is not None
+            and cached.keys == keys
+            and time.monotonic() - cached.started < ttl
+        ):
+            return cached
+        return None
 
-    def submit(self, func: tp.Callable, field: str):
-        future = self.thread_pool.submit(self._run_func, func, field)
-        place_holder = "{" + field + "}"
+    def put(self, field: str, value, started: float, keys: tp.Tuple):
+        faded = value if value is None else style_as_faded(value)
+        self._fields[field] = CachedField(value, faded, started, keys)
+
+
+class CircuitBreaker:
+    """Stops evaluating the fields that keep timing out.
+
+    After ``$ASYNC_PROMPT_BREAKER_THRESHOLD`` timeouts in a row, a field is
+    not evaluated for ``$ASYNC_PROMPT_BREAKER_COOLDOWN`` seconds. Then it is
+    tried once more, and skipped again if it still times out.
+    """
+
+    def __init__(self, clock: tp.Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._timeouts: tp.Dict[str, int] = {}
+        self._open_until: tp.Dict[str, float] = {}
+
+    @staticmethod
+    def threshold() -> int:
+        return max(XSH.env.get("ASYNC_PROMPT_BREAKER_THRESHOLD", 3), 1)
+
+    def is_open(self, field: str) -> bool:
+        """Whether the field should not be evaluated now."""
+        until = self._open_until.get(field)
+        if until is None:
+            return False
+        if self.clock() < until:
+            return True
+        del self._open_until[field]
+        # one more timeout opens it again
+        self._timeouts[field] = self.threshold() - 1
+        return False
+
+    def timed_out(self, field: str):
+        count = self._timeouts.get(field, 0) + 1
+        self._timeouts[field] = count
+        if count >= self.threshold():
+            cooldown = XSH.env.get("ASYNC_PROMPT_BREAKER_COOLDOWN", 60.0)
+            self._open_until[field] = self.clock() + cooldown
+
+    def succeeded(self, field: str):
+        self._timeouts.pop(field, None)
+
+
+def is_coroutine_function(func: tp.Callable) -> bool:
+    return inspect.iscoroutinefunction(getattr(func, "func", func))
+
+
+class CoroutineJob:
+    """A coroutine field, run once on the event loop for all the prompts
+    showing it. It is cancelled once none of them waits for it."""
 
-        return (
-            future,
-            (
-                self.thread_results[field]
-                if field in self.thread_results
-                else place_holder
-            ),
-            place_holder,
+    def __init__(self, func: tp.Callable[[], tp.Awaitable]):
+        self.func = func
+        self.task: tp.Optional[asyncio.Future] = None
+        self._waiting = 0
+
+    def start(self) -> asyncio.Future:
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.func())
+        self._waiting += 1
+        return self.task
+
+    def release(self):
+        self._waiting -= 1
+        if self._waiting <= 0 and self.task is not None:
+            self.task.cancel()
+
+
+# evaluates a field, either running in a thread or on the event loop
+Job = tp.Union[concurrent.futures.Future, CoroutineJob]
+
+
+class Deadline:
+    """When a field running in a thread is due, counted from its start, so
+    that the time it is queued behind the other fields does not count."""
+
+    __slots__ = ("field", "timeout", "since")
+
+    def __init__(self, field: str, timeout: float):
+        self.field = field
+        self.timeout = timeout
+        # set by the thread once it runs
+        self.since: tp.Optional[float] = None
+
+    def remaining(self) -> float:
+        if self.since is None:
+            return self.timeout
+        return self.since + self.timeout - time.monotonic()
+
+    def passed(self) -> bool:
+        return self.since is not None and self.remaining() <= 0
+
+
+class Executor:
+    """Caches thread results across prompts."""
+
+    def __init__(self):
+        self.thread_pool = self._create_pool()
+
+        # the prompt fields' cache is cleared between prompts.
+        # This keeps the results from callback alone by field name.
+        self.cache = FieldCache()
+        # the fields submitted for the current prompt, shared by its sections
+        self.jobs: tp.Dict[str, tp.Tuple[Job, tp.Any, str]] = {}
+        self.breaker = CircuitBreaker()
+        # the call run by each thread, and its deadline
+        self._calls: tp.MutableMapping[
+            concurrent.futures.Future, tp.Tuple[tp.Callable, tp.Optional[Deadline]]
+        ] = weakref.WeakKeyDictionary()
+        # the queued calls moved to a new pool
+        self._moved: tp.MutableMapping[
+            concurrent.futures.Future, concurrent.futures.Future
+        ] = weakref.WeakKeyDictionary()
+        # the threads still running after their deadline, by field
+        self._hung: tp.Dict[str, concurrent.futures.Future] = {}
+
+    @staticmethod
+    def _create_pool() -> concurrent.futures.ThreadPoolExecutor:
+        return concurrent.futures.ThreadPoolExecutor(
+            max_workers=XSH.env["ASYNC_PROMPT_THREAD_WORKERS"]
         )
 
-    def _run_func(self, func, field):
+    @staticmethod
+    def timeout(field: str) -> float:
+        """Seconds the field is waited for, 0 to wait forever."""
+        timeouts = XSH.env.get("ASYNC_PROMPT_FIELD_TIMEOUT") or {}
+        if field in timeouts:
+            return timeouts[field]
+        return XSH.env.get("ASYNC_PROMPT_TIMEOUT", 0)
+
+    @staticmethod
+    def fallback(field: str) -> str:
+        """The value shown for a field that timed out."""
+        return f"{{BACKGROUND_YELLOW}}{{TIMEOUT:{field}}}{{RESET}}"
+
+    def new_cycle(self):
+        """The fields submitted next are for a new prompt."""
+        self.jobs.clear()
+
+    def submit(
+        self, func: tp.Callable, field: str
+    ) -> tp.Tuple[tp.Optional[Job], tp.Any, str]:
+        """Evaluate the field in the background, unless its cached value is
+        fresh. Returns the job, which is ``None`` then, the value to show
+        meanwhile and the placeholder of the field.
+
+        A sync ``func`` is run in the thread pool right away. For a coroutine
+        function, the job is run on the event loop once the prompt starts.
+        A field is evaluated once per prompt, however often it is shown.
+        Fields that timed out too often, or are still running after their
+        deadline, are not evaluated and show the fallback value.
+        """
+        submitted = self.jobs.get(field)
+        if submitted is not None:
+            job, intermediate, place_holder = submitted
+            if isinstance(job, concurrent.futures.Future):
+                job = self._follow(job)
+            if isinstance(job, concurrent.futures.Future) and job.done():
+                if not job.cancelled() and job.exception() is None:
+                    return None, job.result(), place_holder
+            else:
+                return submitted
+        submitted = self._submit(func, field)
+        if submitted[0] is not None:
+            self.jobs[field] = submitted
+        return submitted
+
+    def _submit(self, func: tp.Callable, field: str):
+        place_holder = "{" + field + "}"
+        keys = self.cache.keys(field) if self.cache.ttl(field) else ()
+        fresh = self.cache.fresh(field, keys)
+        if fresh is not None:
+            return None, fresh.value, place_holder
+        if self._is_hung(field) or self.breaker.is_open(field):
+            return None, self.fallback(field), place_holder
+
+        cached = self.cache.get(field)
+        intermediate = place_holder if cached is None else cached.faded
+        started = time.monotonic()
+        timeout = self.timeout(field)
+        job: Job
+        if is_coroutine_function(func):
+            job = CoroutineJob(
+                functools.partial(
+                    self._run_coro, func, field, started, keys, timeout
+                )
+            )
+        else:
+            deadline = Deadline(field, timeout) if timeout else None
+            call = functools.partial(
+                self._run_func, func, field, started, keys, deadline
+            )
+            job = self._start(call, deadline)
+        return job, intermediate, place_holder
+
+    def _start(
+        self, call: tp.Callable, deadline: tp.Optional[Deadline]
+    ) -> concurrent.futures.Future:
+        future = self.thread_pool.submit(call)
+        self._calls[future] = (call, deadline)
+        return future
+
+    def _follow(self, future: concurrent.futures.Future) -> concurrent.futures.Future:
+        """The future of the call, after it was moved to another pool."""
+        while future in self._moved:
+            future = self._moved[future]
+        return future
+
+    def _is_hung(self, field: str) -> bool:
+        hung = self._hung.get(field)
+        if hung is not None and hung.done():
+            del self._hung[field]
+            hung = None
+        return hung is not None
+
+    def _run_func(self, func, field, started: float, keys: tp.Tuple, deadline=None):
         """Run the callback and store the result."""
+        if deadline is not None:
+            deadline.since = time.monotonic()
         result = func()
-        self.thread_results[field] = (
-            result if result is None else style_as_faded(result)
-        )
+        self.cache.put(field, result, started, keys)
+        if deadline is None or not deadline.passed():
+            self.breaker.succeeded(field)
+        return result
+
+    async def _run_coro(
+        self, func, field, started: float, keys: tp.Tuple, timeout: float = 0
+    ):
+        """Await the callback until its timeout and store the result."""
+        if not timeout:
+            result = await func()
+        else:
+            try:
+                result = await asyncio.wait_for(func(), timeout)
+            except asyncio.TimeoutError:
+                self.breaker.timed_out(field)
+                return self.fallback(field)
+            self.breaker.succeeded(field)
+        self.cache.put(field, result, started, keys)
         return result
 
+    async def wait(self, future: concurrent.futures.Future):
+        """Wait for a thread until its deadline. Then the fallback value of
+        its field is returned, and a new pool takes the place of the one with
+        the blocked worker."""
+        while True:
+            try:
+                return await self._wait(future)
+            except asyncio.CancelledError:
+                moved = self._moved.get(future)
+                if moved is None or not future.cancelled():
+                    raise
+                future = moved
+
+    async def _wait(self, future: concurrent.futures.Future):
+        # the thread keeps running when the prompt is done, to cache its result
+        wrapped = asyncio.wrap_future(future)
+        deadline = self._calls.get(future, (None, None))[1]
+        if deadline is None:
+            return await asyncio.shield(wrapped)
+        while True:
+            try:
+                return await asyncio.wait_for(
+                    asyncio.shield(wrapped), max(deadline.remaining(), 0)
+                )
+            except asyncio.TimeoutError:
+                if deadline.passed():
+                    return self._timed_out(deadline.field, future)
+                # still queued, or it started late
+
+    def _timed_out(self, field: str, future: concurrent.futures.Future) -> str:
+        # once for all the prompts showing the field
+        if not self._is_hung(field) and not future.done():
+            self.breaker.timed_out(field)
+            self._hung[field] = future
+            self._replace_pool()
+        return self.fallback(field)
+
+    def _replace_pool(self):
+        """Submit the fields to a new pool, since a worker of the current one
+        is blocked. The fields queued in the old pools are moved to it."""
+        old = self.thread_pool
+        self.thread_pool = self._create_pool()
+        for future, (call, deadline) in list(self._calls.items()):
+            # only possible while it is queued
+            if future.cancel():
+                self._moved[future] = self._start(call, deadline)
+        # its idle workers exit, the blocked one once its field returns
+        old.shutdown(wait=False)
+
+
+class InvalidateScheduler:
+    """Redraw the async prompts updated within ``$ASYNC_INVALIDATE_INTERVAL``
+    at once.
+
+    The redraw is scheduled on the event loop of the prompt, so that no thread
+    is started for it. Without a running loop, the prompts are redrawn
+    right away.
+    """
+
+    def __init__(self, session: PromptSession):
+        self.session = session
+        self.loop: tp.Optional[asyncio.AbstractEventLoop] = None
+        self._pending: tp.Dict[str, "AsyncPrompt"] = {}
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def attach(self, loop: tp.Optional[asyncio.AbstractEventLoop]):
+        """Schedule the redraws on the ``loop`` of a new prompt. The redraws
+        still pending for the previous prompt are dropped."""
+        with self._lock:
+            self.loop = loop
+            self._pending.clear()
+            self._scheduled = False
+
+    def request(self, prompt: "AsyncPrompt"):
+        """Redraw the ``prompt`` with the next redraw. Thread-safe."""
+        with self._lock:
+            self._pending[prompt.name] = prompt
+            if self._scheduled:
+                return
+            self._scheduled = True
+        try:
+            self.loop.call_soon_threadsafe(self._schedule)  # type: ignore
+        except (AttributeError, RuntimeError):
+            # no loop, or it is closed already
+            self.flush()
+
+    def _schedule(self):
+        self.loop.call_later(  # type: ignore
+            XSH.env.get("ASYNC_INVALIDATE_INTERVAL", 0.05), self.flush
+        )
+
+    def flush(self):
+        """Redraw the pending prompts."""
+        with self._lock:
+            prompts = list(self._pending.values())
+            self._pending.clear()
+            self._scheduled = False
+        if not prompts:
+            return
+        for prompt in prompts:
+            prompt.refresh()
+        self.session.app.invalidate()
+
 
 class AsyncPrompt:
     """Represent an asynchronous prompt."""
 
-    def __init__(self, name: str, session: PromptSession, executor: Executor):
+    def __init__(
+        self,
+        name: str,
+        session: PromptSession,
+        executor: Executor,
+        scheduler: tp.Optional[InvalidateScheduler] = None,
+    ):
         """
 
         Parameters
@@ -58,26 +489,34 @@ class AsyncPrompt:
             what prompt to update. One of ['message', 'rprompt', 'bottom_toolbar']
         session: PromptSession
             current ptk session
+        scheduler: InvalidateScheduler
+            groups the redraws of the prompts, by default it is redrawn on
+            each update
         """
 
         self.name = name
 
         # list of tokens in that prompt. It could either be resolved or not resolved.
         self.tokens: tp.Optional[ParsedTokens] = None
-        self.timer = None
         self.session = session
         self.executor = executor
+        self.scheduler = scheduler
 
         # (Key: the future object) that is created for the (value: index/field_name) in the tokens list
+        # a field may be shown more than once in the prompt
         self.futures: tp.Dict[
-            concurrent.futures.Future,
-            tp.Tuple[str, tp.Optional[int], tp.Optional[str], tp.Optional[str]],
+            Job,
+            tp.List[
+                tp.Tuple[str, tp.Optional[int], tp.Optional[str], tp.Optional[str]]
+            ],
         ] = {}
 
-    def start_update(self, on_complete):
+    async def start_update(self, on_complete):
         """Listen on futures and update the prompt as each one completed.
 
-        Timer is used to avoid clogging multiple calls at the same time.
+        The coroutine fields are run on the event loop, and cancelled along
+        with this. The other fields are already running in threads. The
+        fields are waited for until their deadline, see ``Executor.timeout``.
 
         Parameters
         -----------
@@ -87,57 +526,79 @@ class AsyncPrompt:
         if not self.tokens:
             print(f"Warn: AsyncPrompt is created without tokens - {self.name}")
             return
-        for fut in concurrent.futures.as_completed(self.futures):
-            try:
-                val = fut.result()
-            except concurrent.futures.CancelledError:
-                continue
+        waiting: tp.Dict[asyncio.Future, Job] = {}
+        started: tp.List[CoroutineJob] = []
+        for job in list(self.futures):
+            if isinstance(job, concurrent.futures.Future):
+                waiting[asyncio.ensure_future(self.executor.wait(job))] = job
+            else:
+                waiting[job.start()] = job
+                started.append(job)
+        try:
+            while waiting:
+                done, _ = await asyncio.wait(
+                    waiting, return_when=asyncio.FIRST_COMPLETED
+                )
+                for fut in done:
+                    self._update(waiting.pop(fut), fut)
+        finally:
+            # the results of the threads are still cached for the next prompt
+            for fut, job in waiting.items():
+                if isinstance(job, concurrent.futures.Future):
+                    fut.cancel()
+            for job in started:
+                job.release()
 
-            if fut not in self.futures:
-                # rare case where the future is completed but the container is already cleared
-                # because new prompt is called
-                continue
+        on_complete(self.name)
 
-            placeholder, idx, spec, conv = self.futures[fut]
-            # example: placeholder="{field}", idx=10, spec="env: {}"
+    def _update(self, job: Job, fut: asyncio.Future):
+        try:
+            val = fut.result()
+        except asyncio.CancelledError:
+            return
+
+        if job not in self.futures:
+            # rare case where the future is completed but the container is already cleared
+            # because new prompt is called
+            return
 
+        for placeholder, idx, spec, conv in self.futures[job]:
+            # example: placeholder="{field}", idx=10, spec="env: {}"
             if isinstance(idx, int):
                 self.tokens.update(idx, val, spec, conv)
             else:  # when the function is called outside shell.
                 for idx, ptok in enumerate(self.tokens.tokens):
                     if placeholder in ptok.value:
-                        val = ptok.value.replace(placeholder, val)
-                        self.tokens.update(idx, val, spec, conv)
+                        value = ptok.value.replace(placeholder, val)
+                        self.tokens.update(idx, value, spec, conv)
 
-            # calling invalidate in less period is inefficient
-            self.invalidate()
-
-        on_complete(self.name)
+        # calling invalidate in less period is inefficient
+        self.invalidate()
 
     def invalidate(self):
-        """Create a timer to update the prompt. The timing can be configured through env variables.
-        threading.Timer is used to stop calling invalidate frequently.
-        """
-        from xonsh.ptk_shell.shell import tokenize_ansi
-
-        if self.timer:
-            self.timer.cancel()
-
-        def _invalidate():
-            new_prompt = self.tokens.process()
-            formatted_tokens = tokenize_ansi(
-                PygmentsTokens(partial_color_tokenize(new_prompt))
-            )
-            setattr(self.session, self.name, formatted_tokens)
+        """Request a redraw of the prompt from the scheduler, which groups
+        the calls within ``$ASYNC_INVALIDATE_INTERVAL``."""
+        if self.scheduler is None:
+            self.refresh()
             self.session.app.invalidate()
+        else:
+            self.scheduler.request(self)
 
-        self.timer = threading.Timer(XSH.env["ASYNC_INVALIDATE_INTERVAL"], _invalidate)
-        self.timer.start()
+    def refresh(self):
+        """Set the prompt of the session to the current tokens."""
+        from xontrib_ptk_shell.shell import tokenize_ansi
+
+        new_prompt = self.tokens.process()
+        formatted_tokens = tokenize_ansi(
+            PygmentsTokens(partial_color_tokenize(new_prompt))
+        )
+        setattr(self.session, self.name, formatted_tokens)
 
     def stop(self):
         """Stop any running threads"""
-        for fut in self.futures:
-            fut.cancel()
+        for job in self.futures:
+            if isinstance(job, concurrent.futures.Future):
+                job.cancel()
         self.futures.clear()
 
     def submit_section(
@@ -149,7 +610,8 @@ class AsyncPrompt:
         conv=None,
     ):
         future, intermediate_value, placeholder = self.executor.submit(func, field)
-        self.futures[future] = (placeholder, idx, spec, conv)
+        if future is not None:
+            self.futures.setdefault(future, []).append((placeholder, idx, spec, conv))
         return intermediate_value
 
 
@@ -162,6 +624,7 @@ class PromptUpdator:
         self.prompts: tp.Dict[str, AsyncPrompt] = {}
         self.shell: PromptToolkitShell = shell
         self.executor = Executor()
+        self.scheduler = InvalidateScheduler(shell.prompter)
         self.futures = {}
         self.attrs_loaded = None
 
@@ -173,7 +636,7 @@ class PromptUpdator:
         self.stop(prompt_name)
 
         self.prompts[prompt_name] = AsyncPrompt(
-            prompt_name, self.shell.prompter, self.executor
+            prompt_name, self.shell.prompter, self.executor, self.scheduler
         )
         return self.prompts[prompt_name]
 
@@ -184,24 +647,32 @@ class PromptUpdator:
 
     def start(self):
         """after ptk prompt is created, update it in background."""
+        try:
+            # called by the prompt before it runs, within its event loop
+            self.scheduler.attach(asyncio.get_running_loop())
+        except RuntimeError:
+            self.scheduler.attach(None)
         if not self.attrs_loaded:
             self.attrs_loaded = self.executor.thread_pool.submit(self.add_attrs)
 
         prompts = list(self.prompts)  # removal safe
         for pt_name in prompts:
-            if pt_name not in self.prompts:
+            # those of the previous prompts were cancelled with it
+            if pt_name not in self.prompts or pt_name in self.futures:
                 continue
             prompt = self.prompts[pt_name]
-            future = self.executor.thread_pool.submit(
-                prompt.start_update, self.on_complete
+            # cancelled once the prompt is done
+            task = self.shell.prompter.app.create_background_task(
+                prompt.start_update(self.on_complete)
             )
-            self.futures[pt_name] = future
+            self.futures[pt_name] = task
+        self.executor.new_cycle()
 
     def stop(self, prompt_name: str):
         if prompt_name in self.prompts:
-            self.prompts[prompt_name].stop()
+            self.prompts.pop(prompt_name).stop()
         if prompt_name in self.futures:
-            self.futures[prompt_name].cancel()
+            self.futures.pop(prompt_name).cancel()
 
     def on_complete(self, prompt_name):
         self.prompts.pop(prompt_name, None)